@@ -1,129 +1,167 @@
 import gradio as gr
-import base64
+import asyncio
 import os
-import requests
-import json
-import fitz
-from PIL import Image
-import io
+import time
+import backend
+import history_io
+import image_prep
+import ingest
+import metrics
+import model_manager
+import pdf_pipeline
+import profiling
+import upload_store
+import streaming
 from settings_mgr import generate_download_settings_js, generate_upload_settings_js
 
-from doc2json import process_docx
+import prompt_builder
+import response_cache
+import scheduler
+import singleflight
+from image_prep import ImageCache
+from prompt_builder import AttachmentCache, SessionStore
 
 dump_controls = False
 log_to_console = False
 
-temp_files = []
-
-def encode_image(image_data):
-    """Generates a prefix for image base64 data in the required format for the
-    four known image formats: png, jpeg, gif, and webp.
+def encode_image(image_data, model=None):
+    """Encodes image data as a data URL, downscaled and re-encoded as image_prep
+    configures for the model. Supports png, jpeg, gif, and webp.
 
     Args:
-    image_data: The image data, encoded in base64.
+    image_data: The image file contents.
+    model: The model the image is for, selects the maximum size.
 
     Returns:
-    A string containing the prefix.
+    A string containing the data URL.
     """
+    return image_prep.prepare(image_data, image_prep.max_side_for(model))
 
-    # Get the first few bytes of the image data.
-    magic_number = image_data[:4]
-  
-    # Check the magic number to determine the image type.
-    if magic_number.startswith(b'\x89PNG'):
-        image_type = 'png'
-    elif magic_number.startswith(b'\xFF\xD8'):
-        image_type = 'jpeg'
-    elif magic_number.startswith(b'GIF89a'):
-        image_type = 'gif'
-    elif magic_number.startswith(b'RIFF'):
-        if image_data[8:12] == b'WEBP':
-            image_type = 'webp'
-        else:
-            # Unknown image type.
-            raise Exception("Unknown image type")
-    else:
-        # Unknown image type.
-        raise Exception("Unknown image type")
-
-    return f"data:image/{image_type};base64,{base64.b64encode(image_data).decode('utf-8')}"
-
-def process_pdf_img(pdf_fn: str):
-    pdf = fitz.open(pdf_fn)
-    message_parts = []
-
-    for page in pdf.pages():
-        # Create a transformation matrix for rendering at the calculated scale
-        mat = fitz.Matrix(0.6, 0.6)
-        
-        # Render the page to a pixmap
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        
-        # Convert pixmap to PIL Image
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        
-        # Convert PIL Image to bytes
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        # Encode image to base64
-        base64_encoded = base64.b64encode(img_byte_arr).decode('utf-8')
-        
-        # Construct the data URL
-        image_url = f"data:image/png;base64,{base64_encoded}"
-        
-        # Append the message part
-        message_parts.append({
+def iter_pdf_parts(pdf_fn: str, pages=None, text_layer=True, render=True):
+    """Yields the message parts of a PDF page by page: the text layer of pages
+    that have one, an image of the others.
+
+    Args:
+    pdf_fn: The PDF file.
+    pages: Page range such as "1-5,8", None for pdf_pipeline.default_pages.
+    text_layer: False to send every page as an image.
+    render: False to note pages without a text layer instead of rendering them.
+    """
+    # the name rather than the upload's temporary path, so the parts are the same for every upload of the file
+    name = os.path.basename(pdf_fn)
+    for page in pdf_pipeline.iter_pdf(pdf_fn, pages=pages, text_layer=text_layer, render=render):
+        if "text" in page:
+            yield {
+                "type": "text",
+                "text": f"Page {page['page']} of file '{name}':\n{page['text']}"
+            }
+            continue
+        if "omitted" in page:
+            yield {
+                "type": "text",
+                "text": f"Page {page['page']} of file '{name}': {page['omitted']}"
+            }
+            continue
+
+        yield {
             "type": "text",
-            "text": f"Page {page.number} of file '{pdf_fn}'"
-        })
-        message_parts.append({
+            "text": f"Page {page['page']} of file '{name}'"
+        }
+        yield {
             "type": "image_url",
             "image_url": {
-                "url": image_url,
+                "url": page["image"],
                 "detail": "high"
             }
-        })
+        }
 
-    pdf.close()
+def process_pdf_img(pdf_fn: str, pages=None, text_layer=True, render=True):
+    """Converts a PDF to a list of text and image_url message parts, see iter_pdf_parts()."""
+    return list(iter_pdf_parts(pdf_fn, pages, text_layer, render))
 
-    return message_parts
-
-def encode_file(fn: str) -> list:
+def encode_file(fn: str, chars: ingest.CharBudget = None) -> dict:
+    start = time.perf_counter()
     user_msg_parts = {}
-    text_content = ""
-
-    # if fn.endswith(".docx"):
-    #     user_msg_parts.append({"type": "text", "text": process_docx(fn)})
-    # elif fn.endswith(".pdf"):
-    #     user_msg_parts.extend(process_pdf_img(fn))
-    if False:
-        pass
+    name = os.path.basename(fn)
+    size = os.path.getsize(fn)
+    metrics.attachment_bytes.observe(size)
+
+    # only the first bytes are read to tell the type; the rest is streamed up to ingest.max_file_bytes,
+    # and no further than what the request's budget has left
+    kind = ingest.sniff(fn)
+    limit = ingest.max_file_bytes
+    if chars is not None and kind in ("text", "docx", "pdf"):
+        limit = chars.reserve(min(limit, size) if kind == "text" else limit)
+    truncated = False
+    if kind == "docx":
+        # doc2json.default_mode (MLX_CHAT_DOCX_MODE) picks the representation, Markdown unless set
+        user_msg_parts["text"] = ingest.docx_text(fn, limit)
+        truncated = len(user_msg_parts["text"]) > limit
+    elif kind == "pdf":
+        text_parts = []
+        text_chars = 0
+        images = []
+        # pages without a text layer are only rendered if their images are sent
+        parts = iter_pdf_parts(fn, render=prompt_builder.send_images)
+        try:
+            for part in parts:
+                if part["type"] != "text":
+                    images.append(part["image_url"]["url"])
+                    continue
+                if text_chars + len(part["text"]) > limit:
+                    text_parts.append(ingest.marker(name, f"{text_chars} characters", "the document"))
+                    truncated = True
+                    break
+                text_parts.append(part["text"] + "\n")
+                text_chars += len(part["text"]) + 1
+        finally:
+            # stops rendering the remaining pages
+            parts.close()
+        user_msg_parts["text"] = "".join(text_parts)
+        # rendered pages without a text layer, at most pdf_pipeline.max_images of them
+        user_msg_parts["images"] = images
+    elif kind == "image":
+        # scaled and encoded per model when the prompt is built, see image_prep.ImageCache
+        user_msg_parts["text"] = ""
+        user_msg_parts["image_files"] = [fn]
+    elif kind == "binary":
+        user_msg_parts["text"] = f"[{name}: binary file of {size} bytes, not included]\n"
     else:
-        with open(fn, mode="rb") as f:
-            content = f.read()
+        # read_text() takes a limit of 0 for none
+        user_msg_parts["text"] = ingest.read_text(fn, limit) if limit or not size else ingest.marker(name, "0 bytes", f"{size} bytes")
+        truncated = size > limit
+
+    if chars is not None and kind in ("text", "docx", "pdf"):
+        chars.release(max(limit - len(user_msg_parts["text"]), 0))
+        if truncated and limit < ingest.max_file_bytes:
+            # cut by this request's budget, not the file's own cap: not to be reused as the file's encoding
+            user_msg_parts["partial"] = True
+    metrics.encode_file_seconds.observe(time.perf_counter() - start)
+    return user_msg_parts
 
-        isImage = False
-        if isinstance(content, bytes):
-            try:
-                # try to add as image
-                content = encode_image(content)
-                isImage = True
-            except:
-                # not an image, try text
-                text_content = text_content + content.decode('utf-8', 'replace')
-        else:
-            text_content = text_content + str(content)
+def encode_settings() -> list:
+    # everything besides the file itself that changes what encode_file() returns
+    import doc2json
 
-        if isImage:
-            pass
-            # user_msg_parts.append({"type": "image_url",
-            #                     "image_url":{"url": content}})
-        else:
-            user_msg_parts["text"] = text_content
+    return [doc2json.default_mode, ingest.max_file_bytes, pdf_pipeline.default_pages, pdf_pipeline.render_scale,
+            pdf_pipeline.image_format, pdf_pipeline.image_quality, pdf_pipeline.min_text_chars,
+            prompt_builder.send_images, pdf_pipeline.max_pages, pdf_pipeline.max_images, pdf_pipeline.max_image_bytes]
 
-    return user_msg_parts
+# uploads are kept and encoded once per content, see upload_store.py
+store = upload_store.get_store()
+attachments = AttachmentCache(encode_file, store=store, settings=encode_settings)
+images = ImageCache(store=store)
+sessions = SessionStore()
+
+def drop_session(request: gr.Request):
+    sessions.drop(request.session_hash)
+
+def model_choices():
+    return gr.update(choices=model_manager.get_manager().choices())
+
+def select_model(model):
+    # starts loading a model as soon as it is picked, while the user is still typing
+    model_manager.get_manager().record_selection(model)
 
 def undo(history):
     history.pop()
@@ -147,226 +185,241 @@ def process_values_js():
     }
     """
 
-def bot(message, history, system_prompt, temperature, max_tokens, model):
+def attachment_kinds(message) -> list:
+    """The types of a message's files, as ingest.sniff() tells them."""
+    kinds = []
+    for file in message.get('files') or ():
+        try:
+            kinds.append(ingest.sniff(file['path']))
+        except OSError:
+            kinds.append("missing")
+    return kinds
+
+async def bot(message, history, system_prompt, temperature, max_tokens, model, request: gr.Request = None):
+    # a sampled fraction of requests is profiled (MLX_CHAT_PROFILE); otherwise this check is all it costs
+    profile = profiling.begin(model) if profiling.sample_rate else None
+    prompt_chars = 0
+    outcome = "ok"
     try:
         if False:
             pass
         else:
+            start = time.perf_counter()
+            metrics.requests_total.inc(model=model)
+
             if log_to_console:
                 print(f"bot history: {str(history)}")
 
-            history_openai_format = []
-            user_msg_parts = ""
-            if system_prompt:
-                    user_msg_parts = system_prompt + "\n"
-            for human, assi in history:
-                if human is not None:
-                    if type(human) is tuple:
-                        fc = encode_file(human[0])
-                        if fc["text"]:
-                            user_msg_parts = user_msg_parts + fc["text"]
-                    else:
-                        user_msg_parts = user_msg_parts + human
-
-                if assi is not None:
-                    if user_msg_parts:
-                        history_openai_format.append({"role": "user", "content": user_msg_parts})
-                        user_msg_parts = ""
-
-                    history_openai_format.append({"role": "assistant", "content": assi})
-
-            if message['text']:
-                user_msg_parts = user_msg_parts + message['text']
-            if message['files']:
-                for file in message['files']:
-                    fc = encode_file(file['path'])
-                    if fc["text"]:
-                        user_msg_parts = user_msg_parts + fc["text"]
-            history_openai_format.append({"role": "user", "content": user_msg_parts})
-            user_msg_parts = []
+            pending = model_manager.get_manager().pending_load(model)
+            if pending is not None:
+                gr.Info(f"Waiting for {model} to finish loading")
+                # every chat waiting for the model shares the load: Stop in one of them must not cancel it
+                await asyncio.shield(asyncio.wrap_future(pending))
+
+            # file access would block the event loop shared by all sessions
+            prompt_state = sessions.get(request.session_hash if request else None)
+            data, fit = await asyncio.to_thread(prompt_builder.prepare_request, prompt_state, message, history, system_prompt,
+                                                temperature, max_tokens, model, attachments,
+                                                images=images if prompt_builder.send_images else None)
+            history_openai_format = data["messages"]
+            metrics.prompt_build_seconds.observe(time.perf_counter() - start)
+            if fit["trimmed_tokens"]:
+                metrics.prompt_trimmed_tokens.inc(fit["trimmed_tokens"])
+                gr.Info(f"Left out about {fit['trimmed_tokens']} tokens of earlier conversation to fit the context of {model}")
+
+            shared_prefix, prompt_chars = prompt_state.record_request(history_openai_format)
+            metrics.prompt_chars.observe(prompt_chars)
+            metrics.prompt_chars_total.inc(prompt_chars)
+            metrics.prompt_shared_prefix_chars.inc(shared_prefix)
 
             if log_to_console:
                 print(f"br_prompt: {str(history_openai_format)}")
-
-            url = "http://localhost:8000/v1/chat/completions"
-            headers = {"Content-Type": "application/json"}
-            data = {
-                "model": model,
-                "messages": history_openai_format,
-                "max_tokens": max_tokens,
-                "stream": True
-            }
-
-            response = requests.post(url, headers=headers, json=data, stream=True)
-
-            if response.status_code != 200:
-                gr.Error(f"Error: Received status code {response.status_code} {response.text}")
-                return
+                print(f"br_context: {str(fit)}")
+                print(f"br_prefix: {shared_prefix} of {prompt_chars} chars shared with previous request")
 
             full_content = ""
-
+            # waits for a slot under the per-model and per-backend caps; cache hits skip the queue
+            stream = scheduler.get_scheduler().stream(backend.stream_chat, request.session_hash if request else None,
+                                                      fit["prompt_tokens"] + int(max_tokens))
+            if singleflight.enabled:
+                # identical requests already streaming are joined rather than generated again
+                stream = singleflight.get_group().stream(stream)
+            if response_cache.enabled:
+                deltas = response_cache.cached_stream(data, stream)
+            else:
+                deltas = stream(data)
+            updates = streaming.coalesce(deltas, mode="full")
             try:
-                for line in response.iter_lines():
-                        if line:
-                            line = line.decode('utf-8')
-                            if line.startswith('data: '):
-                                event_data = line[6:]  # Remove 'data: ' prefix
-                                if event_data == '[DONE]':
-                                    break
-                                try:
-                                    chunk_data = json.loads(event_data)
-                                    content = chunk_data['choices'][0]['delta']['content']
-                                    full_content += content
-                                    yield full_content
-                                except json.JSONDecodeError:
-                                    gr.Error(f"Failed to decode JSON: {event_data}")
-                                except KeyError:
-                                    gr.Error(f"Unexpected data structure: {chunk_data}")
-
-            except requests.exceptions.RequestException as e:
-                gr.Error(f"An error occurred: {e}")
+                async for full_content in updates:
+                    if start is not None:
+                        metrics.ttft_seconds.observe(time.perf_counter() - start, model=model)
+                        start = None
+                    yield full_content
+            finally:
+                # also reached when Gradio cancels or closes this generator
+                await updates.aclose()
 
         if log_to_console:
             print(f"br_result: {str(full_content)}")
 
     except Exception as e:
+        outcome = type(e).__name__
         raise gr.Error(f"Error: {str(e)}")
+    finally:
+        if profile is not None:
+            profile.finish(prompt_chars=prompt_chars, attachments=attachment_kinds(message),
+                           history_turns=len(history), outcome=outcome)
 
-def import_history(history, file):
-    with open(file.name, mode="rb") as f:
-        content = f.read()
+def import_history(history, file, system_prompt=""):
+    # NDJSON (gzipped or not) is read turn by turn; the JSON formats from before are read whole
+    try:
+        history, system_prompt = history_io.read_history(file.name, system_prompt)
+    except ValueError as e:
+        raise gr.Error(f"Cannot import history: {e}")
+    finally:
+        os.remove(file.name)
+
+    return history, system_prompt  # Return system prompt value to be set in the UI
+
+def export_history(history, system_prompt):
+    # written on the server line by line, with each attachment embedded once
+    return gr.update(value=history_io.export_history(history, system_prompt), visible=True)
+
+def build_ui() -> gr.Blocks:
+    """Builds the chat UI. Kept out of module import, so tools and benchmarks can use
+    the chat functions without constructing it."""
+    with gr.Blocks(delete_cache=(86400, 86400)) as demo:
+        gr.Markdown("# MLX Chat (Nils' Version™️)")
+        with gr.Accordion("Startup"):
+            gr.Markdown("""Use of this interface permitted under the terms and conditions of the 
+                        [MIT license](https://github.com/ndurner/oai_chat/blob/main/LICENSE).
+                        Third party terms and conditions apply, particularly
+                        those of the LLM vendor and hosting provider (e.g. Hugging Face). This app and the AI models may make mistakes, so verify any outputs.""")
+
+            # offers the models loaded on the backends; a model entered by name is loaded when picked
+            model = gr.Dropdown(label="Model", value="meta-llama/Meta-Llama-3.1-8B-Instruct", allow_custom_value=True, elem_id="model",
+                                choices=model_manager.fallback_models)
+            model.focus(model_choices, None, model)
+            model.change(select_model, model, None)
+            system_prompt = gr.TextArea("You are a helpful yet diligent AI assistant. Answer faithfully and factually correct. Respond with 'I do not know' if uncertain.", label="System Prompt", lines=3, max_lines=250, elem_id="system_prompt")  
+            temp = gr.Slider(0, 2, label="Temperature", elem_id="temp", value=1)
+            max_tokens = gr.Slider(1, 16384, label="Max. Tokens", elem_id="max_tokens", value=800)
+            save_button = gr.Button("Save Settings")  
+            load_button = gr.Button("Load Settings")  
+            dl_settings_button = gr.Button("Download Settings")
+            ul_settings_button = gr.Button("Upload Settings")
+
+            load_button.click(load_settings, js="""  
+                () => {  
+                    let elems = ['#system_prompt textarea', '#temp input', '#max_tokens input', '#model'];
+                    elems.forEach(elem => {
+                        let item = document.querySelector(elem);
+                        let event = new InputEvent('input', { bubbles: true });
+                        item.value = localStorage.getItem(elem.split(" ")[0].slice(1)) || '';
+                        item.dispatchEvent(event);
+                    });
+                }  
+            """)
 
-        if isinstance(content, bytes):
-            content = content.decode('utf-8', 'replace')
-        else:
-            content = str(content)
-    os.remove(file.name)
+            save_button.click(save_settings, [system_prompt, temp, max_tokens, model], js="""  
+                (oai, sys, temp, ntok, model) => {  
+                    localStorage.setItem('system_prompt', sys);  
+                    localStorage.setItem('temp', document.querySelector('#temp input').value);  
+                    localStorage.setItem('max_tokens', document.querySelector('#max_tokens input').value);  
+                    localStorage.setItem('model', model);  
+                }  
+            """) 
+
+            control_ids = [
+                           ('system_prompt', '#system_prompt textarea'),
+                           ('temp', '#temp input'),
+                           ('max_tokens', '#max_tokens input'),
+                           ('model', '#model')]
+            controls = [system_prompt, temp, max_tokens, model]
+
+            dl_settings_button.click(None, controls, js=generate_download_settings_js("oai_chat_settings.bin", control_ids))
+            ul_settings_button.click(None, None, None, js=generate_upload_settings_js(control_ids))
+
+        chat = gr.ChatInterface(fn=bot, multimodal=True, additional_inputs=controls, retry_btn = None, autofocus = False)
+        chat.textbox.file_count = "multiple"
+        chatbot = chat.chatbot
+        chatbot.show_copy_button = True
+        chatbot.height = 350
+
+        if dump_controls:
+            with gr.Row():
+                dmp_btn = gr.Button("Dump")
+                txt_dmp = gr.Textbox("Dump")
+                dmp_btn.click(dump, inputs=[chatbot], outputs=[txt_dmp])
+
+        with gr.Accordion("Import/Export", open = False):
+            import_button = gr.UploadButton("History Import")
+            export_button = gr.Button("History Export")
+            export_file = gr.File(label="History File", visible=False)
+            export_button.click(export_history, [chatbot, system_prompt], export_file)
+            dl_button = gr.Button("File download")
+            dl_button.click(lambda: None, [chatbot], js="""
+                (chat_history) => {
+                    // Attempt to extract content enclosed in backticks with an optional filename
+                    const contentRegex = /```(\\S*\\.(\\S+))?\\n?([\\s\\S]*?)```/;
+                    const match = contentRegex.exec(chat_history[chat_history.length - 1][1]);
+                    if (match && match[3]) {
+                        // Extract the content and the file extension
+                        const content = match[3];
+                        const fileExtension = match[2] || 'txt'; // Default to .txt if extension is not found
+                        const filename = match[1] || `download.${fileExtension}`;
+                        // Create a Blob from the content
+                        const blob = new Blob([content], {type: `text/${fileExtension}`});
+                        // Create a download link for the Blob
+                        const url = URL.createObjectURL(blob);
+                        const a = document.createElement('a');
+                        a.href = url;
+                        // If the filename from the chat history doesn't have an extension, append the default
+                        a.download = filename.includes('.') ? filename : `${filename}.${fileExtension}`;
+                        document.body.appendChild(a);
+                        a.click();
+                        document.body.removeChild(a);
+                        URL.revokeObjectURL(url);
+                    } else {
+                        // Inform the user if the content is malformed or missing
+                        alert('Sorry, the file content could not be found or is in an unrecognized format.');
+                    }
+                }
+            """)
+            import_button.upload(import_history, inputs=[chatbot, import_button, system_prompt], outputs=[chatbot, system_prompt])
 
-    # Deserialize the JSON content
-    import_data = json.loads(content)
+        demo.load(model_choices, None, model)
 
-    # Check if 'history' key exists for backward compatibility
-    if 'history' in import_data:
-        history = import_data['history']
-        system_prompt.value = import_data.get('system_prompt', '')  # Set default if not present
-    else:
-        # Assume it's an old format with only history data
-        history = import_data
-
-    return history, system_prompt.value  # Return system prompt value to be set in the UI
-
-with gr.Blocks(delete_cache=(86400, 86400)) as demo:
-    gr.Markdown("# MLX Chat (Nils' Version™️)")
-    with gr.Accordion("Startup"):
-        gr.Markdown("""Use of this interface permitted under the terms and conditions of the 
-                    [MIT license](https://github.com/ndurner/oai_chat/blob/main/LICENSE).
-                    Third party terms and conditions apply, particularly
-                    those of the LLM vendor and hosting provider (e.g. Hugging Face). This app and the AI models may make mistakes, so verify any outputs.""")
-
-        model = gr.Dropdown(label="Model", value="meta-llama/Meta-Llama-3.1-8B-Instruct", allow_custom_value=True, elem_id="model",
-                            choices=["meta-llama/Meta-Llama-3.1-8B-Instruct", "google/gemma-2-9b-it"])
-        system_prompt = gr.TextArea("You are a helpful yet diligent AI assistant. Answer faithfully and factually correct. Respond with 'I do not know' if uncertain.", label="System Prompt", lines=3, max_lines=250, elem_id="system_prompt")  
-        temp = gr.Slider(0, 2, label="Temperature", elem_id="temp", value=1)
-        max_tokens = gr.Slider(1, 16384, label="Max. Tokens", elem_id="max_tokens", value=800)
-        save_button = gr.Button("Save Settings")  
-        load_button = gr.Button("Load Settings")  
-        dl_settings_button = gr.Button("Download Settings")
-        ul_settings_button = gr.Button("Upload Settings")
-
-        load_button.click(load_settings, js="""  
-            () => {  
-                let elems = ['#system_prompt textarea', '#temp input', '#max_tokens input', '#model'];
-                elems.forEach(elem => {
-                    let item = document.querySelector(elem);
-                    let event = new InputEvent('input', { bubbles: true });
-                    item.value = localStorage.getItem(elem.split(" ")[0].slice(1)) || '';
-                    item.dispatchEvent(event);
-                });
-            }  
-        """)
-
-        save_button.click(save_settings, [system_prompt, temp, max_tokens, model], js="""  
-            (oai, sys, temp, ntok, model) => {  
-                localStorage.setItem('system_prompt', sys);  
-                localStorage.setItem('temp', document.querySelector('#temp input').value);  
-                localStorage.setItem('max_tokens', document.querySelector('#max_tokens input').value);  
-                localStorage.setItem('model', model);  
-            }  
-        """) 
-
-        control_ids = [
-                       ('system_prompt', '#system_prompt textarea'),
-                       ('temp', '#temp input'),
-                       ('max_tokens', '#max_tokens input'),
-                       ('model', '#model')]
-        controls = [system_prompt, temp, max_tokens, model]
-
-        dl_settings_button.click(None, controls, js=generate_download_settings_js("oai_chat_settings.bin", control_ids))
-        ul_settings_button.click(None, None, None, js=generate_upload_settings_js(control_ids))
-
-    chat = gr.ChatInterface(fn=bot, multimodal=True, additional_inputs=controls, retry_btn = None, autofocus = False)
-    chat.textbox.file_count = "multiple"
-    chatbot = chat.chatbot
-    chatbot.show_copy_button = True
-    chatbot.height = 350
-
-    if dump_controls:
-        with gr.Row():
-            dmp_btn = gr.Button("Dump")
-            txt_dmp = gr.Textbox("Dump")
-            dmp_btn.click(dump, inputs=[chatbot], outputs=[txt_dmp])
-
-    with gr.Accordion("Import/Export", open = False):
-        import_button = gr.UploadButton("History Import")
-        export_button = gr.Button("History Export")
-        export_button.click(lambda: None, [chatbot, system_prompt], js="""
-            (chat_history, system_prompt) => {
-                const export_data = {
-                    history: chat_history,
-                    system_prompt: system_prompt
-                };
-                const history_json = JSON.stringify(export_data);
-                const blob = new Blob([history_json], {type: 'application/json'});
-                const url = URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = 'chat_history.json';
-                document.body.appendChild(a);
-                a.click();
-                document.body.removeChild(a);
-                URL.revokeObjectURL(url);
-            }
-            """)
-        dl_button = gr.Button("File download")
-        dl_button.click(lambda: None, [chatbot], js="""
-            (chat_history) => {
-                // Attempt to extract content enclosed in backticks with an optional filename
-                const contentRegex = /```(\\S*\\.(\\S+))?\\n?([\\s\\S]*?)```/;
-                const match = contentRegex.exec(chat_history[chat_history.length - 1][1]);
-                if (match && match[3]) {
-                    // Extract the content and the file extension
-                    const content = match[3];
-                    const fileExtension = match[2] || 'txt'; // Default to .txt if extension is not found
-                    const filename = match[1] || `download.${fileExtension}`;
-                    // Create a Blob from the content
-                    const blob = new Blob([content], {type: `text/${fileExtension}`});
-                    // Create a download link for the Blob
-                    const url = URL.createObjectURL(blob);
-                    const a = document.createElement('a');
-                    a.href = url;
-                    // If the filename from the chat history doesn't have an extension, append the default
-                    a.download = filename.includes('.') ? filename : `${filename}.${fileExtension}`;
-                    document.body.appendChild(a);
-                    a.click();
-                    document.body.removeChild(a);
-                    URL.revokeObjectURL(url);
-                } else {
-                    // Inform the user if the content is malformed or missing
-                    alert('Sorry, the file content could not be found or is in an unrecognized format.');
-                }
-            }
-        """)
-        import_button.upload(import_history, inputs=[chatbot, import_button], outputs=[chatbot, system_prompt])
+    demo.unload(drop_session)
+    return demo
+
+_demo = None
+
+def get_demo() -> gr.Blocks:
+    """Returns the chat UI, built on first use."""
+    global _demo
+
+    if _demo is None:
+        _demo = build_ui()
+    return _demo
+
+def __getattr__(name):
+    # `app.demo`, as Gradio's reload mode and the benchmarks look it up
+    if name == "demo":
+        return get_demo()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def launch(**kwargs):
+    """Starts serving the chat UI; kwargs are passed on to gr.Blocks.launch()."""
+    # Gradio's own limit (one event at a time by default) would serialize all chats; scheduler admits them instead
+    return get_demo().queue(default_concurrency_limit=None).launch(**kwargs)
+
+def main():
+    if metrics.enabled:
+        metrics.start_server()
+    # loads and warms up MLX_CHAT_PRELOAD_MODELS in the background while the UI comes up
+    model_manager.get_manager().preload()
+    launch()
 
-demo.unload(lambda: [os.remove(file) for file in temp_files])
-demo.queue().launch()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
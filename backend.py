@@ -0,0 +1,272 @@
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+import metrics
+
+# FastMLX (OpenAI-compatible) servers to spread requests over, comma-separated in FASTMLX_URLS
+backend_urls = [url.strip().rstrip("/") for url in
+                os.environ.get("FASTMLX_URLS", os.environ.get("FASTMLX_URL", "http://localhost:8000")).split(",")
+                if url.strip()]
+
+# Seconds between background health checks of each backend
+health_interval = 10.0
+health_timeout = 5.0
+
+# Connection pool sizing, shared by all chat sessions of this process
+max_connections = 512
+max_keepalive_connections = 64
+keepalive_expiry = 30.0
+connect_timeout = 10.0
+
+_client = None
+_client_loop = None
+_pool = None
+
+# Streams open per model; the model manager leaves a model loaded while it has any
+model_streams = {}
+
+class BackendError(Exception):
+    """Raised when the backend rejects a request or the connection fails."""
+    pass
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the pooled client of the running event loop, creating it on first use.
+
+    Connections are kept alive between turns and shared across sessions, so a
+    streaming request does not pay TCP setup and does not occupy a worker thread.
+    """
+    global _client, _client_loop
+
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections,
+                                keepalive_expiry=keepalive_expiry),
+            # generation may pause arbitrarily long between tokens, so no read timeout
+            timeout=httpx.Timeout(None, connect=connect_timeout))
+        _client_loop = loop
+
+    return _client
+
+async def aclose_client():
+    global _client, _client_loop
+
+    if _pool is not None:
+        _pool.stop_health_checks()
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+def parse_models(data) -> set:
+    """Extracts model names from a /v1/models response (FastMLX or OpenAI format)."""
+    if isinstance(data, dict):
+        data = data.get("models", data.get("data", []))
+    return {m.get("id") if isinstance(m, dict) else m for m in data or []}
+
+class Endpoint:
+    """One backend server and what is known about it."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.models = None      # loaded models, None until the first health check
+        self.inflight = 0
+        self.last_check = 0.0
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+class BackendPool:
+    """Routes requests over several backends.
+
+    A request goes to the healthy backend with the fewest requests in flight
+    among those that have the model loaded. Backends are checked in the
+    background through /v1/models, which also tells which models they hold.
+    """
+
+    def __init__(self, urls):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_task = None
+
+    def select(self, model: str) -> list:
+        """Returns the endpoints to try for a model, best first."""
+        def rank(endpoint):
+            return (not endpoint.healthy, not endpoint.serves(model), endpoint.inflight)
+        return sorted(self.endpoints, key=rank)
+
+    async def check(self, endpoint: Endpoint):
+        try:
+            response = await get_client().get(f"{endpoint.url}/v1/models", timeout=health_timeout)
+            response.raise_for_status()
+            endpoint.models = parse_models(response.json())
+            metrics.register_models(endpoint.models)
+            endpoint.healthy = True
+        except (httpx.HTTPError, ValueError):
+            endpoint.healthy = False
+        endpoint.last_check = time.monotonic()
+        metrics.backend_healthy.set(int(endpoint.healthy), backend=endpoint.url)
+
+    async def check_all(self):
+        await asyncio.gather(*[self.check(endpoint) for endpoint in self.endpoints])
+
+    async def _health_loop(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(health_interval)
+
+    def start_health_checks(self):
+        """Starts the background health checks on the running event loop, if not running yet."""
+        loop = asyncio.get_running_loop()
+        if self.health_task is None or self.health_task.done() or self.health_task.get_loop() is not loop:
+            self.health_task = loop.create_task(self._health_loop())
+
+    def stop_health_checks(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+
+def get_pool() -> BackendPool:
+    """Returns the pool for the configured backend_urls, rebuilding it when they change."""
+    global _pool
+
+    if _pool is None or [endpoint.url for endpoint in _pool.endpoints] != backend_urls:
+        if _pool is not None:
+            _pool.stop_health_checks()
+        _pool = BackendPool(backend_urls)
+    return _pool
+
+def parse_sse_line(line: str):
+    """Parses one line of an OpenAI-style SSE stream.
+
+    Returns:
+    The content delta as string, None for lines without content, or False
+    once the '[DONE]' marker has been reached.
+    """
+    if not line.startswith('data: '):
+        return None
+
+    event_data = line[6:]  # Remove 'data: ' prefix
+    if event_data == '[DONE]':
+        return False
+
+    try:
+        chunk_data = json.loads(event_data)
+        return chunk_data['choices'][0]['delta'].get('content')
+    except (json.JSONDecodeError, KeyError, IndexError, TypeError, AttributeError):
+        # keep-alives and unexpected chunks carry no text
+        return None
+
+def _retryable(status_code: int) -> bool:
+    # model not loaded there, or the server is overloaded or failing
+    return status_code in (404, 429) or status_code >= 500
+
+async def stream_chat(payload: dict, reserved: Endpoint = None, limit: int = None):
+    """Streams a chat completion from the backend, yielding content deltas.
+
+    Backends are tried in the order of BackendPool.select() until one accepts the
+    request; once content has been streamed, errors are no longer retried. A
+    stream that ends without the '[DONE]' marker raises BackendError after its content.
+
+    Args:
+    payload: The chat request.
+    reserved: A backend to try first, whose slot in Endpoint.inflight the
+        caller holds already, as the scheduler does.
+    limit: Streams per backend; other backends with as many in flight are
+        passed over. None for no limit.
+    """
+    payload = dict(payload, stream=True)
+    model = payload.get("model")
+    pool = get_pool()
+    pool.start_health_checks()
+
+    endpoints = pool.select(model)
+    if reserved is not None:
+        endpoints = [reserved] + [endpoint for endpoint in endpoints if endpoint is not reserved]
+
+    last_error = None
+    busy = False
+    for endpoint in endpoints:
+        held = endpoint is reserved
+        if not held and limit is not None and endpoint.inflight >= limit:
+            busy = True
+            continue
+        start = time.perf_counter()
+        if not held:
+            endpoint.inflight += 1
+        model_streams[model] = model_streams.get(model, 0) + 1
+        metrics.inflight_streams.inc()
+        first = None
+        try:
+            async with get_client().stream("POST", f"{endpoint.url}/v1/chat/completions", json=payload) as response:
+                metrics.upstream_connect_seconds.observe(time.perf_counter() - start)
+                metrics.upstream_responses.inc(status=response.status_code)
+                if response.status_code != 200:
+                    body = await response.aread()
+                    last_error = BackendError(f"Received status code {response.status_code} {body.decode('utf-8', 'replace')}")
+                    if _retryable(response.status_code):
+                        if response.status_code != 404:
+                            endpoint.healthy = False
+                        continue
+                    raise last_error
+
+                done = False
+                chunks = 0
+                try:
+                    async for line in response.aiter_lines():
+                        # read on past '[DONE]' up to the end of the body, or the
+                        # connection cannot go back into the keep-alive pool
+                        if done:
+                            continue
+                        content = parse_sse_line(line)
+                        if content is False:
+                            done = True
+                        elif content:
+                            chunks += 1
+                            if first is None:
+                                first = time.perf_counter()
+                            yield content
+                except (GeneratorExit, asyncio.CancelledError):
+                    # The reader stopped (stop button, closed tab). Leaving the
+                    # 'async with' closes the connection instead of returning it to
+                    # the pool, which makes the backend stop generating.
+                    if not done:
+                        metrics.streams_aborted.inc()
+                        metrics.aborted_stream_chunks.inc(chunks)
+                        metrics.aborted_token_budget.inc(max(int(payload.get("max_tokens") or 0) - chunks, 0))
+                    raise
+
+                if first is not None:
+                    elapsed = time.perf_counter() - first
+                    metrics.completion_chunks.inc(chunks)
+                    metrics.stream_seconds.observe(elapsed)
+                    if elapsed > 0:
+                        metrics.tokens_per_second.observe(chunks / elapsed)
+                if not done:
+                    # the backend ended the stream without '[DONE]': the completion is cut off, so
+                    # callers such as the response cache must not take it for a whole one
+                    metrics.upstream_truncated.inc()
+                    raise BackendError("The backend ended the stream before the completion was done")
+                return
+        except httpx.HTTPError as e:
+            metrics.upstream_errors.inc()
+            endpoint.healthy = False
+            error = BackendError(f"An error occurred: {e}")
+            if first is not None:
+                raise error from e
+            # a backend's refusal says more than another one being unreachable
+            last_error = last_error or error
+        finally:
+            if not held:
+                endpoint.inflight -= 1
+            model_streams[model] -= 1
+            metrics.inflight_streams.dec()
+
+    if last_error is None and busy:
+        raise BackendError("All backends are busy, please try again later")
+    raise last_error or BackendError("No backend configured")
@@ -0,0 +1,175 @@
+"""Runs prompts from a JSONL file through the backend, without the UI.
+
+Each input line is an object with a "prompt" and optionally an "id", "history"
+([[user, assistant], ...]), "system_prompt", "model", "max_tokens" and
+"temperature"; missing settings come from the command line. Prompts are
+formatted as the chat UI formats them and results are appended to the output
+JSONL as they finish; a line that cannot be run is recorded with its error
+like a failed request. Items already in the output without an error are
+skipped, so an interrupted run continues where it stopped.
+
+Usage: python batch.py prompts.jsonl results.jsonl --model M [--concurrency 4] [--backend URL,URL | --stub]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import backend
+import prompt_builder
+from metrics import percentiles
+from prompt_builder import PromptState
+
+def read_items(path: str):
+    """Yields the items of the input; a line that is not one yields an item run_item() records as failed."""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                item = {"invalid": f"Line {line_no} is not JSON: {e}"}
+            if isinstance(item, str):
+                item = {"prompt": item}
+            elif not isinstance(item, dict):
+                item = {"invalid": f"Line {line_no} is not an object or a string"}
+            item.setdefault("id", line_no)
+            yield item
+
+def completed_ids(path: str) -> set:
+    """Ids of the items in an existing output file that finished without an error."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # a line cut short when the previous run was killed
+                continue
+            if isinstance(result, dict) and result.get("error") is None:
+                done.add(json.dumps(result.get("id")))
+    return done
+
+async def run_item(item: dict, args) -> dict:
+    model = item.get("model") or args.model
+    result = {"id": item["id"], "model": model, "response": None, "error": None,
+              "prompt_tokens": None, "trimmed_tokens": None}
+
+    start = time.perf_counter()
+    chunks = []
+    first = None
+    # anything wrong with the item fails that item only, not the run
+    try:
+        if "invalid" in item:
+            raise ValueError(item["invalid"])
+        max_tokens = int(item.get("max_tokens") or args.max_tokens)
+        temperature = float(item["temperature"] if item.get("temperature") is not None else args.temperature)
+        message = {"text": item.get("prompt") or item.get("text") or "", "files": []}
+        history = [tuple(entry) for entry in item.get("history") or []]
+
+        payload, fit = prompt_builder.prepare_request(PromptState(), message, history,
+                                                      item.get("system_prompt", args.system_prompt),
+                                                      temperature, max_tokens, model, None)
+        result["prompt_tokens"] = fit["prompt_tokens"]
+        result["trimmed_tokens"] = fit["trimmed_tokens"]
+
+        async for content in backend.stream_chat(payload):
+            if first is None:
+                first = time.perf_counter()
+            chunks.append(content)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    end = time.perf_counter()
+
+    result["response"] = "".join(chunks)
+    result["chunks"] = len(chunks)
+    result["ttft_s"] = first - start if first is not None else None
+    result["total_s"] = end - start
+    # content deltas stand in for tokens: FastMLX sends one per token
+    result["tokens_per_s"] = (len(chunks) - 1) / (end - first) if first is not None and len(chunks) > 1 and end > first else None
+    return result
+
+async def run(args) -> dict:
+    done = completed_ids(args.output)
+    items = (item for item in read_items(args.input) if json.dumps(item["id"]) not in done)
+    results = []
+    skipped = len(done)
+    start = time.perf_counter()
+
+    if os.path.exists(args.output) and os.path.getsize(args.output):
+        with open(args.output, "rb+") as f:
+            # a line cut short when the previous run was killed must not run into the first new result
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        async def worker():
+            for item in items:
+                try:
+                    result = await asyncio.wait_for(run_item(item, args), args.timeout or None)
+                except asyncio.TimeoutError:
+                    result = {"id": item["id"], "model": item.get("model") or args.model, "response": None,
+                              "error": f"Timed out after {args.timeout} s"}
+                # the event loop is single-threaded, so lines are never interleaved
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                results.append(result)
+                if not args.quiet:
+                    status = result["error"] or f"{result['chunks']} chunks in {result['total_s']:.2f} s"
+                    print(f"{result['id']}: {status}", file=sys.stderr)
+
+        # the workers share one generator, so at most --concurrency requests are in flight
+        # and the input is read only as fast as it is processed
+        try:
+            await asyncio.gather(*[worker() for _ in range(max(1, args.concurrency))])
+        finally:
+            await backend.aclose_client()
+
+    ok = [r for r in results if r["error"] is None]
+    return {
+        "completed": len(ok),
+        "failed": len(results) - len(ok),
+        "skipped": skipped,
+        "wall_s": time.perf_counter() - start,
+        "ttft_s": percentiles([r["ttft_s"] for r in ok if r.get("ttft_s") is not None]),
+        "tokens_per_s": percentiles([r["tokens_per_s"] for r in ok if r.get("tokens_per_s") is not None]),
+        "total_s": percentiles([r["total_s"] for r in ok]),
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the chat backend")
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--model", default="meta-llama/Meta-Llama-3.1-8B-Instruct")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--system-prompt", default="")
+    parser.add_argument("--timeout", type=float, default=0, help="seconds per item, 0 for none")
+    parser.add_argument("--backend", help="comma-separated server URLs instead of FASTMLX_URL(S)")
+    parser.add_argument("--stub", action="store_true", help="run against a local stub server")
+    parser.add_argument("--quiet", action="store_true", help="no per-item progress on stderr")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+
+    if args.stub:
+        from benchmarks.stub_server import StubConfig, start_stub_server
+        stub = start_stub_server(StubConfig(ttft=0.05, rate=0, tokens=args.max_tokens))
+        backend.backend_urls = [stub.url]
+    elif args.backend:
+        backend.backend_urls = args.backend.split(",")
+
+    summary = asyncio.run(run(args))
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""End-to-end benchmark of the chat path against the stub FastMLX server.
+
+Drives app.bot() directly ("direct") and through concurrent Gradio sessions
+("gradio"), and prints machine-readable JSON with per-request TTFT,
+inter-token latency, tokens/s, prompt preparation time and bytes pushed to the
+UI, summarized as p50/p95/p99.
+
+Usage: python -m benchmarks.bench_chat [--mode direct|gradio|both] [--requests 32] [--concurrency 8] [--out results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+
+from benchmarks.stub_server import StubConfig, start_stub_server
+from metrics import percentiles
+
+def summarize(samples: list) -> dict:
+    keys = ["prompt_prep_s", "ttft_s", "itl_s", "tokens_per_s", "bytes_pushed", "updates", "total_s"]
+    return {key: percentiles([s[key] for s in samples if s.get(key) is not None]) for key in keys}
+
+def synthetic_history(turns: int, turn_chars: int) -> list:
+    return [[f"question {i} " + "q" * turn_chars, f"answer {i} " + "a" * turn_chars] for i in range(turns)]
+
+def sample_from_updates(start, updates, prompt_prep=None) -> dict:
+    """Derives per-request metrics from (timestamp, full response) UI updates."""
+    end = time.monotonic()
+    if not updates:
+        return {"prompt_prep_s": prompt_prep, "ttft_s": None, "total_s": end - start, "updates": 0, "bytes_pushed": 0}
+
+    first, last = updates[0][0], updates[-1][0]
+    tokens = len(updates[-1][1].split())
+    return {
+        "prompt_prep_s": prompt_prep,
+        "ttft_s": first - start,
+        "itl_s": (last - first) / (tokens - 1) if tokens > 1 else None,
+        "tokens_per_s": tokens / (last - first) if last > first else None,
+        "bytes_pushed": sum(len(text.encode('utf-8')) for _, text in updates),
+        "updates": len(updates),
+        "tokens": tokens,
+        "total_s": end - start,
+    }
+
+async def bench_direct(app, args) -> list:
+    from prompt_builder import PromptState
+
+    history = synthetic_history(args.history_turns, args.turn_chars)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        message = {"text": f"request {i}: {args.prompt}", "files": []}
+        async with semaphore:
+            start = time.monotonic()
+            PromptState().build(message, history, args.system_prompt, app.attachments)
+            prompt_prep = time.monotonic() - start
+
+            start = time.monotonic()
+            updates = []
+            async for text in app.bot(message, history, args.system_prompt, 0, args.max_tokens, args.model):
+                updates.append((time.monotonic(), text))
+            return sample_from_updates(start, updates, prompt_prep)
+
+    return await asyncio.gather(*[one(i) for i in range(args.requests)])
+
+def bench_gradio(app, args) -> list:
+    from gradio_client import Client
+
+    _, local_url, _ = app.launch(prevent_thread_lock=True, quiet=True, server_port=args.gradio_port)
+    samples = []
+    lock = threading.Lock()
+    jobs = iter(range(args.requests))
+
+    def session():
+        while True:
+            with lock:
+                i = next(jobs, None)
+            if i is None:
+                return
+            # a new client per request, as the API endpoint keeps history per session
+            client = Client(local_url, verbose=False)
+            start = time.monotonic()
+            updates = []
+            job = client.submit({"text": f"request {i}: {args.prompt}", "files": []},
+                                args.system_prompt, 0, args.max_tokens, args.model, api_name="/chat")
+            for text in job:
+                updates.append((time.monotonic(), text))
+            sample = sample_from_updates(start, updates)
+            with lock:
+                samples.append(sample)
+
+    threads = [threading.Thread(target=session) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    app.demo.close()
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["direct", "gradio", "both"], default="direct")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model", default="meta-llama/Meta-Llama-3.1-8B-Instruct")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--prompt", default="Summarize the conversation so far.")
+    parser.add_argument("--system-prompt", default="You are a helpful assistant.")
+    parser.add_argument("--history-turns", type=int, default=10)
+    parser.add_argument("--turn-chars", type=int, default=2000)
+    parser.add_argument("--ttft", type=float, default=0.1, help="stub server time to first token")
+    parser.add_argument("--rate", type=float, default=100.0, help="stub server tokens per second")
+    parser.add_argument("--chunk", type=int, default=1, help="stub server tokens per SSE event")
+    parser.add_argument("--backend", help="benchmark against these comma-separated servers instead of the stub")
+    parser.add_argument("--gradio-port", type=int, default=None)
+    parser.add_argument("--out", help="also write the results to this file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GRADIO_ANALYTICS_ENABLED", "False")
+    import app
+    import backend
+
+    stub = None
+    if args.backend:
+        backend.backend_urls = args.backend.split(",")
+    else:
+        stub = start_stub_server(StubConfig(ttft=args.ttft, rate=args.rate, chunk=args.chunk,
+                                            tokens=args.max_tokens))
+        backend.backend_urls = [stub.url]
+
+    results = {"config": vars(args), "results": {}}
+    # Gradio's queue does not start up after asyncio.run() has been used, so it goes first
+    if args.mode in ("gradio", "both"):
+        start = time.monotonic()
+        samples = bench_gradio(app, args)
+        results["results"]["gradio"] = dict(summarize(samples), wall_s=time.monotonic() - start)
+    if args.mode in ("direct", "both"):
+        start = time.monotonic()
+        samples = asyncio.run(bench_direct(app, args))
+        results["results"]["direct"] = dict(summarize(samples), wall_s=time.monotonic() - start)
+    if stub:
+        results["stub"] = stub.stats.snapshot()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
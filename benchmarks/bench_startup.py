@@ -0,0 +1,134 @@
+"""Startup benchmark: import time of app.py and time until the server listens.
+
+Each run starts fresh interpreters, so nothing is shared between runs:
+ * import: imports gradio, then app, then builds the UI, timing each step and
+   recording which of the document and imaging libraries got loaded on the way
+   (none should be, they are loaded on first use)
+ * listen: starts `python app.py` and polls until it answers HTTP
+
+Prints JSON with p50/p95/p99 per measurement and exits with status 1 if a
+median exceeds its budget or an eagerly loaded library is found.
+
+Usage: python -m benchmarks.bench_startup [--runs 3] [--budget-app-import 0.25] [--budget-listen 20] [--out results.json]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from metrics import percentiles
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use only; finding one after `import app` is a regression
+LAZY_MODULES = ["fitz", "pymupdf", "lxml", "doc2json"]
+
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import gradio
+gradio_s = time.perf_counter() - start
+start = time.perf_counter()
+import app
+app_s = time.perf_counter() - start
+start = time.perf_counter()
+app.build_ui()
+build_s = time.perf_counter() - start
+print(json.dumps({"gradio_import_s": gradio_s, "app_import_s": app_s, "build_ui_s": build_s,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+def environment(port=None) -> dict:
+    env = dict(os.environ, GRADIO_ANALYTICS_ENABLED="False", PYTHONDONTWRITEBYTECODE="1")
+    env.pop("MLX_CHAT_PRELOAD_MODELS", None)
+    env.pop("MLX_CHAT_METRICS", None)
+    if port is not None:
+        env["GRADIO_SERVER_PORT"] = str(port)
+    return env
+
+def measure_import() -> dict:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], cwd=REPO_DIR, env=environment(),
+                            capture_output=True, text=True, check=True)
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample["process_s"] = time.perf_counter() - start
+    return sample
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def measure_listen(timeout: float) -> float:
+    """Seconds from starting app.py until its HTTP server answers, None if it did not within timeout."""
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "app.py"], cwd=REPO_DIR, env=environment(port),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                return None
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1):
+                    return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.05)
+        return None
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-app-import", type=float, default=0.25,
+                        help="seconds for `import app` once gradio is loaded (median)")
+    parser.add_argument("--budget-listen", type=float, default=20.0,
+                        help="seconds from starting app.py until it answers HTTP (median)")
+    parser.add_argument("--skip-listen", action="store_true", help="only measure imports")
+    parser.add_argument("--out", help="also write the results to this file")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    listens = [] if args.skip_listen else [measure_listen(max(args.budget_listen * 3, 30)) for _ in range(args.runs)]
+
+    results = {"config": vars(args), "results": {
+        key: percentiles([sample[key] for sample in imports])
+        for key in ("gradio_import_s", "app_import_s", "build_ui_s", "process_s")}}
+    results["results"]["eagerly_loaded"] = sorted({m for sample in imports for m in sample["loaded"]})
+    if not args.skip_listen:
+        results["results"]["listen_s"] = percentiles([s for s in listens if s is not None])
+        results["results"]["listen_failures"] = sum(s is None for s in listens)
+
+    failures = []
+    if results["results"]["app_import_s"]["p50"] > args.budget_app_import:
+        failures.append(f"app import {results['results']['app_import_s']['p50']:.3f} s > {args.budget_app_import} s")
+    if results["results"]["eagerly_loaded"]:
+        failures.append(f"loaded at import: {', '.join(results['results']['eagerly_loaded'])}")
+    if not args.skip_listen:
+        listen = results["results"]["listen_s"]
+        if not listen or results["results"]["listen_failures"]:
+            failures.append("app.py did not start listening")
+        elif listen["p50"] > args.budget_listen:
+            failures.append(f"time to listening {listen['p50']:.2f} s > {args.budget_listen} s")
+    results["failures"] = failures
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
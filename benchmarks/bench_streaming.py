@@ -0,0 +1,48 @@
+"""Counts the bytes pushed to the UI per response, per token vs. coalesced.
+
+Usage: python -m benchmarks.bench_streaming [--tokens 4000] [--rate 60]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import streaming
+
+async def synthetic_deltas(tokens, rate):
+    for i in range(tokens):
+        await asyncio.sleep(1 / rate)
+        yield f"tok{i % 100} "
+
+async def measure(tokens, rate, **policy):
+    start = time.monotonic()
+    ttft = None
+    updates = 0
+    pushed = 0
+
+    async for update in streaming.coalesce(synthetic_deltas(tokens, rate), **policy):
+        if ttft is None:
+            ttft = time.monotonic() - start
+        updates += 1
+        pushed += len(update.encode('utf-8'))
+
+    return {"updates": updates, "bytes_pushed": pushed, "ttft_s": round(ttft, 4),
+            "total_s": round(time.monotonic() - start, 3)}
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--rate", type=float, default=60, help="tokens per second")
+    parser.add_argument("--interval", type=float, default=streaming.flush_interval)
+    parser.add_argument("--max-tokens", type=int, default=streaming.flush_tokens)
+    args = parser.parse_args()
+
+    results = {
+        "per_token": await measure(args.tokens, args.rate, interval=0, max_tokens=0, mode="full"),
+        "coalesced": await measure(args.tokens, args.rate, interval=args.interval, max_tokens=args.max_tokens, mode="full"),
+        "coalesced_delta": await measure(args.tokens, args.rate, interval=args.interval, max_tokens=args.max_tokens, mode="delta"),
+    }
+    print(json.dumps({"tokens": args.tokens, "rate": args.rate, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
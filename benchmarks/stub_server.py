@@ -0,0 +1,200 @@
+"""Local stand-in for a FastMLX server, for benchmarks without Apple Silicon.
+
+Serves the OpenAI-compatible endpoints app.py and infra.py use, streaming
+synthetic tokens at a configurable rate.
+
+Usage: python -m benchmarks.stub_server [--port 8000] [--ttft 0.2] [--rate 50] [--chunk 1]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+class StubConfig:
+    def __init__(self, ttft=0.2, rate=50.0, chunk=1, tokens=256, models=None, prefill_rate=0.0):
+        self.ttft = ttft                    # seconds before the first token
+        self.rate = rate                    # tokens per second after the first (0 = unthrottled)
+        self.chunk = chunk                  # tokens per SSE event
+        self.tokens = tokens                # completion length, capped by the request's max_tokens
+        self.models = models or ["meta-llama/Meta-Llama-3.1-8B-Instruct", "google/gemma-2-9b-it"]
+        self.prefill_rate = prefill_rate    # prompt characters per second added to ttft (0 = none)
+        self.done_marker = True             # False ends streams without "data: [DONE]", as a failing backend would
+        self.status = 200                   # other statuses answer model listings and chat completions with that error, e.g. 503
+
+class StubStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()
+        self.tokens_sent = 0
+        self.active_streams = 0
+        self.max_active_streams = 0
+        self.disconnects = 0
+        self.bodies = []
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "connections": len(self.connections),
+                    "tokens_sent": self.tokens_sent, "max_active_streams": self.max_active_streams,
+                    "disconnects": self.disconnects}
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        config = self.server.config
+        if config.status != 200:
+            self._send_json({"detail": "Stub failure"}, config.status)
+        elif self.path.startswith("/v1/models"):
+            self._send_json({"models": config.models})
+        elif self.path.startswith("/v1/supported_models"):
+            self._send_json({"lm": config.models})
+        else:
+            self._send_json({"detail": "Not Found"}, 404)
+
+    def do_POST(self):
+        config = self.server.config
+        stats = self.server.stats
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+
+        if self.path.startswith("/v1/models"):
+            model = parse_qs(urlsplit(self.path).query).get("model_name", [None])[0]
+            if model and model not in config.models:
+                config.models.append(model)
+            self._send_json({"status": "ok"})
+            return
+        if not self.path.startswith("/v1/chat/completions"):
+            self._send_json({"detail": "Not Found"}, 404)
+            return
+
+        request = json.loads(body)
+        with stats.lock:
+            stats.requests += 1
+            stats.connections.add(self.client_address)
+            stats.bodies.append(request)
+            del stats.bodies[:-100]
+
+        if config.status != 200:
+            self._send_json({"detail": "Stub failure"}, config.status)
+            return
+        if request.get("model") not in config.models:
+            self._send_json({"detail": f"Model {request.get('model')} not loaded"}, 404)
+            return
+
+        tokens = min(config.tokens, int(request.get("max_tokens") or config.tokens))
+        ttft = config.ttft
+        if config.prefill_rate:
+            ttft += len(json.dumps(request.get("messages", []))) / config.prefill_rate
+
+        if not request.get("stream"):
+            time.sleep(ttft + (tokens / config.rate if config.rate else 0))
+            self._send_json({"choices": [{"message": {"role": "assistant",
+                                                      "content": "".join(f"tok{i} " for i in range(tokens))}}]})
+            with stats.lock:
+                stats.tokens_sent += tokens
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        with stats.lock:
+            stats.active_streams += 1
+            stats.max_active_streams = max(stats.max_active_streams, stats.active_streams)
+        try:
+            time.sleep(ttft)
+            start = time.monotonic()
+            for first in range(0, tokens, config.chunk):
+                count = min(config.chunk, tokens - first)
+                if config.rate:
+                    # pace against the start time so slow writes do not accumulate drift
+                    delay = start + first / config.rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                content = "".join(f"tok{i} " for i in range(first, first + count))
+                event = {"choices": [{"index": 0, "delta": {"content": content}}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                with stats.lock:
+                    stats.tokens_sent += count
+            if config.done_marker:
+                self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            with stats.lock:
+                stats.disconnects += 1
+            self.close_connection = True
+        finally:
+            with stats.lock:
+                stats.active_streams -= 1
+
+    def do_DELETE(self):
+        config = self.server.config
+        if not self.path.startswith("/v1/models"):
+            self._send_json({"detail": "Not Found"}, 404)
+            return
+        model = parse_qs(urlsplit(self.path).query).get("model_name", [None])[0]
+        if model in config.models:
+            config.models.remove(model)
+        self._send_json({"status": "ok"})
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config=None):
+        super().__init__(address, StubHandler)
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+def start_stub_server(config=None, host="127.0.0.1", port=0) -> StubServer:
+    """Starts a stub server on a background thread; port 0 picks a free port."""
+    server = StubServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--rate", type=float, default=50.0)
+    parser.add_argument("--chunk", type=int, default=1)
+    parser.add_argument("--tokens", type=int, default=256)
+    parser.add_argument("--prefill-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = StubConfig(ttft=args.ttft, rate=args.rate, chunk=args.chunk, tokens=args.tokens,
+                        prefill_rate=args.prefill_rate)
+    server = StubServer((args.host, args.port), config)
+    print(f"Stub FastMLX server on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
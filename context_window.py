@@ -0,0 +1,173 @@
+# Context length in tokens per model; models not listed get default_context
+model_context = {
+    "meta-llama/Meta-Llama-3.1-8B-Instruct": 131072,
+    "google/gemma-2-9b-it": 8192,
+}
+default_context = 8192
+
+# Upper bound for the prompt regardless of the model's context, to bound prefill latency (0 = none)
+max_prompt_tokens = 0
+
+# Tokens kept free on top of the requested completion length
+safety_tokens = 64
+
+# Fallback estimate when no tokenizer is registered for a model
+chars_per_token = 3.5
+message_overhead_tokens = 4
+image_tokens = 1024
+
+# Messages other than the last one are cut down to this size before any
+# turn is dropped (0 = never truncate, only drop whole turns)
+max_message_tokens = 4096
+
+# Model name -> callable(text) -> token count
+tokenizers = {}
+
+truncation_marker = "\n[... {} tokens omitted ...]\n"
+
+def register_tokenizer(model: str, count_tokens):
+    """Registers an exact token counter, e.g. lambda s: len(hf_tokenizer.encode(s))."""
+    tokenizers[model] = count_tokens
+
+def estimate_text_tokens(text: str, model: str = None) -> int:
+    count_tokens = tokenizers.get(model)
+    if count_tokens:
+        return count_tokens(text)
+    return int(len(text) / chars_per_token) + 1
+
+def estimate_message_tokens(msg: dict, model: str = None) -> int:
+    content = msg["content"]
+    if isinstance(content, str):
+        return message_overhead_tokens + estimate_text_tokens(content, model)
+
+    tokens = message_overhead_tokens
+    for part in content:
+        if part.get("type") == "text":
+            tokens += estimate_text_tokens(part["text"], model)
+        else:
+            tokens += image_tokens
+    return tokens
+
+def prompt_budget(model: str, max_tokens: int) -> int:
+    """Returns the number of prompt tokens that fit next to max_tokens of completion."""
+    context = model_context.get(model, default_context)
+    budget = context - int(max_tokens) - safety_tokens
+    if max_prompt_tokens:
+        budget = min(budget, max_prompt_tokens)
+    # a completion length close to the context size must not starve the prompt entirely
+    return max(budget, context // 4)
+
+def truncate_text(text: str, keep_tokens: int, model: str = None) -> str:
+    """Cuts text down to roughly keep_tokens, keeping its beginning and end."""
+    tokens = estimate_text_tokens(text, model)
+    if tokens <= keep_tokens:
+        return text
+
+    marker = truncation_marker.format(tokens - keep_tokens)
+    keep_tokens = max(keep_tokens - estimate_text_tokens(marker, model), 0)
+    keep_chars = int(len(text) * keep_tokens / tokens)
+    head = text[:keep_chars // 2]
+    tail = text[len(text) - keep_chars // 2:] if keep_chars > 1 else ""
+    return head + marker + tail
+
+def _truncate_message(msg: dict, keep_tokens: int, model: str) -> dict:
+    content = msg["content"]
+    if isinstance(content, str):
+        return dict(msg, content=truncate_text(content, keep_tokens, model))
+
+    # images cannot be shortened, so they are replaced by a note
+    parts = []
+    for part in content:
+        if part.get("type") == "text":
+            parts.append(dict(part, text=truncate_text(part["text"], keep_tokens, model)))
+        else:
+            parts.append({"type": "text", "text": "[image omitted]"})
+    return dict(msg, content=parts)
+
+def _first_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return next((part["text"] for part in content if part.get("type") == "text"), "")
+
+def fit_messages(messages: list, model: str, max_tokens: int, keep_prefix: str = None):
+    """Trims a chat prompt to the model's token budget.
+
+    Oversized earlier messages (typically pasted attachments) are truncated first,
+    then the oldest turns are dropped. System messages and the final user message
+    are always kept; the final message is truncated as a last resort.
+
+    Args:
+    messages: OpenAI-format messages, not modified.
+    model: Model name, selects context length and tokenizer.
+    max_tokens: Requested completion length.
+    keep_prefix: Text the first user message starts with (e.g. the system prompt
+    merged into it) that is carried over to the first remaining user message.
+
+    Returns:
+    The fitted message list and a report dict with estimated prompt_tokens,
+    trimmed_tokens, dropped_messages and truncated_messages.
+    """
+    budget = prompt_budget(model, max_tokens)
+    sizes = [estimate_message_tokens(msg, model) for msg in messages]
+    total = sum(sizes)
+    report = {"prompt_tokens": total, "budget_tokens": budget, "trimmed_tokens": 0,
+              "dropped_messages": 0, "truncated_messages": 0}
+    if total <= budget:
+        return messages, report
+
+    messages = list(messages)
+    last = len(messages) - 1
+
+    # 1. cut down oversized history messages
+    if max_message_tokens:
+        for i in range(last):
+            if sizes[i] > max_message_tokens and messages[i]["role"] != "system":
+                messages[i] = _truncate_message(messages[i], max_message_tokens, model)
+                new_size = estimate_message_tokens(messages[i], model)
+                total -= sizes[i] - new_size
+                sizes[i] = new_size
+                report["truncated_messages"] += 1
+                if total <= budget:
+                    break
+
+    # 2. drop the oldest turns, a turn being a user message and what follows up to the next one
+    prefix_dropped = False
+    while total > budget:
+        first = next((i for i in range(last) if messages[i]["role"] != "system"), None)
+        if first is None:
+            break
+        end = first + 1
+        while end < last and messages[end]["role"] != "user":
+            end += 1
+        if messages[first]["role"] == "user" and keep_prefix and not prefix_dropped:
+            prefix_dropped = _first_text(messages[first]["content"]).startswith(keep_prefix)
+        total -= sum(sizes[first:end])
+        del messages[first:end], sizes[first:end]
+        last -= end - first
+        report["dropped_messages"] += end - first
+
+    if prefix_dropped:
+        first_user = next(i for i, msg in enumerate(messages) if msg["role"] == "user")
+        content = messages[first_user]["content"]
+        if isinstance(content, str):
+            content = keep_prefix + content
+        elif content and content[0].get("type") == "text":
+            content = [dict(content[0], text=keep_prefix + content[0]["text"])] + content[1:]
+        else:
+            content = [{"type": "text", "text": keep_prefix}] + content
+        messages[first_user] = dict(messages[first_user], content=content)
+        new_size = estimate_message_tokens(messages[first_user], model)
+        total += new_size - sizes[first_user]
+        sizes[first_user] = new_size
+
+    # 3. the remaining prompt is still too long: truncate the final message
+    if total > budget:
+        room = budget - (total - sizes[last]) - message_overhead_tokens
+        messages[last] = _truncate_message(messages[last], max(room, 1), model)
+        new_size = estimate_message_tokens(messages[last], model)
+        total -= sizes[last] - new_size
+        report["truncated_messages"] += 1
+
+    report["trimmed_tokens"] = report["prompt_tokens"] - total
+    report["prompt_tokens"] = total
+    return messages, report
@@ -1,8 +1,17 @@
 from collections import defaultdict
+import argparse
+import io
 import json
+import os
+import shutil
+import sys
+import tempfile
+import time
 import zipfile
 from lxml import etree
 
+import context_window
+
 # Define common fonts to ignore
 common_fonts = {
     'Times New Roman',
@@ -65,22 +74,17 @@ ignored_metadata_elements = {
     # Add any other metadata elements to ignore here
 }
 
-def remove_ignored_elements(tree):
-    """Remove all ignored elements from the XML tree, except highlights."""
-    for elem in tree.xpath(".//*"):
-        tag_without_ns = elem.tag.split('}')[-1]
-        if tag_without_ns in ignored_elements:
-            elem.getparent().remove(elem)
-        elif elem.tag == '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}rPr':  # Check for highlights in rPr
-            if not any(child.tag.endswith('highlight') for child in elem.getchildren()):
-                elem.getparent().remove(elem)
-        else:
-            # Remove ignored attributes
-            for attr in list(elem.attrib):
-                attr_without_ns = attr.split('}')[-1]
-                if attr_without_ns in ignored_attributes or attr_without_ns.startswith('rsid'):
-                    del elem.attrib[attr]
-    return tree
+def filter_attributes(attrib):
+    """Filter out common fonts and ignored attributes, removing namespace URIs."""
+    filtered_attribs = {}
+    for k, v in attrib.items():
+        k = k.split('}')[-1]  # Remove namespace URI
+        if k in ('ascii', 'hAnsi', 'cs', 'eastAsia'):
+            if v not in common_fonts:
+                filtered_attribs[k] = v
+        elif k not in ignored_attributes and not k.startswith('rsid'):
+            filtered_attribs[k] = v
+    return filtered_attribs
 
 def etree_to_dict(t):
     """Convert an lxml etree to a nested dictionary, excluding ignored namespaces and attributes."""
@@ -98,16 +102,7 @@ def etree_to_dict(t):
         d = {tag: {k: v[0] if len(v) == 1 else v for k, v in dd.items()}}
 
     if t.attrib:
-        # Filter out common fonts and ignored attributes
-        filtered_attribs = {}
-        for k, v in t.attrib.items():
-            k = k.split('}')[-1]  # Remove namespace URI
-            if k in ('ascii', 'hAnsi', 'cs', 'eastAsia'):
-                if v not in common_fonts:
-                    filtered_attribs[k] = v
-            elif k not in ignored_attributes and not k.startswith('rsid'):
-                filtered_attribs[k] = v
-        d[tag].update(filtered_attribs)
+        d[tag].update(filter_attributes(t.attrib))
     
     if t.text:
         text = t.text.strip()
@@ -124,10 +119,12 @@ def etree_to_dict(t):
 
     return d
 
-# Additionally, update the 'remove_ignored_elements' function to fix encoding
+_descendants = etree.XPath(".//*")
+_descendant_texts = etree.XPath(".//text()")
+
 def remove_ignored_elements(tree):
     """Remove all ignored elements from the XML tree, except highlights."""
-    for elem in tree.xpath(".//*"):
+    for elem in _descendants(tree):
         tag_without_ns = elem.tag.split('}')[-1]
         if tag_without_ns in ignored_elements:
             elem.getparent().remove(elem)
@@ -141,7 +138,7 @@ def remove_ignored_elements(tree):
                 if attr_without_ns in ignored_attributes or attr_without_ns.startswith('rsid'):
                     del elem.attrib[attr]
     # Decode the text correctly for each XML element
-    for elem in tree.xpath(".//text()"):
+    for elem in _descendant_texts(tree):
         elem_text = elem.strip()
         encoded_text = bytes(elem_text, 'utf-8').decode('utf-8', 'ignore')
         parent = elem.getparent()
@@ -161,21 +158,602 @@ def extract_metadata(docx):
                 metadata[tag] = child.text
     return metadata
 
-def process_docx(file_path):
-    # Load the document with zipfile and lxml
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Elements at this depth (root = 0), i.e. the paragraphs and tables of w:body,
+# are converted as whole subtrees; everything above them is streamed
+stream_depth = 2
+
+# Spooled output above this size goes to a temporary file
+spool_max_memory = 1024 * 1024
+# Converted subtrees are serialized this many at a time
+serialize_batch = 64
+
+def is_ignored_element(elem):
+    """Whether remove_ignored_elements() would remove this element."""
+    if elem.tag.split('}')[-1] in ignored_elements:
+        return True
+    if elem.tag == W_NS + 'rPr':
+        return not any(child.tag.endswith('highlight') for child in elem)
+    return False
+
+def remove_ignored_attributes(elem):
+    for attr in list(elem.attrib):
+        attr_without_ns = attr.split('}')[-1]
+        if attr_without_ns in ignored_attributes or attr_without_ns.startswith('rsid'):
+            del elem.attrib[attr]
+
+def subtree_to_dict(elem):
+    """Convert one completed element the way it is converted as part of the whole tree."""
+    if elem.tag != W_NS + 'rPr':
+        remove_ignored_attributes(elem)
+    remove_ignored_elements(elem)
+    return etree_to_dict(elem)
+
+class _Frame:
+    """An element above stream_depth, collecting its converted children as they complete.
+
+    Children at stream_depth are serialized into one spool per tag in small
+    batches, already indented and separated as items of a JSON list, so that
+    writing the frame out is mostly a plain copy. Children above stream_depth
+    are kept as frames.
+    """
+
+    def __init__(self, elem, depth, compact=False):
+        self.tag = elem.tag.split('}')[-1]
+        if depth == 0:
+            # remove_ignored_elements() leaves the root's attributes alone
+            self.has_attrib = bool(elem.attrib)
+        else:
+            self.has_attrib = any(not (a.split('}')[-1] in ignored_attributes or a.split('}')[-1].startswith('rsid'))
+                                  for a in elem.attrib)
+        self.attrib = filter_attributes(elem.attrib) if self.has_attrib else {}
+        self.level = depth + 1  # nesting level of this element's value in the output
+        self.compact = compact
+        self.children = 0
+        self.highlight = False
+        self.text = None
+        self.values = {}  # child tag -> [spool, items written, items pending] or list of child frames
+
+    def add_value(self, key, value):
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [tempfile.SpooledTemporaryFile(max_size=spool_max_memory, mode="w+",
+                                                                      encoding="utf-8", newline="\n"), 0, []]
+        entry[2].append(value)
+        if len(entry[2]) >= serialize_batch:
+            self._serialize(entry)
+
+    def _serialize(self, entry):
+        # one json.dumps() per batch of items: its setup costs more than most paragraphs
+        spool, count, pending = entry
+        if not pending:
+            return
+        if self.compact:
+            if count:
+                spool.write(",")
+            spool.write(json.dumps(pending, ensure_ascii=False, separators=(",", ":"))[1:-1])
+        else:
+            text = json.dumps(pending, ensure_ascii=False, indent=2)[4:-2]
+            if count:
+                spool.write(",\n" + "  " * (self.level + 2))
+            spool.write(text.replace("\n", "\n" + "  " * (self.level + 1)))
+        entry[1] += len(pending)
+        pending.clear()
+
+    def add_frame(self, frame):
+        self.values.setdefault(frame.tag, []).append(frame)
+
+    def is_empty(self):
+        return not self.has_attrib and not self.children and not self.text
+
+    def close(self):
+        for entry in self.values.values():
+            if isinstance(entry[0], _Frame):
+                for frame in entry:
+                    frame.close()
+            else:
+                entry[0].close()
+
+def _write_frame(frame, out, shift=0):
+    """Write a frame's value as etree_to_dict() and json.dumps() would, indented or compact.
+
+    shift is the number of extra indentation levels, 1 for a frame that is an
+    item of a list: its spools were indented for a single value when they were written.
+    """
+    if not frame.children and not frame.has_attrib:
+        out.write(json.dumps(frame.text, ensure_ascii=False))
+        return
+
+    entries = [[key, None, entry] for key, entry in frame.values.items()]
+    positions = {key: i for i, (key, _, _) in enumerate(entries)}
+    for k, v in frame.attrib.items():
+        if k in positions:
+            entries[positions[k]][1:] = [v, None]
+        else:
+            entries.append([k, v, None])
+    if frame.text:
+        entries.append(["#text", frame.text, None])
+
+    if not entries:
+        out.write("{}")
+        return
+
+    if frame.compact:
+        indent = item_indent = list_indent = newline = ""
+        colon = ":"
+    else:
+        indent = "  " * (frame.level + shift)
+        item_indent = indent + "  "
+        list_indent = item_indent + "  "
+        newline = "\n"
+        colon = ": "
+    out.write("{" + newline)
+    for i, (key, value, entry) in enumerate(entries):
+        out.write(item_indent + json.dumps(key, ensure_ascii=False) + colon)
+        if entry is None:
+            out.write(json.dumps(value, ensure_ascii=False))
+        elif isinstance(entry[0], _Frame):
+            if len(entry) == 1:
+                _write_frame(entry[0], out, shift)
+            else:
+                out.write("[" + newline + list_indent)
+                for j, child in enumerate(entry):
+                    if j:
+                        out.write("," + newline + list_indent)
+                    _write_frame(child, out, shift + 1)
+                out.write(newline + item_indent + "]")
+        else:
+            frame._serialize(entry)
+            spool, count, _ = entry
+            spool.seek(0)
+            # the spool is indented for items of a list in a frame without shift
+            extra = 0 if frame.compact else 2 * shift - (2 if count == 1 else 0)
+            if count != 1:
+                out.write("[" + newline + list_indent)
+            if extra:
+                # the only item is not in a list, or the frame is itself a list item
+                for line_no, line in enumerate(spool):
+                    if not line_no:
+                        out.write(line)
+                    elif extra > 0:
+                        out.write(" " * extra + line)
+                    else:
+                        out.write(line[-extra:])
+            else:
+                shutil.copyfileobj(spool, out)
+            if count != 1:
+                out.write(newline + item_indent + "]")
+        out.write("," + newline if i < len(entries) - 1 else newline)
+    out.write(indent + "}")
+
+def convert_docx(file_path, out, compact=False):
+    """Convert a DOCX file to JSON, writing to the text stream out as the document is parsed.
+
+    Produces the same output as converting the whole tree at once
+    (remove_ignored_elements, etree_to_dict, json.dumps with indent=2, or
+    without any whitespace if compact is set), but only
+    holds one paragraph or table of the body in memory at a time. Converted parts
+    wait in spooled temporary files until their parent element completes.
+    """
     with zipfile.ZipFile(file_path) as docx:
         metadata = extract_metadata(docx)
         with docx.open('word/document.xml') as document_xml:
-            xml_content = document_xml.read()
-            document_tree = etree.XML(xml_content)
+            frames = []
+            depth = 0
+            for event, elem in etree.iterparse(document_xml, events=("start", "end"), huge_tree=True,
+                                               remove_comments=True, remove_pis=True):
+                if event == "start":
+                    if depth < stream_depth:
+                        frames.append(_Frame(elem, depth, compact))
+                    depth += 1
+                    continue
 
-            # Remove the ignored elements
-            document_tree = remove_ignored_elements(document_tree)
+                depth -= 1
+                if depth > stream_depth:
+                    # part of a subtree that is converted once it is complete
+                    continue
 
-            # Convert the rest of the XML tree to a dictionary
-            document_dict = etree_to_dict(document_tree)
-            document_dict['metadata'] = metadata  # Add metadata to the document dictionary
+                if depth == stream_depth:
+                    parent = frames[-1]
+                    if not is_ignored_element(elem):
+                        parent.children += 1
+                        parent.highlight = parent.highlight or elem.tag.endswith('highlight')
+                        d = subtree_to_dict(elem)
+                        if d is not None:
+                            (key, value), = d.items()
+                            parent.add_value(key, value)
+                else:
+                    frame = frames.pop()
+                    frame.text = elem.text.strip() if elem.text is not None else None
+                    if depth == 0:
+                        root = frame
+                        break
+
+                    parent = frames[-1]
+                    removed = frame.tag in ignored_elements or (elem.tag == W_NS + 'rPr' and not frame.highlight)
+                    if not removed:
+                        parent.children += 1
+                        parent.highlight = parent.highlight or elem.tag.endswith('highlight')
+                    if removed or frame.is_empty():
+                        frame.close()
+                    else:
+                        parent.add_frame(frame)
+
+                # free what has been converted
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+    try:
+        if compact:
+            out.write("{" + json.dumps(root.tag, ensure_ascii=False) + ":")
+        else:
+            out.write("{\n  " + json.dumps(root.tag, ensure_ascii=False) + ": ")
+        if root.is_empty():
+            out.write("null")
+        else:
+            _write_frame(root, out)
+        if compact:
+            out.write(",\"metadata\":" + json.dumps(metadata, ensure_ascii=False, separators=(",", ":")) + "}")
+        else:
+            metadata_json = json.dumps(metadata, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            out.write(",\n  \"metadata\": " + metadata_json + "\n}")
+    finally:
+        root.close()
 
-            docx_json = json.dumps(document_dict, ensure_ascii=False, indent=2)
+def convert_docx_tree(file_path, compact=False) -> str:
+    """Convert a DOCX file by loading the whole tree at once, as process_docx() did
+    before convert_docx(). Kept as the reference that convert_docx() must match."""
+    parser = etree.XMLParser(huge_tree=True, remove_comments=True, remove_pis=True)
+    with zipfile.ZipFile(file_path) as docx:
+        metadata = extract_metadata(docx)
+        with docx.open('word/document.xml') as document_xml:
+            document_tree = etree.XML(document_xml.read(), parser)
+
+    document_dict = etree_to_dict(remove_ignored_elements(document_tree))
+    document_dict['metadata'] = metadata
+    if compact:
+        return json.dumps(document_dict, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(document_dict, ensure_ascii=False, indent=2)
+
+R_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Output modes of render_docx(): the nested OOXML structure as indented or
+# minified JSON, or just the content as Markdown (headings, lists, tables,
+# emphasis, highlights, links) or plain text
+MODES = ("json", "json-min", "markdown", "text")
+default_mode = os.environ.get("MLX_CHAT_DOCX_MODE", "markdown")
+
+# Inline elements whose content is not part of the visible text
+_skipped_inline = {W_NS + 'pPr', W_NS + 'rPr', W_NS + 'del', W_NS + 'moveFrom'}
+
+def _val(elem, default=None):
+    return elem.get(W_NS + 'val', default) if elem is not None else default
+
+def _is_on(elem):
+    """Whether a toggle property such as w:b or w:highlight is set."""
+    return elem is not None and _val(elem, 'true') not in ('0', 'false', 'off', 'none')
+
+class _DocxContext:
+    """The parts of styles.xml, numbering.xml and the relationships that rendering needs."""
+
+    def __init__(self, docx):
+        names = set(docx.namelist())
+        self.headings = {}         # paragraph style id -> heading level
+        self.style_numbering = {}  # paragraph style id -> (numId, ilvl)
+        self.num_formats = {}      # abstractNumId -> {ilvl: numFmt}
+        self.nums = {}             # numId -> abstractNumId
+        self.links = {}            # relationship id -> hyperlink target
+
+        if 'word/styles.xml' in names:
+            with docx.open('word/styles.xml') as f:
+                for style in etree.parse(f).iter(W_NS + 'style'):
+                    if style.get(W_NS + 'type') != 'paragraph':
+                        continue
+                    style_id = style.get(W_NS + 'styleId')
+                    name = (_val(style.find(W_NS + 'name')) or '').lower()
+                    ppr = style.find(W_NS + 'pPr')
+                    outline = _val(ppr.find(W_NS + 'outlineLvl')) if ppr is not None else None
+                    if name == 'title':
+                        self.headings[style_id] = 1
+                    elif name.startswith('heading ') and name[8:].isdigit():
+                        self.headings[style_id] = int(name[8:])
+                    elif outline is not None and outline.isdigit() and int(outline) < 9:
+                        self.headings[style_id] = int(outline) + 1
+                    num_pr = ppr.find(W_NS + 'numPr') if ppr is not None else None
+                    if num_pr is not None:
+                        self.style_numbering[style_id] = (_val(num_pr.find(W_NS + 'numId')),
+                                                          int(_val(num_pr.find(W_NS + 'ilvl'), '0')))
+
+        if 'word/numbering.xml' in names:
+            with docx.open('word/numbering.xml') as f:
+                numbering = etree.parse(f)
+            for abstract in numbering.iter(W_NS + 'abstractNum'):
+                self.num_formats[abstract.get(W_NS + 'abstractNumId')] = {
+                    int(lvl.get(W_NS + 'ilvl', '0')): _val(lvl.find(W_NS + 'numFmt'), 'decimal')
+                    for lvl in abstract.iter(W_NS + 'lvl')}
+            for num in numbering.iter(W_NS + 'num'):
+                self.nums[num.get(W_NS + 'numId')] = _val(num.find(W_NS + 'abstractNumId'))
+
+        if 'word/_rels/document.xml.rels' in names:
+            with docx.open('word/_rels/document.xml.rels') as f:
+                for rel in etree.parse(f).iter(PKG_REL_NS + 'Relationship'):
+                    if rel.get('Type', '').endswith('/hyperlink'):
+                        self.links[rel.get('Id')] = rel.get('Target')
+
+    def is_ordered(self, num_id, ilvl):
+        fmt = self.num_formats.get(self.nums.get(num_id), {}).get(ilvl, 'decimal')
+        return fmt not in ('bullet', 'none')
+
+def _run_segments(elem, context, link=None):
+    """Yield (text, (bold, italic, strike, highlight), link) for the runs below a paragraph, in order."""
+    for child in elem:
+        if child.tag == W_NS + 'r':
+            rpr = child.find(W_NS + 'rPr')
+            if rpr is None:
+                fmt = (False, False, False, False)
+            else:
+                fmt = (_is_on(rpr.find(W_NS + 'b')), _is_on(rpr.find(W_NS + 'i')),
+                       _is_on(rpr.find(W_NS + 'strike')), _is_on(rpr.find(W_NS + 'highlight')))
+            text = []
+            for part in child:
+                if part.tag == W_NS + 't':
+                    text.append(part.text or '')
+                elif part.tag == W_NS + 'tab':
+                    text.append('\t')
+                elif part.tag in (W_NS + 'br', W_NS + 'cr'):
+                    text.append('\n')
+                elif part.tag == W_NS + 'noBreakHyphen':
+                    text.append('-')
+            yield ''.join(text), fmt, link
+        elif child.tag == W_NS + 'hyperlink':
+            target = context.links.get(child.get(R_NS + 'id'))
+            yield from _run_segments(child, context, target or link)
+        elif child.tag not in _skipped_inline:
+            # insertions, content controls, smart tags, simple fields, ...
+            yield from _run_segments(child, context, link)
+
+def _format_runs(segments, markdown):
+    merged = []
+    for text, fmt, link in segments:
+        if not text:
+            continue
+        if merged and merged[-1][1] == fmt and merged[-1][2] == link:
+            merged[-1][0] += text
+        else:
+            merged.append([text, fmt, link])
+    if not markdown:
+        return ''.join(text for text, _, _ in merged)
+
+    parts = []
+    for text, (bold, italic, strike, highlight), link in merged:
+        core = text.strip()
+        if not core:
+            parts.append(text)
+            continue
+        # emphasis markers must hug the text
+        lead = text[:len(text) - len(text.lstrip())]
+        trail = text[len(text.rstrip()):]
+        if highlight:
+            core = '==' + core + '=='
+        if strike:
+            core = '~~' + core + '~~'
+        if italic:
+            core = '*' + core + '*'
+        if bold:
+            core = '**' + core + '**'
+        if link:
+            core = '[' + core + '](' + link + ')'
+        parts.append(lead + core + trail)
+    return ''.join(parts)
+
+def _render_paragraph(p, context, markdown, counters):
+    """Return (kind, text) for a paragraph, kind being "list" for list items; None if it is empty."""
+    text = _format_runs(_run_segments(p, context), markdown).strip()
+    if not text:
+        return None
+
+    ppr = p.find(W_NS + 'pPr')
+    style = _val(ppr.find(W_NS + 'pStyle')) if ppr is not None else None
+    num_pr = ppr.find(W_NS + 'numPr') if ppr is not None else None
+    if num_pr is not None:
+        numbering = (_val(num_pr.find(W_NS + 'numId')), int(_val(num_pr.find(W_NS + 'ilvl'), '0')))
+    else:
+        numbering = context.style_numbering.get(style)
+
+    level = context.headings.get(style)
+    if level is None and ppr is not None:
+        outline = _val(ppr.find(W_NS + 'outlineLvl'))
+        if outline is not None and outline.isdigit() and int(outline) < 9:
+            level = int(outline) + 1
+    if level is not None:
+        return 'block', ('#' * min(level, 6) + ' ' + text if markdown else text)
+
+    if numbering is not None and numbering[0] not in (None, '0'):
+        num_id, ilvl = numbering
+        counts = counters.setdefault(num_id, [0] * 10)
+        ilvl = min(ilvl, 9)
+        counts[ilvl] += 1
+        counts[ilvl + 1:] = [0] * (9 - ilvl)
+        marker = f'{counts[ilvl]}.' if context.is_ordered(num_id, ilvl) else '-'
+        return 'list', '  ' * ilvl + marker + ' ' + text.replace('\n', '\n' + '  ' * (ilvl + 1))
+
+    return 'block', text
+
+def _render_table(tbl, context, markdown):
+    rows = []
+    for tr in tbl.iter(W_NS + 'tr'):
+        if tr.getparent() is not tbl:
+            # rows of nested tables end up in the text of their cell
+            continue
+        cells = []
+        for tc in tr.iter(W_NS + 'tc'):
+            if tc.getparent() is not tr:
+                continue
+            paragraphs = [_format_runs(_run_segments(p, context), markdown).strip() for p in tc.iter(W_NS + 'p')]
+            if markdown:
+                text = ' <br> '.join(p for p in paragraphs if p).replace('\n', ' <br> ').replace('|', '\\|')
+            else:
+                text = ' '.join(p for p in paragraphs if p).replace('\n', ' ').replace('\t', ' ')
+            cells.append(text)
+            tc_pr = tc.find(W_NS + 'tcPr')
+            span = _val(tc_pr.find(W_NS + 'gridSpan')) if tc_pr is not None else None
+            if span and span.isdigit():
+                cells.extend([''] * (int(span) - 1))
+        rows.append(cells)
+    if not any(any(cells) for cells in rows):
+        return None
+
+    if not markdown:
+        return '\n'.join('\t'.join(cells) for cells in rows)
+    width = max(len(cells) for cells in rows)
+    lines = []
+    for i, cells in enumerate(rows):
+        lines.append('| ' + ' | '.join(cells + [''] * (width - len(cells))) + ' |')
+        if i == 0:
+            lines.append('|' + ' --- |' * width)
+    return '\n'.join(lines)
+
+def _render_block(elem, context, markdown, counters):
+    """Yield (kind, text) for a block-level element of the body."""
+    if elem.tag == W_NS + 'p':
+        rendered = _render_paragraph(elem, context, markdown, counters)
+        if rendered:
+            yield rendered
+    elif elem.tag == W_NS + 'tbl':
+        table = _render_table(elem, context, markdown)
+        if table:
+            yield 'block', table
+    elif elem.tag in (W_NS + 'sdt', W_NS + 'sdtContent', W_NS + 'customXml'):
+        for child in elem:
+            yield from _render_block(child, context, markdown, counters)
+
+def render_content(file_path, out, markdown=True):
+    """Write the content of a DOCX file as Markdown or plain text, streaming over the body like convert_docx()."""
+    with zipfile.ZipFile(file_path) as docx:
+        context = _DocxContext(docx)
+        with docx.open('word/document.xml') as document_xml:
+            counters = {}
+            previous = None
+            depth = 0
+            for event, elem in etree.iterparse(document_xml, events=("start", "end"), huge_tree=True,
+                                               remove_comments=True, remove_pis=True):
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth != stream_depth:
+                    continue
+
+                for kind, text in _render_block(elem, context, markdown, counters):
+                    if previous is not None:
+                        # list items stay together; Markdown needs blank lines between other blocks
+                        out.write('\n' if not markdown or previous == kind == 'list' else '\n\n')
+                    out.write(text)
+                    previous = kind
+
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+    if previous is not None:
+        out.write('\n')
+
+def write_docx(file_path, out, mode=None):
+    """Write a DOCX file to the text stream out in one of MODES, default_mode if None."""
+    mode = mode or default_mode
+    if mode == "json":
+        convert_docx(file_path, out)
+    elif mode == "json-min":
+        convert_docx(file_path, out, compact=True)
+    elif mode in ("markdown", "text"):
+        render_content(file_path, out, markdown=mode == "markdown")
+    else:
+        raise ValueError(f"Unknown DOCX output mode {mode!r}, expected one of {', '.join(MODES)}")
+
+def render_docx(file_path, mode=None):
+    """Return a DOCX file as a string in one of MODES, default_mode if None."""
+    out = io.StringIO()
+    write_docx(file_path, out, mode)
+    return out.getvalue()
+
+def process_docx(file_path):
+    return render_docx(file_path, "json")
+
+class _SizeCounter:
+    """Text stream that only counts what is written to it."""
+
+    def __init__(self):
+        self.chars = 0
+        self.bytes = 0
+        self.lines = 0
+
+    def write(self, s):
+        self.chars += len(s)
+        self.bytes += len(s.encode('utf-8'))
+        self.lines += s.count('\n')
+        return len(s)
+
+def docx_stats(file_path, modes=MODES) -> dict:
+    """Size of a DOCX file in each output mode.
+
+    Args:
+    file_path: The DOCX file.
+    modes: The output modes to measure.
+
+    Returns:
+    For each mode: characters, UTF-8 bytes, lines, estimated tokens, the size
+    relative to the first mode, and the conversion time in seconds.
+    """
+    stats = {}
+    for mode in modes:
+        counter = _SizeCounter()
+        start = time.perf_counter()
+        write_docx(file_path, counter, mode)
+        stats[mode] = {"chars": counter.chars, "bytes": counter.bytes, "lines": counter.lines,
+                       "est_tokens": int(counter.chars / context_window.chars_per_token),
+                       "seconds": round(time.perf_counter() - start, 4)}
+    base = stats[modes[0]]["chars"] if modes else 0
+    for mode_stats in stats.values():
+        mode_stats["ratio"] = round(mode_stats["chars"] / base, 4) if base else None
+    return stats
+
+def check_docx(file_path) -> list:
+    """Compare convert_docx() with convert_docx_tree() on a file.
+
+    Returns:
+    The JSON modes ("json", "json-min") in which the two differ.
+    """
+    mismatches = []
+    for mode, compact in (("json", False), ("json-min", True)):
+        out = io.StringIO()
+        convert_docx(file_path, out, compact=compact)
+        if out.getvalue() != convert_docx_tree(file_path, compact=compact):
+            mismatches.append(mode)
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a DOCX file to text for a prompt")
+    parser.add_argument("files", nargs="+", metavar="file")
+    parser.add_argument("--mode", choices=MODES, default=default_mode)
+    parser.add_argument("--stats", action="store_true", help="print the size of every mode instead")
+    parser.add_argument("--check", action="store_true",
+                        help="compare the streaming JSON conversion with the whole-tree one instead")
+    args = parser.parse_args()
+
+    failed = False
+    for file in args.files:
+        if args.check:
+            mismatches = check_docx(file)
+            failed = failed or bool(mismatches)
+            print(f"{file}: {'differs in ' + ', '.join(mismatches) if mismatches else 'same'}")
+        elif args.stats:
+            print(json.dumps(docx_stats(file), indent=2))
+        else:
+            write_docx(file, sys.stdout, args.mode)
+    if failed:
+        sys.exit(1)
 
-            return docx_json
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Chat history files: versioned NDJSON, gzip-compressed by default.
+
+The first line is a header, {"format": "mlx_chat_history", "version": 2,
+"system_prompt": ...}. Every following line holds either an attachment,
+{"file": {"sha256", "name", "size", "data"?}}, or a turn, {"turn": [user, assistant]}.
+A side of a turn is text, null, or a reference {"sha256", "name"} to an
+attachment line that came before it. Attachments are written once per content,
+however often the history refers to them, with their content base64-encoded
+up to max_embed_bytes; only embedded content is restored on import.
+
+Files are written and read line by line, so neither needs the whole history in
+memory. The JSON formats exported before, {"history": [...], "system_prompt": ...}
+and a bare history list, are still read.
+"""
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+
+import upload_store
+
+FORMAT = "mlx_chat_history"
+VERSION = 2
+
+compress = os.environ.get("MLX_CHAT_HISTORY_GZIP", "1") not in ("", "0")
+# Attachments up to this size are embedded in exports; larger ones are referenced by hash and name
+max_embed_bytes = int(os.environ.get("MLX_CHAT_HISTORY_EMBED_BYTES", str(8 * 1024 * 1024)))
+# Imports are read up to this many (decompressed) bytes
+max_import_bytes = int(os.environ.get("MLX_CHAT_HISTORY_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Under the temp directory, where Gradio serves files from: attachments of
+# imported histories by hash, and exports, each removed after max age seconds
+# unused, checked on the next import or export
+import_dir = os.path.join(tempfile.gettempdir(), "mlx_chat", "imported")
+import_max_age = 86400
+export_dir = os.path.join(tempfile.gettempdir(), "mlx_chat", "exports")
+export_max_age = 86400
+
+read_size = 1024 * 1024
+missing_note = "[{name}: attachment not included in the history file]"
+
+class HistoryTooLarge(ValueError):
+    pass
+
+def _file_digest(path: str) -> str:
+    store = upload_store.get_store()
+    if store is not None:
+        return store.digest(path)
+    h = hashlib.sha256()
+    with open(path, mode="rb") as f:
+        for block in iter(lambda: f.read(read_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _file_path(part):
+    """The path of a file message in Gradio's history, None for text."""
+    if isinstance(part, (tuple, list)) and part and isinstance(part[0], str):
+        return part[0]
+    if isinstance(part, dict):
+        # the frontend's file messages, as the JSON export had them
+        file = part.get("file", part)
+        if isinstance(file, dict) and isinstance(file.get("path"), str):
+            return file["path"]
+    return None
+
+def iter_lines(history, system_prompt):
+    """Yields the lines of a history file, without line breaks."""
+    yield json.dumps({"format": FORMAT, "version": VERSION, "system_prompt": system_prompt or ""}, ensure_ascii=False)
+
+    written = set()
+    for entry in history:
+        turn = []
+        for part in entry:
+            path = _file_path(part)
+            if path is None:
+                turn.append(part)
+                continue
+            name = os.path.basename(path)
+            try:
+                digest = _file_digest(path)
+            except OSError:
+                turn.append(missing_note.format(name=name))
+                continue
+            if digest not in written:
+                written.add(digest)
+                size = os.path.getsize(path)
+                file = {"sha256": digest, "name": name, "size": size}
+                if size <= max_embed_bytes:
+                    with open(path, mode="rb") as f:
+                        file["data"] = base64.b64encode(f.read()).decode("ascii")
+                yield json.dumps({"file": file}, ensure_ascii=False)
+            turn.append({"sha256": digest, "name": name})
+        yield json.dumps({"turn": turn}, ensure_ascii=False)
+
+def write_history(path: str, history, system_prompt, gzipped=None):
+    """Writes history to path, gzip-compressed unless gzipped is False (None for compress)."""
+    gzipped = compress if gzipped is None else gzipped
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with (gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) if gzipped
+          else open(tmp, "w", encoding="utf-8")) as f:
+        for line in iter_lines(history, system_prompt):
+            f.write(line)
+            f.write("\n")
+    os.replace(tmp, path)
+
+def _prune(directory: str, max_age: float):
+    """Removes the files and directories in directory last modified more than max_age seconds ago."""
+    now = time.time()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        old = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(old) > max_age:
+                if os.path.isdir(old):
+                    shutil.rmtree(old)
+                else:
+                    os.remove(old)
+        except OSError:
+            pass
+
+def export_history(history, system_prompt) -> str:
+    """Writes history to a new file for download and returns its path."""
+    os.makedirs(export_dir, exist_ok=True)
+    _prune(export_dir, export_max_age)
+    suffix = ".ndjson.gz" if compress else ".ndjson"
+    path = os.path.join(tempfile.mkdtemp(dir=export_dir), "chat_history" + suffix)
+    write_history(path, history, system_prompt)
+    return path
+
+class _CappedReader(io.RawIOBase):
+    """Binary stream that raises HistoryTooLarge past limit bytes."""
+
+    def __init__(self, raw, limit: int):
+        self.raw = raw
+        self.limit = limit
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        self.count += len(data)
+        if self.count > self.limit:
+            raise HistoryTooLarge(f"History file exceeds {self.limit} bytes")
+        buffer[:len(data)] = data
+        return len(data)
+
+def _restore(file: dict) -> str:
+    """Puts an attachment of a history file where Gradio serves files from; returns its path or None.
+
+    Only content embedded in the file is restored: knowing a digest must not
+    give access to what someone else uploaded or imported.
+    """
+    digest = file.get("sha256")
+    name = file.get("name")
+    name = (os.path.basename(name) if isinstance(name, str) else "") or "attachment"
+    if not isinstance(digest, str) or len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+        return None
+    data = file.get("data")
+    if not isinstance(data, str):
+        return None
+    data = base64.b64decode(data)
+    if hashlib.sha256(data).hexdigest() != digest:
+        return None
+
+    path = os.path.join(import_dir, digest, name)
+    if os.path.exists(path):
+        try:
+            # in use again: not to be pruned
+            os.utime(os.path.dirname(path))
+        except OSError:
+            pass
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, mode="wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path
+
+def _is_reference(part) -> bool:
+    return isinstance(part, dict) and isinstance(part.get("sha256"), str) and isinstance(part.get("name"), str)
+
+def _check_turn(turn, is_file):
+    """Raises ValueError unless turn is a [user, assistant] pair of text, None or what is_file() accepts."""
+    if (not isinstance(turn, list) or len(turn) != 2
+            or not all(part is None or isinstance(part, str) or is_file(part) for part in turn)):
+        raise ValueError("Not a chat history file")
+
+def _legacy_part(part):
+    path = _file_path(part)
+    if path is None:
+        return part
+    if os.path.exists(path):
+        return (path,)
+    return missing_note.format(name=os.path.basename(path))
+
+def read_history(path: str, system_prompt="", limit: int = None) -> tuple:
+    """Reads a history file of any supported format.
+
+    Args:
+    path: The file, gzip-compressed or not.
+    system_prompt: Returned for formats that do not carry one.
+    limit: Decompressed bytes to read at most, None for max_import_bytes.
+
+    Returns:
+    Gradio's tuple-format history and the system prompt.
+
+    Raises:
+    HistoryTooLarge: The file exceeds the limit.
+    ValueError: The file is not a history file, or is corrupt.
+    """
+    limit = max_import_bytes if limit is None else limit
+    _prune(import_dir, import_max_age)
+    try:
+        return _read(path, system_prompt, limit)
+    except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+        raise ValueError(f"Corrupt history file: {e}") from e
+
+def _read(path: str, system_prompt, limit: int) -> tuple:
+    with open(path, mode="rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+        f.seek(0)
+        raw = gzip.GzipFile(fileobj=f, mode="rb") if gzipped else f
+        text = io.TextIOWrapper(io.BufferedReader(_CappedReader(raw, limit), read_size),
+                                encoding="utf-8", errors="replace")
+        first = text.readline()
+        try:
+            header = json.loads(first)
+        except ValueError:
+            header = None
+
+        if isinstance(header, dict) and header.get("format") == FORMAT:
+            if not isinstance(header.get("version", 0), int):
+                raise ValueError("Not a chat history file")
+            if header.get("version", 0) > VERSION:
+                raise ValueError(f"History file version {header.get('version')} is newer than this app supports")
+            if not isinstance(header.get("system_prompt", ""), str):
+                raise ValueError("Not a chat history file")
+            files = {}
+            history = []
+            for line in text:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if not isinstance(item, dict):
+                    raise ValueError("Not a chat history file")
+                if "file" in item:
+                    file = item["file"]
+                    if not isinstance(file, dict):
+                        raise ValueError("Not a chat history file")
+                    restored = _restore(file)
+                    if restored:
+                        files[file["sha256"]] = restored
+                elif "turn" in item:
+                    _check_turn(item["turn"], _is_reference)
+                    turn = []
+                    for part in item["turn"]:
+                        if isinstance(part, dict):
+                            restored = files.get(part["sha256"])
+                            turn.append((restored,) if restored else missing_note.format(name=part["name"]))
+                        else:
+                            turn.append(part)
+                    history.append(turn)
+            return history, header.get("system_prompt", "")
+
+        # the JSON formats from before: one document, read whole within the limit
+        import_data = json.loads(first + text.read())
+
+    # Check if 'history' key exists for backward compatibility
+    if isinstance(import_data, dict) and 'history' in import_data:
+        history = import_data['history']
+        system_prompt = import_data.get('system_prompt', '')  # Set default if not present
+    elif isinstance(import_data, list):
+        # Assume it's an old format with only history data, keep the current system prompt
+        history = import_data
+    else:
+        raise ValueError("Not a chat history file")
+    if not isinstance(history, list) or not isinstance(system_prompt, str):
+        raise ValueError("Not a chat history file")
+    for entry in history:
+        _check_turn(entry, lambda part: _file_path(part) is not None)
+    return [[_legacy_part(part) for part in entry] for entry in history], system_prompt
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+import base64
+import hashlib
+import io
+import os
+import threading
+
+import upload_store
+
+# Pillow is imported in prepare(), on the first image rather than at startup
+
+# Longest image side in pixels sent to a model; larger images are downscaled.
+# Models not listed get default_max_side (0 = never downscale).
+model_max_side = {
+    "mlx-community/llava-1.5-7b-4bit": 672,
+}
+default_max_side = 1024
+
+# Codec for downscaled images ("jpeg", "webp" or "png") and quality for the lossy ones
+image_format = os.environ.get("MLX_CHAT_IMAGE_FORMAT", "jpeg")
+image_quality = 85
+
+# Bounds of the prepared image cache
+cache_entries = 256
+cache_bytes = 64 * 1024 * 1024
+
+def sniff_format(data: bytes):
+    """Returns "png", "jpeg", "gif" or "webp" from the magic number, or None for other data."""
+    if data.startswith(b'\x89PNG'):
+        return 'png'
+    if data.startswith(b'\xFF\xD8'):
+        return 'jpeg'
+    if data.startswith(b'GIF8'):
+        return 'gif'
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def max_side_for(model: str) -> int:
+    return model_max_side.get(model, default_max_side)
+
+def data_url(data: bytes, fmt: str) -> str:
+    return f"data:image/{fmt};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def prepare(data: bytes, max_side: int = None, fmt: str = None, quality: int = None) -> str:
+    """Downscales an image to max_side and re-encodes it.
+
+    Images that are already small enough are passed through unchanged, as are
+    animated GIFs.
+
+    Args:
+    data: The image file contents.
+    max_side: Longest side in pixels, None for default_max_side, 0 for no limit.
+    fmt: Codec for re-encoded images, None for image_format.
+    quality: Quality for jpeg and webp, None for image_quality.
+
+    Returns:
+    The image as a data URL.
+    """
+    source_format = sniff_format(data)
+    if source_format is None:
+        raise ValueError("Unknown image type")
+    max_side = default_max_side if max_side is None else max_side
+    fmt = (fmt or image_format).lower()
+
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(data))
+    if not max_side or max(img.size) <= max_side or getattr(img, "is_animated", False):
+        return data_url(data, source_format)
+
+    # let the JPEG decoder skip detail that would be scaled away anyway
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if fmt == "jpeg" and img.mode != "RGB":
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt.upper(), quality=quality or image_quality)
+    return data_url(buffer.getvalue(), fmt)
+
+class ImageCache:
+    """Prepared images by content hash and target size, bounded by entry count and size.
+
+    Conversations re-send their images with every turn; this keeps each one
+    from being decoded, scaled and encoded again.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, store=None):
+        self.store = store      # upload_store.UploadStore to hash files with and keep prepared images in
+        self.max_entries = max_entries or cache_entries
+        self.max_bytes = max_bytes or cache_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.file_hashes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _file_hash(self, fn: str):
+        if self.store is not None:
+            return self.store.digest(fn), None
+
+        st = os.stat(fn)
+        key = (fn, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            digest = self.file_hashes.get(key)
+            if digest is not None:
+                self.file_hashes.move_to_end(key)
+                return digest, None
+
+        with open(fn, mode="rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self.file_hashes[key] = digest
+            while len(self.file_hashes) > 4 * self.max_entries:
+                self.file_hashes.popitem(last=False)
+        return digest, data
+
+    def get(self, fn: str, model: str = None) -> str:
+        """Returns the image file fn prepared for model as a data URL."""
+        digest, data = self._file_hash(fn)
+        key = (digest, max_side_for(model), image_format, image_quality)
+
+        with self.lock:
+            url = self.entries.get(key)
+            if url is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return url
+            self.misses += 1
+
+        url = None
+        if self.store is not None:
+            artifact = upload_store.artifact_name("image", list(key[1:]))
+            url = self.store.load_artifact(digest, artifact)
+        if url is None:
+            if data is None:
+                with open(fn, mode="rb") as f:
+                    data = f.read()
+            url = prepare(data, key[1], key[2], key[3])
+            if self.store is not None:
+                self.store.save_artifact(digest, artifact, url)
+
+        with self.lock:
+            if key not in self.entries and len(url) <= self.max_bytes:
+                self.entries[key] = url
+                self.bytes += len(url)
+                while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                    _, old = self.entries.popitem(last=False)
+                    self.bytes -= len(old)
+
+        return url
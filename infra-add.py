@@ -1,9 +1,11 @@
-import requests
+import sys
 
-url = "http://localhost:8000/v1/models"
-params = {
-    "model_name": "google/gemma-2-9b-it",
-}
+from model_manager import get_manager
 
-response = requests.post(url, params=params)
-print(response.json())
\ No newline at end of file
+models = sys.argv[1:] or ["google/gemma-2-9b-it"]
+
+# loads on every backend and sends a warm-up request, so the first chat does not wait
+manager = get_manager()
+for model in models:
+    future = manager.ensure_loaded(model)
+    print(model, future.result() if future is not None else "already loaded")
@@ -1,11 +1,9 @@
-import requests
+from model_manager import get_manager
 
-url = "http://localhost:8000/v1/supported_models"
-response = requests.get(url)
+manager = get_manager()
 print("-- Supported\n")
-print(response.json())
+print(manager.supported_models())
 
-url = "http://localhost:8000/v1/models"
-response = requests.get(url)
 print("\n\n-- Models\n")
-print(response.json())
\ No newline at end of file
+for backend_url, models in manager.refresh(force=True).items():
+    print(backend_url, sorted(models))
@@ -0,0 +1,172 @@
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import image_prep
+import pdf_pipeline
+
+# Bytes read from one uploaded file (for DOCX and PDF: characters of extracted text)
+max_file_bytes = int(os.environ.get("MLX_CHAT_MAX_FILE_BYTES", str(8 * 1024 * 1024)))
+# Characters of attachment text in one request, over the files of the whole
+# history and the new message; files are read no further than what is left of it
+max_request_chars = int(os.environ.get("MLX_CHAT_MAX_REQUEST_CHARS", str(2 * 1024 * 1024)))
+
+# The type of a file is told from this many leading bytes
+sniff_bytes = 4096
+read_size = 256 * 1024
+
+truncation_marker = "\n[... {name}: truncated after {kept} of {total} ...]\n"
+
+# The files of a turn are encoded on up to this many threads at once. DOCX
+# files of at least process_min_bytes are converted in pdf_pipeline's worker
+# processes, smaller ones in the thread to skip the round trip
+max_workers = int(os.environ.get("MLX_CHAT_INGEST_WORKERS", str(min(8, (os.cpu_count() or 1) + 4))))
+process_min_bytes = 256 * 1024
+
+# Seconds a turn waits for its files; those not done by then are left out of
+# that turn and included in the next, once they are
+time_budget = float(os.environ.get("MLX_CHAT_INGEST_BUDGET", "60"))
+late_note = "\n[{name}: still being processed after {seconds:g} s, not included in this message]\n"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class CapReached(Exception):
+    pass
+
+class CharBudget:
+    """Characters of attachment text a request may still read, shared by the threads encoding its files."""
+
+    def __init__(self, chars: int):
+        self.left = max(chars, 0)
+        self.lock = threading.Lock()
+
+    def reserve(self, chars: int) -> int:
+        """Takes up to chars from the budget; returns how many were granted."""
+        with self.lock:
+            granted = min(chars, self.left)
+            self.left -= granted
+            return granted
+
+    def release(self, chars: int):
+        """Returns reserved characters that were not read."""
+        with self.lock:
+            self.left += chars
+
+def sniff(fn: str, head: bytes = None) -> str:
+    """Returns "image", "pdf", "docx", "binary" or "text" from the start of the file."""
+    if head is None:
+        with open(fn, mode="rb") as f:
+            head = f.read(sniff_bytes)
+    if image_prep.sniff_format(head):
+        return "image"
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04") and fn.lower().endswith(".docx"):
+        return "docx"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "text"
+    if b"\x00" in head:
+        return "binary"
+    return "text"
+
+def _text_encoding(head: bytes) -> str:
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    return "utf-8-sig"
+
+def marker(name: str, kept: str, total: str) -> str:
+    return truncation_marker.format(name=name, kept=kept, total=total)
+
+def read_text(fn: str, max_bytes: int = None) -> str:
+    """Reads a text file of any size with at most max_bytes of it in memory.
+
+    The file is decoded block by block (UTF-8, or UTF-16 with a byte order
+    mark; invalid bytes are replaced). Past max_bytes reading stops and a
+    truncation marker is appended.
+
+    Args:
+    fn: The file.
+    max_bytes: Bytes to read at most, None for max_file_bytes, 0 for no limit.
+
+    Returns:
+    The decoded text.
+    """
+    limit = max_file_bytes if max_bytes is None else max_bytes
+    size = os.path.getsize(fn)
+    parts = []
+    consumed = 0
+    with open(fn, mode="rb") as f:
+        head = f.read(min(sniff_bytes, limit) if limit else sniff_bytes)
+        decoder = codecs.getincrementaldecoder(_text_encoding(head))(errors="replace")
+        block = head
+        while block:
+            consumed += len(block)
+            parts.append(decoder.decode(block))
+            if limit and consumed >= limit:
+                break
+            block = f.read(min(read_size, limit - consumed) if limit else read_size)
+        # a character cut by the limit is dropped rather than replaced
+        parts.append(decoder.decode(b"", final=consumed >= size))
+
+    if consumed < size:
+        parts.append(marker(os.path.basename(fn), f"{consumed} bytes", f"{size} bytes"))
+    return "".join(parts)
+
+def cap_text(text: str, limit: int, name: str) -> str:
+    """Cuts text to limit characters, marking the cut."""
+    if len(text) <= limit:
+        return text
+    return text[:limit] + marker(name, f"{limit} characters", f"{len(text)} characters")
+
+def late(name: str, seconds: float) -> dict:
+    """Stands in for a file that was not encoded within the time budget."""
+    return {"text": late_note.format(name=name, seconds=seconds), "late": True}
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        return _pool
+
+def convert_docx(fn: str, limit: int = None) -> str:
+    """Converts a DOCX file as doc2json.default_mode selects, up to limit characters (None for max_file_bytes)."""
+    # lxml, through doc2json, is loaded with the first DOCX rather than at startup
+    import doc2json
+
+    out = CappedWriter(max_file_bytes if limit is None else limit)
+    try:
+        doc2json.write_docx(fn, out)
+        return out.getvalue()
+    except CapReached:
+        return out.getvalue() + marker(os.path.basename(fn), f"{out.chars} characters", "the document")
+
+def docx_text(fn: str, limit: int = None) -> str:
+    """convert_docx() in a worker process for large files, so conversions of several files run in parallel."""
+    if os.path.getsize(fn) < process_min_bytes:
+        return convert_docx(fn, limit)
+    return pdf_pipeline.get_pool().submit(convert_docx, fn, limit).result()
+
+class CappedWriter:
+    """Text stream that keeps at most limit characters and raises CapReached past them."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.parts = []
+        self.chars = 0
+
+    def write(self, s):
+        room = self.limit - self.chars
+        if len(s) > room:
+            self.parts.append(s[:room])
+            self.chars = self.limit
+            raise CapReached()
+        self.parts.append(s)
+        self.chars += len(s)
+        return len(s)
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
@@ -0,0 +1,225 @@
+import bisect
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Metrics are off unless MLX_CHAT_METRICS is set; disabled metrics return
+# right away from every call, so instrumentation can stay on the hot path
+enabled = os.environ.get("MLX_CHAT_METRICS", "") not in ("", "0")
+metrics_host = os.environ.get("MLX_CHAT_METRICS_HOST", "127.0.0.1")
+metrics_port = int(os.environ.get("MLX_CHAT_METRICS_PORT", "9100"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+LOAD_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 900)
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7, 1e8)
+
+_registry = []
+
+# Values of the "model" label: models the backends reported, as they are. Any
+# other name, such as one typed into the model dropdown that no backend has,
+# is counted as OTHER_MODEL, so user input cannot add label values without bound
+known_models = set()
+OTHER_MODEL = "other"
+
+# Operator endpoints served next to /metrics: path -> function(method, query) returning a JSON-able dict
+admin_routes = {}
+
+def register_models(models):
+    """Adds model names that are used as they are in the "model" label."""
+    known_models.update(model for model in models if model)
+
+def _label_key(labels: dict) -> tuple:
+    model = labels.get("model")
+    if model is not None and model not in known_models:
+        labels = dict(labels, model=OTHER_MODEL)
+    return tuple(sorted(labels.items()))
+
+def _escape(value) -> str:
+    # label values in the text exposition format: backslash, double quote and line feed are escaped
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+        self.values = {}
+        _registry.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not enabled:
+            return
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        if not enabled:
+            return
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        if not enabled:
+            return
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not enabled:
+            return
+        key = _label_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += n
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def percentiles(values) -> dict:
+    """Summarizes samples as p50/p95/p99, mean and max, as batch.py and the benchmarks report them."""
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pct(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {"p50": pct(50), "p95": pct(95), "p99": pct(99),
+            "mean": sum(values) / len(values), "max": values[-1], "n": len(values)}
+
+requests_total = Counter("mlx_chat_requests_total", "Chat requests by model")
+prompt_build_seconds = Histogram("mlx_chat_prompt_build_seconds", "Time to assemble the prompt messages")
+prompt_chars = Histogram("mlx_chat_prompt_chars", "Serialized prompt size in characters", SIZE_BUCKETS)
+prompt_shared_prefix_chars = Counter("mlx_chat_prompt_shared_prefix_chars_total", "Prompt characters shared with the session's previous request")
+prompt_chars_total = Counter("mlx_chat_prompt_chars_total", "Serialized prompt characters sent")
+prompt_trimmed_tokens = Counter("mlx_chat_prompt_trimmed_tokens_total", "Estimated prompt tokens left out to fit the context window")
+attachment_bytes = Histogram("mlx_chat_attachment_bytes", "Size of encoded attachment files", SIZE_BUCKETS)
+encode_file_seconds = Histogram("mlx_chat_encode_file_seconds", "Time to read and encode an attachment")
+upstream_connect_seconds = Histogram("mlx_chat_upstream_connect_seconds", "Time from sending a request to the backend's response headers")
+upstream_responses = Counter("mlx_chat_upstream_responses_total", "Backend responses by status code")
+upstream_errors = Counter("mlx_chat_upstream_errors_total", "Backend requests that failed without a response")
+inflight_streams = Gauge("mlx_chat_inflight_streams", "Backend streams currently open")
+backend_healthy = Gauge("mlx_chat_backend_healthy", "1 if the backend passed its last health check")
+ttft_seconds = Histogram("mlx_chat_ttft_seconds", "Time from receiving a chat request to the first token")
+stream_seconds = Histogram("mlx_chat_stream_seconds", "Time from the first to the last token")
+tokens_per_second = Histogram("mlx_chat_tokens_per_second", "Streaming rate after the first token", RATE_BUCKETS)
+completion_chunks = Counter("mlx_chat_completion_chunks_total", "Content deltas received from the backend")
+streams_aborted = Counter("mlx_chat_streams_aborted_total", "Backend streams closed early because the reader went away")
+aborted_stream_chunks = Counter("mlx_chat_aborted_stream_chunks_total", "Content deltas received on streams that were aborted")
+aborted_token_budget = Counter("mlx_chat_aborted_token_budget_total", "Completion tokens that aborted streams still had left of max_tokens")
+response_cache_requests = Counter("mlx_chat_response_cache_requests_total", "Response cache lookups by result (hit, miss, bypass)")
+upstream_truncated = Counter("mlx_chat_upstream_truncated_total", "Backend streams that ended without the [DONE] marker")
+queue_depth = Gauge("mlx_chat_queue_depth", "Requests waiting for a backend slot")
+queue_wait_seconds = Histogram("mlx_chat_queue_wait_seconds", "Time requests waited for a backend slot")
+queue_rejected = Counter("mlx_chat_queue_rejected_total", "Requests turned away because too many were waiting")
+scheduled_streams = Gauge("mlx_chat_scheduled_streams", "Backend streams admitted by the scheduler")
+coalesced_streams = Counter("mlx_chat_coalesced_streams_total", "Streams by role: leader runs the backend generation, followers join it")
+model_load_seconds = Histogram("mlx_chat_model_load_seconds", "Time to load (phase=load) and warm up (phase=warmup) a model", LOAD_BUCKETS)
+model_loaded = Gauge("mlx_chat_model_loaded", "1 if the model is loaded on some backend")
+upload_store_bytes = Gauge("mlx_chat_upload_store_bytes", "Disk space used by the upload store")
+upload_store_files = Counter("mlx_chat_upload_store_files_total", "Uploads added to the store by result (new, duplicate)")
+upload_store_artifacts = Counter("mlx_chat_upload_store_artifacts_total", "Derived artifact lookups by result (hit, miss)")
+upload_store_evictions = Counter("mlx_chat_upload_store_evictions_total", "Store entries removed to stay within the quota")
+profiles_written = Counter("mlx_chat_profiles_written_total", "Chat requests profiled by profiling.py")
+retrieval_indexes = Counter("mlx_chat_retrieval_indexes_total", "Retrieval index lookups by source (memory, disk, built)")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, content_type, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _admin(self, method) -> bool:
+        url = urlsplit(self.path)
+        route = admin_routes.get(url.path)
+        if route is None:
+            return False
+        try:
+            result = route(method, parse_qs(url.query))
+        except ValueError as e:
+            self._send(400, "application/json", json.dumps({"error": str(e)}).encode('utf-8'))
+            return True
+        self._send(200, "application/json", json.dumps(result).encode('utf-8'))
+        return True
+
+    def do_GET(self):
+        if self._admin("GET"):
+            return
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        self._send(200, "text/plain; version=0.0.4; charset=utf-8", render().encode('utf-8'))
+
+    def do_POST(self):
+        if not self._admin("POST"):
+            self.send_error(404)
+
+def start_server(host=None, port=None) -> ThreadingHTTPServer:
+    """Serves /metrics on a background thread, next to the Gradio server."""
+    server = ThreadingHTTPServer((host or metrics_host, metrics_port if port is None else port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
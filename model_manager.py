@@ -0,0 +1,290 @@
+"""Keeps the models the chat UI offers loaded and warm on the FastMLX backends.
+
+Usage: python model_manager.py [list | load MODEL [MODEL ...] | unload MODEL [MODEL ...]]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+import sys
+import threading
+import time
+
+import httpx
+
+import backend
+import metrics
+import scheduler
+
+# Models loaded and warmed up when the app starts, comma-separated
+preload_models = [m.strip() for m in os.environ.get("MLX_CHAT_PRELOAD_MODELS", "").split(",") if m.strip()]
+
+# Models kept loaded besides the preloaded ones, chosen by how often they are
+# picked; others are unloaded. 0 keeps whatever is loaded
+max_loaded_models = int(os.environ.get("MLX_CHAT_MAX_LOADED_MODELS", "0"))
+# A pick counts half as much after this many seconds
+usage_half_life = 3600.0
+# Seconds until a model that was in use when it should have been unloaded is tried again
+unload_retry_interval = 30.0
+
+# Offered while no backend can be asked what it has loaded
+fallback_models = ["meta-llama/Meta-Llama-3.1-8B-Instruct", "google/gemma-2-9b-it"]
+
+# Loading downloads and maps the weights, which takes minutes on first use
+load_timeout = 900.0
+request_timeout = 10.0
+# Seconds a listing of the loaded models is reused
+refresh_interval = 5.0
+
+warmup_messages = [{"role": "user", "content": "Hi"}]
+warmup_max_tokens = 1
+
+def parse_supported(data) -> list:
+    """Extracts model names from a /v1/supported_models response, which groups them by kind."""
+    if isinstance(data, dict):
+        names = []
+        for value in data.values():
+            names.extend(value if isinstance(value, list) else [])
+        return names
+    return list(data or [])
+
+def list_models(client: httpx.Client, url: str) -> set:
+    response = client.get(f"{url}/v1/models", timeout=request_timeout)
+    response.raise_for_status()
+    return backend.parse_models(response.json())
+
+def list_supported(client: httpx.Client, url: str) -> list:
+    response = client.get(f"{url}/v1/supported_models", timeout=request_timeout)
+    response.raise_for_status()
+    return parse_supported(response.json())
+
+class ModelManager:
+    """Loads, warms up and unloads models ahead of the chat requests that need them.
+
+    Management calls run on a single worker thread with their own HTTP client,
+    so they neither block nor share the event loop of the chat streams, and
+    loads reach the backends one at a time.
+    """
+
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self.client = httpx.Client(timeout=httpx.Timeout(load_timeout, connect=request_timeout))
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-manager")
+        self.lock = threading.Lock()
+        self.loaded = {}        # url -> loaded models
+        self.listed_at = 0.0
+        self.loading = {}       # model -> future of its load
+        self.usage = {}         # model -> (decayed pick count, time of last pick)
+        self.timings = {}       # model -> {"load_s", "warmup_s", "loaded_at"}
+        self.selected = None    # model picked last
+        self.retry = None       # timer of a deferred plan()
+
+    def refresh(self, force: bool = False) -> dict:
+        """Asks every backend which models it has loaded, at most every refresh_interval seconds."""
+        with self.lock:
+            if not force and self.listed_at and time.monotonic() - self.listed_at < refresh_interval:
+                return dict(self.loaded)
+        loaded = {}
+        for url in self.urls:
+            try:
+                loaded[url] = list_models(self.client, url)
+            except (httpx.HTTPError, ValueError):
+                continue
+        with self.lock:
+            self.loaded = loaded
+            self.listed_at = time.monotonic()
+        metrics.register_models(set().union(*loaded.values()))
+        for model in set().union(*loaded.values()):
+            metrics.model_loaded.set(1, model=model)
+        return dict(loaded)
+
+    def loaded_models(self) -> set:
+        return set().union(*self.refresh().values())
+
+    def supported_models(self) -> list:
+        supported = []
+        for url in self.urls:
+            try:
+                supported.extend(m for m in list_supported(self.client, url) if m not in supported)
+            except (httpx.HTTPError, ValueError):
+                continue
+        return supported
+
+    def choices(self) -> list:
+        """Loaded models for the model dropdown, most picked first; fallback_models while no backend answers."""
+        loaded = self.refresh()
+        if not loaded:
+            return list(fallback_models)
+        now = time.time()
+        return sorted(set().union(*loaded.values()), key=lambda m: (-self.score(m, now), m))
+
+    def pending_load(self, model: str):
+        """Returns the future of model's load while it is in progress, else None."""
+        with self.lock:
+            future = self.loading.get(model)
+            return future if future is not None and not future.done() else None
+
+    def ensure_loaded(self, model: str):
+        """Loads and warms up model in the background unless it is loaded or loading.
+
+        Returns:
+        The future of the load, or None if the model is already loaded.
+        """
+        future = self.pending_load(model)
+        if future is not None:
+            return future
+        if not model or model in self.loaded_models():
+            return None
+        with self.lock:
+            future = self.loading.get(model)
+            if future is None or future.done():
+                future = self.loading[model] = self.executor.submit(self._load, model)
+            return future
+
+    def _load(self, model: str) -> dict:
+        timing = {}
+        start = time.perf_counter()
+        for url in self.urls:
+            response = self.client.post(f"{url}/v1/models", params={"model_name": model})
+            response.raise_for_status()
+        metrics.register_models([model])
+        timing["load_s"] = time.perf_counter() - start
+        metrics.model_load_seconds.observe(timing["load_s"], model=model, phase="load")
+
+        # the first generation compiles kernels and pages in the weights
+        start = time.perf_counter()
+        for url in self.urls:
+            response = self.client.post(f"{url}/v1/chat/completions",
+                                        json={"model": model, "messages": warmup_messages,
+                                              "max_tokens": warmup_max_tokens, "stream": False})
+            response.raise_for_status()
+        timing["warmup_s"] = time.perf_counter() - start
+        metrics.model_load_seconds.observe(timing["warmup_s"], model=model, phase="warmup")
+
+        timing["loaded_at"] = time.time()
+        with self.lock:
+            self.timings[model] = timing
+        self.refresh(force=True)
+        return timing
+
+    def unload(self, model: str):
+        for url in self.urls:
+            try:
+                self.client.delete(f"{url}/v1/models", params={"model_name": model},
+                                   timeout=request_timeout).raise_for_status()
+            except httpx.HTTPError:
+                continue
+        metrics.model_loaded.set(0, model=model)
+        self.refresh(force=True)
+
+    def preload(self, models=None) -> list:
+        """Starts loading the configured models; returns the futures of the loads."""
+        futures = [self.ensure_loaded(model) for model in (models if models is not None else preload_models)]
+        return [future for future in futures if future is not None]
+
+    def score(self, model: str, now: float = None) -> float:
+        count, last = self.usage.get(model, (0.0, 0.0))
+        return count * math.pow(0.5, ((now or time.time()) - last) / usage_half_life)
+
+    def record_selection(self, model: str):
+        """Counts a pick of model in the dropdown and loads it right away, before the first message."""
+        if not model:
+            return
+        now = time.time()
+        with self.lock:
+            self.usage[model] = (self.score(model, now) + 1.0, now)
+            self.selected = model
+        self.executor.submit(self.plan, model)
+        self.ensure_loaded(model)
+
+    def keep(self, selected: str = None) -> list:
+        """The models to keep loaded: the preloaded ones, then up to max_loaded_models others,
+        the selected model first and the most picked after it."""
+        now = time.time()
+        with self.lock:
+            ranked = sorted(self.usage, key=lambda m: -self.score(m, now))
+        if selected:
+            ranked = [selected] + [m for m in ranked if m != selected]
+        others = [m for m in ranked if m not in preload_models]
+        return list(preload_models) + others[:max_loaded_models]
+
+    def in_use(self, model: str) -> bool:
+        """Whether chats are streaming from model or waiting to."""
+        return backend.model_streams.get(model, 0) > 0 or model in scheduler.busy_models()
+
+    def plan(self, selected: str = None):
+        """Unloads the models that fell out of keep(), if max_loaded_models limits them.
+
+        Models still in use are left loaded until a later plan(), which is
+        retried after unload_retry_interval seconds.
+        """
+        if not max_loaded_models:
+            return
+        keep = set(self.keep(selected))
+        deferred = False
+        for model in self.loaded_models() - keep:
+            if self.pending_load(model) is not None:
+                continue
+            if self.in_use(model):
+                deferred = True
+            else:
+                self.unload(model)
+        if deferred:
+            self._defer_plan()
+
+    def _defer_plan(self):
+        with self.lock:
+            if self.retry is not None:
+                return
+            self.retry = threading.Timer(unload_retry_interval, self._retry_plan)
+            self.retry.daemon = True
+            self.retry.start()
+
+    def _retry_plan(self):
+        with self.lock:
+            self.retry = None
+            selected = self.selected
+        self.executor.submit(self.plan, selected)
+
+    def status(self) -> dict:
+        now = time.time()
+        loaded = self.refresh()
+        return {"loaded": {url: sorted(models) for url, models in loaded.items()},
+                "loading": sorted(m for m in list(self.loading) if self.pending_load(m) is not None),
+                "timings": dict(self.timings),
+                "scores": {m: round(self.score(m, now), 3) for m in self.usage}}
+
+_manager = None
+
+def get_manager() -> ModelManager:
+    """Returns the manager for the configured backend.backend_urls, rebuilding it when they change."""
+    global _manager
+
+    if _manager is None or _manager.urls != backend.backend_urls:
+        _manager = ModelManager(backend.backend_urls)
+    return _manager
+
+def main():
+    manager = get_manager()
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    models = sys.argv[2:]
+
+    if command == "list":
+        print("-- Supported\n")
+        print(manager.supported_models())
+        print("\n\n-- Models\n")
+        for url, loaded in manager.refresh(force=True).items():
+            print(url, sorted(loaded))
+    elif command == "load":
+        for model, future in zip(models, [manager.ensure_loaded(model) for model in models]):
+            timing = future.result() if future is not None else "already loaded"
+            print(model, timing)
+    elif command == "unload":
+        for model in models:
+            manager.unload(model)
+            print(model, "unloaded")
+    else:
+        print(__doc__)
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import atexit
+import base64
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import io
+import multiprocessing
+import os
+import threading
+
+# PyMuPDF (fitz) and Pillow are imported where they are used: importing this
+# module is part of the app's startup, rendering a PDF is not
+
+# Rasterization of pages without a text layer
+render_scale = float(os.environ.get("MLX_CHAT_PDF_SCALE", "0.6"))
+image_format = os.environ.get("MLX_CHAT_PDF_IMAGE_FORMAT", "png")  # "png", "jpeg" or "webp"
+image_quality = 80  # for jpeg and webp
+
+# Pages with fewer characters of extracted text than this are rasterized instead
+min_text_chars = 16
+
+# Pages to ingest by default, e.g. "1-20" (1-based, inclusive); None for all
+default_pages = os.environ.get("MLX_CHAT_PDF_PAGES") or None
+
+# Pages read per document, and pages rendered per document and the size of
+# their data URLs in all; pages past these are passed over with a note
+max_pages = int(os.environ.get("MLX_CHAT_PDF_MAX_PAGES", "500"))
+max_images = int(os.environ.get("MLX_CHAT_PDF_MAX_IMAGES", "20"))
+max_image_bytes = int(os.environ.get("MLX_CHAT_PDF_MAX_IMAGE_BYTES", str(16 * 1024 * 1024)))
+
+# Rendering runs in a process pool once a document has at least this many
+# pages to rasterize; fewer are rendered in-process to skip the pool round trip
+max_workers = max(1, min(8, (os.cpu_count() or 1) - 1))
+parallel_min_pages = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Documents opened by a render worker, so a worker renders many pages of the same file without reopening it
+_worker_docs = {}
+_worker_max_docs = 4
+
+def parse_page_range(spec, page_count: int) -> list:
+    """Returns the 0-based page indices selected by a 1-based spec like "1-3,7,10-".
+
+    Args:
+    spec: Comma-separated pages and ranges, open ranges allowed, or None for all pages.
+    page_count: Number of pages in the document; out-of-range pages are skipped.
+
+    Returns:
+    Sorted page indices without duplicates.
+    """
+    if not spec:
+        return list(range(page_count))
+
+    pages = set()
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        try:
+            first = int(first) if first.strip() else 1
+            last = (int(last) if last.strip() else page_count) if sep else first
+        except ValueError:
+            raise ValueError(f"Invalid page range {part!r}")
+        pages.update(range(max(first, 1) - 1, min(last, page_count)))
+    return sorted(pages)
+
+def encode_pixmap(pix, fmt=None, quality=None) -> str:
+    """Encodes a rendered page as a data URL."""
+    fmt = (fmt or image_format).lower()
+    if fmt == "png":
+        data = pix.tobytes("png")
+    else:
+        from PIL import Image
+
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG" if fmt == "jpg" else fmt.upper(), quality=quality or image_quality)
+        data = buffer.getvalue()
+        fmt = "jpeg" if fmt == "jpg" else fmt
+    return f"data:image/{fmt};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def render_page(page, scale=None, fmt=None, quality=None) -> str:
+    import fitz
+
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale or render_scale, scale or render_scale), alpha=False)
+    return encode_pixmap(pix, fmt, quality)
+
+def _render_in_worker(path, index, scale, fmt, quality):
+    import fitz
+
+    pdf = _worker_docs.get(path)
+    if pdf is None:
+        while len(_worker_docs) >= _worker_max_docs:
+            _worker_docs.pop(next(iter(_worker_docs))).close()
+        pdf = _worker_docs[path] = fitz.open(path)
+    return render_page(pdf[index], scale, fmt, quality)
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the app process runs server and event loop threads
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def shutdown():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+atexit.register(shutdown)
+
+def iter_pdf(path: str, pages=None, scale=None, fmt=None, quality=None, text_layer=True, workers=None,
+             render=True):
+    """Converts a PDF page by page.
+
+    The text layer is extracted first; only pages without one are rendered to
+    an image, in a process pool when there are several. Results come in page
+    order as soon as each page is done, and at most a few pages per worker are
+    rendered ahead of the reader. Pages past max_pages are not read, and
+    rendering stops at max_images pages or max_image_bytes of data URLs.
+
+    Args:
+    path: The PDF file.
+    pages: Page range spec for parse_page_range(), None for default_pages.
+    scale: Render scale, None for render_scale.
+    fmt: Image codec ("png", "jpeg", "webp"), None for image_format.
+    quality: Codec quality for jpeg and webp, None for image_quality.
+    text_layer: False to render every page regardless of its text.
+    workers: Number of pages rendered in parallel, None for max_workers, 1 for in-process rendering.
+    render: False to pass over pages without a text layer instead of rendering them,
+        when their images would not be sent.
+
+    Yields:
+    Dicts with the 1-based "page" number and either its "text", its "image"
+    as a data URL, or the reason it was "omitted". Pages past max_pages are
+    summed up in one "omitted" entry for the first of them.
+    """
+    import fitz
+
+    workers = max_workers if workers is None else max(1, workers)
+    with fitz.open(path) as pdf:
+        indices = parse_page_range(pages if pages is not None else default_pages, pdf.page_count)
+        unread = indices[max_pages:]
+        indices = indices[:max_pages]
+
+        texts = {}
+        if text_layer:
+            for index in indices:
+                text = pdf[index].get_text("text").strip()
+                if len(text) >= min_text_chars:
+                    texts[index] = text
+        to_render = [index for index in indices if index not in texts] if render else []
+        omitted = {index: "no text layer, and page images are not sent"
+                   for index in indices if index not in texts and not render}
+        omitted.update((index, f"no text layer, not rendered: over the limit of {max_images} page images")
+                       for index in to_render[max_images:])
+        to_render = set(to_render[:max_images])
+
+        image_bytes = 0
+        exhausted = False
+
+        def image_result(index, image):
+            nonlocal image_bytes, exhausted
+            if image is not None and not exhausted and image_bytes + len(image) <= max_image_bytes:
+                image_bytes += len(image)
+                return {"page": index + 1, "image": image}
+            exhausted = True
+            return {"page": index + 1, "omitted": omitted.get(
+                index, f"no text layer, not rendered: over the limit of {max_image_bytes} bytes of page images")}
+
+        def page_result(index, future):
+            if index in texts:
+                return {"page": index + 1, "text": texts[index]}
+            if future is None or future.cancelled():
+                return image_result(index, None)
+            return image_result(index, future.result())
+
+        if workers == 1 or len(to_render) < parallel_min_pages:
+            for index in indices:
+                if index in texts:
+                    yield {"page": index + 1, "text": texts[index]}
+                elif index in to_render and not exhausted:
+                    yield image_result(index, render_page(pdf[index], scale, fmt, quality))
+                else:
+                    yield image_result(index, None)
+            if unread:
+                yield _unread_result(unread)
+            return
+
+    pool = get_pool()
+    pending = deque()  # (page index, render future or None), in page order
+    rendering = 0
+
+    def next_result():
+        nonlocal rendering
+        index_done, future = pending.popleft()
+        rendering -= future is not None
+        result = page_result(index_done, future)
+        if exhausted:
+            # nothing rendered from here on is sent
+            for _, queued in pending:
+                if queued is not None:
+                    queued.cancel()
+        return result
+
+    try:
+        for index in indices:
+            if index in to_render:
+                # bound the renders queued ahead of the reader so a slow reader does not buffer the whole document
+                while rendering >= 2 * workers and not exhausted:
+                    yield next_result()
+            if index in to_render and not exhausted:
+                pending.append((index, pool.submit(_render_in_worker, path, index, scale, fmt, quality)))
+                rendering += 1
+            else:
+                pending.append((index, None))
+            while pending and (pending[0][1] is None or pending[0][1].done()):
+                yield next_result()
+        while pending:
+            yield next_result()
+        if unread:
+            yield _unread_result(unread)
+    finally:
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+
+def _unread_result(unread: list) -> dict:
+    return {"page": unread[0] + 1,
+            "omitted": f"not read, nor the {len(unread) - 1} selected pages after it: over the limit of {max_pages} pages"}
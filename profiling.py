@@ -0,0 +1,182 @@
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+import metrics
+
+# Fraction of chat requests to profile, 0 for none. Can be changed at runtime
+# through the metrics server: POST /profiling?rate=0.1 (GET shows the state)
+sample_rate = float(os.environ.get("MLX_CHAT_PROFILE", "0") or 0)
+profile_dir = os.environ.get("MLX_CHAT_PROFILE_DIR", os.path.expanduser("~/.cache/mlx_chat/profiles"))
+# Seconds between stack samples
+interval = 0.005
+# Profiles kept; older ones are deleted. Every profile is listed with its tags
+# in profiles.jsonl in profile_dir
+max_profiles = 200
+
+_lock = threading.Lock()
+_active = set()
+_sampler = None
+_seq = itertools.count(1)
+
+class Profile:
+    """Stack samples of every thread of the process while one request runs.
+
+    Requests running at the same time show up in each other's profiles; the
+    thread name at the root of every stack tells the event loop, prompt
+    building and attachment workers apart. Work in worker processes (PDF
+    rendering, large DOCX conversion) appears as waiting for its result.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.stacks = {}        # (thread name, frame, ...) root first -> samples
+        self.samples = 0
+
+    def add(self, stacks: list):
+        for stack in stacks:
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def finish(self, **tags) -> str:
+        """Stops sampling for this request and writes its profile files.
+
+        Args:
+        tags: Recorded with the profile, e.g. prompt size and attachment types.
+
+        Returns:
+        The path of the collapsed stacks file (flamegraph.pl input), next to
+        which a .speedscope.json file is written; None if they could not be written.
+        """
+        with _lock:
+            _active.discard(self)
+        duration = time.perf_counter() - self.start
+        tags = dict(model=self.model, seconds=round(duration, 4), samples=self.samples, **tags)
+        metrics.profiles_written.inc()
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        base = os.path.join(profile_dir, f"{stamp}-{next(_seq):04d}-{re.sub(r'[^A-Za-z0-9.-]+', '_', str(self.model))}")
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                for stack, count in sorted(self.stacks.items()):
+                    f.write(f"{';'.join(stack)} {count}\n")
+            with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+                json.dump(self.speedscope(tags, duration), f)
+            with open(os.path.join(profile_dir, "profiles.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(dict(file=os.path.basename(base), **tags)) + "\n")
+        except OSError:
+            return None
+        _prune()
+        return base + ".collapsed"
+
+    def speedscope(self, tags: dict, duration: float) -> dict:
+        """The samples in speedscope's file format, one profile per thread."""
+        frames = []
+        frame_index = {}
+        threads = {}
+        for stack, count in self.stacks.items():
+            indices = []
+            for name in stack[1:]:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                indices.append(frame_index[name])
+            samples, weights = threads.setdefault(stack[0], ([], []))
+            samples.append(indices)
+            weights.append(count * interval)
+
+        title = " ".join(f"{k}={v}" for k, v in tags.items())
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": title,
+            "exporter": "mlx_chat profiling",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{"type": "sampled", "name": thread, "unit": "seconds", "startValue": 0,
+                          "endValue": duration, "samples": samples, "weights": weights}
+                         for thread, (samples, weights) in sorted(threads.items())],
+        }
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _sample_loop():
+    global _sampler
+
+    me = threading.get_ident()
+    while True:
+        with _lock:
+            if not _active:
+                _sampler = None
+                return
+
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks.append(tuple(reversed(stack)))
+        with _lock:
+            # not to profiles that finished meanwhile, their samples are being written
+            for profile in _active:
+                profile.add(stacks)
+        time.sleep(interval)
+
+def begin(model) -> Profile:
+    """Starts profiling a request with probability sample_rate.
+
+    Returns:
+    The Profile to finish() when the request is done, or None if it is not sampled.
+    """
+    global _sampler
+
+    if random.random() >= sample_rate:
+        return None
+    profile = Profile(model)
+    with _lock:
+        _active.add(profile)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+            _sampler.start()
+    return profile
+
+def _prune():
+    try:
+        names = sorted(name for name in os.listdir(profile_dir) if name.endswith(".collapsed"))
+    except OSError:
+        return
+    for name in names[:max(len(names) - max_profiles, 0)]:
+        stem = name[:-len(".collapsed")]
+        for suffix in (".collapsed", ".speedscope.json"):
+            try:
+                os.remove(os.path.join(profile_dir, stem + suffix))
+            except OSError:
+                pass
+
+def set_rate(rate: float):
+    global sample_rate
+
+    sample_rate = min(max(float(rate), 0.0), 1.0)
+
+def admin(method: str, query: dict) -> dict:
+    """Handles /profiling on the metrics server: POST ?rate=R sets the sample rate."""
+    if method == "POST" and "rate" in query:
+        set_rate(query["rate"][0])
+    with _lock:
+        active = len(_active)
+    return {"rate": sample_rate, "active": active, "dir": profile_dir}
+
+metrics.admin_routes["/profiling"] = admin
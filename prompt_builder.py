@@ -0,0 +1,414 @@
+from collections import OrderedDict
+import concurrent.futures
+import json
+import os
+import threading
+
+import context_window
+import image_prep
+import ingest
+import retrieval
+import upload_store
+
+# Bounds of the encoded attachment cache
+attachment_cache_entries = 256
+attachment_cache_chars = 64 * 1024 * 1024
+
+# Number of chat sessions to keep prompt state for
+max_sessions = 1024
+
+# "merged" puts the system prompt into the first user message and the new
+# turn's text ahead of its files (the original layout). "stable" sends a system
+# message and lays out every turn exactly as it is later rebuilt from history,
+# so the serialized prompt of turn N is a prefix of turn N+1 and the backend
+# can reuse its prompt cache.
+prompt_layout = os.environ.get("MLX_CHAT_PROMPT_LAYOUT", "merged")
+
+# Models whose chat template rejects the system role; "stable" puts the
+# system prompt at the start of the first user message for those
+no_system_role_models = {"google/gemma-2-9b-it"}
+
+# Send image attachments (uploads and rendered PDF pages) as image_url parts
+# of multipart user messages; without this only their text reaches the model
+send_images = os.environ.get("MLX_CHAT_SEND_IMAGES", "") not in ("", "0")
+
+# Shared prompt prefix between consecutive requests of a session, in characters of serialized messages
+prefix_stats = {"requests": 0, "prompt_chars": 0, "shared_prefix_chars": 0}
+_prefix_stats_lock = threading.Lock()
+
+def shared_prefix_len(a: str, b: str) -> int:
+    """Returns the length of the common prefix of a and b."""
+    lo, hi = 0, min(len(a), len(b))
+    # binary search on slice comparisons, which run in C
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def user_content(text: str, image_urls: list):
+    """Returns message content: the text alone, or text and image parts if there are images."""
+    if not image_urls:
+        return text
+    parts = [{"type": "text", "text": text}] if text else []
+    return parts + [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]
+
+def _encoded_size(fc: dict) -> int:
+    return len(fc.get("text") or "") + sum(len(url) for url in fc.get("images") or ())
+
+class AttachmentCache:
+    """Memoizes the results of an encode function by file path, size and mtime.
+
+    Uploaded files are re-sent with every turn of a conversation, so without
+    this each turn would read and decode all earlier attachments again. With an
+    upload_store.UploadStore, files are memoized by content instead, and the
+    results are also stored next to the file's blob, so an upload of the same
+    file in another session or after a restart is not encoded again.
+    """
+
+    def __init__(self, encode, max_entries=None, max_chars=None, store=None, settings=None):
+        """
+        Args:
+        encode: Function from a file path and an ingest.CharBudget to read it within (or None) to its encoded dict.
+        store: UploadStore to keep files and their encoded dicts in, None for memory only.
+        settings: Function returning what besides the file changes the encoding, for naming stored results.
+        """
+        self.encode = encode
+        self.store = store
+        self.settings = settings
+        self.max_entries = max_entries or attachment_cache_entries
+        self.max_chars = max_chars or attachment_cache_chars
+        self.entries = OrderedDict()
+        self.inflight = {}      # path -> future of get_many()'s encoding
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, fn: str, chars=None) -> dict:
+        """The encoded dict of fn, read within chars (an ingest.CharBudget) if it is not cached."""
+        if self.store is not None:
+            digest = self.store.add(fn)
+            key = (digest, fn)
+        else:
+            digest = None
+            st = os.stat(fn)
+            key = (fn, st.st_size, st.st_mtime_ns)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        fc = None
+        if digest is not None:
+            # results name the file, and image results refer to its path
+            artifact = upload_store.artifact_name("encoded", [os.path.basename(fn), self.settings() if self.settings else None])
+            fc = self.store.load_artifact(digest, artifact)
+        if fc is None:
+            fc = self.encode(fn, chars)
+            if fc.get("partial"):
+                # cut short by the request's budget, which the next request may not be
+                return fc
+            if digest is not None and "image_files" not in fc:
+                self.store.save_artifact(digest, artifact, fc)
+        size = _encoded_size(fc)
+
+        with self.lock:
+            if key not in self.entries and size <= self.max_chars:
+                self.entries[key] = fc
+                self.chars += size
+                while len(self.entries) > self.max_entries or self.chars > self.max_chars:
+                    _, old = self.entries.popitem(last=False)
+                    self.chars -= _encoded_size(old)
+
+        return fc
+
+    def _get_prepared(self, fn, images, model, chars) -> dict:
+        fc = self.get(fn, chars)
+        if images is not None:
+            for image_fn in fc.get("image_files") or ():
+                images.get(image_fn, model)
+        return fc
+
+    def get_many(self, paths, budget=None, images=None, model=None, chars=None) -> dict:
+        """Encodes files concurrently on ingest's thread pool.
+
+        Files still being encoded for another request are waited for rather
+        than encoded twice. Files not done within the budget keep being encoded
+        in the background, for the next request that asks for them.
+
+        Args:
+        paths: The files.
+        budget: Seconds to wait at most, None for ingest.time_budget.
+        images: image_prep.ImageCache to also prepare image attachments with for model.
+        chars: ingest.CharBudget the files are read within, shared by all of them.
+
+        Returns:
+        The encoded dict of every path; ingest.late() for those not done within the budget.
+        """
+        budget = ingest.time_budget if budget is None else budget
+        pool = ingest.get_pool()
+        futures = {}
+        started = []
+        with self.lock:
+            for fn in dict.fromkeys(paths):
+                future = self.inflight.get(fn)
+                if future is None:
+                    future = self.inflight[fn] = pool.submit(self._get_prepared, fn, images, model, chars)
+                    started.append(fn)
+                futures[fn] = future
+        # outside the lock: a callback added to a finished future runs right away
+        for fn in started:
+            futures[fn].add_done_callback(lambda f, fn=fn: self._finished(fn, f))
+
+        concurrent.futures.wait(futures.values(), timeout=budget)
+        results = {}
+        for fn, future in futures.items():
+            if future.done():
+                # raises the file's encoding error, as get() would
+                results[fn] = future.result()
+            else:
+                results[fn] = ingest.late(os.path.basename(fn), budget)
+        return results
+
+    def _finished(self, fn, future):
+        with self.lock:
+            if self.inflight.get(fn) is future:
+                del self.inflight[fn]
+
+class _Prefetched:
+    """An AttachmentCache with the results of one get_many() call at hand, reading other files within its budget."""
+
+    def __init__(self, attachments, results, chars):
+        self.attachments = attachments
+        self.results = results
+        self.chars = chars
+
+    def get(self, fn: str) -> dict:
+        fc = self.results.get(fn)
+        return fc if fc is not None else self.attachments.get(fn, self.chars)
+
+class PromptState:
+    """OpenAI-format messages of one chat session, extended turn by turn.
+
+    The messages for the turns already seen are kept, so building the prompt
+    for a new turn only processes the history entries added since the last call.
+    If the history no longer extends what was seen (undo, import, changed system
+    prompt), the state is rebuilt from scratch.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_request = ""
+        self.reset(None)
+
+    def reset(self, system_prompt, layout="merged", system_role=False, image_side=None):
+        self.system_prompt = system_prompt
+        self.layout = (layout, system_role, image_side, retrieval.enabled)
+        self.entries = []
+        self.messages = []
+        self.pending = ""
+        self.pending_images = []
+        # (name, text) of attachments that go through retrieval: those of the
+        # turn being folded, and those of earlier turns
+        self.pending_indexed = []
+        self.indexed = []
+        # attachment characters of the turns folded so far, see ingest.max_request_chars
+        self.attachment_chars = 0
+        if system_prompt:
+            if layout == "stable" and system_role:
+                self.messages.append({"role": "system", "content": system_prompt})
+            else:
+                self.pending = system_prompt + "\n"
+
+    def _image_urls(self, fc, images, model) -> list:
+        if images is None:
+            return []
+        return list(fc.get("images") or ()) + [images.get(fn, model) for fn in fc.get("image_files") or ()]
+
+    def _excerpts(self, documents, question) -> str:
+        # every turn's excerpts depend only on the turn itself and earlier ones,
+        # so rebuilding a turn from history reproduces what was sent for it
+        if not documents:
+            return ""
+        return retrieval.excerpts(documents, question)
+
+    @staticmethod
+    def _capped(text, fn, used) -> tuple:
+        """Applies the per-request cap to an attachment's text, given the characters the request already has."""
+        text = ingest.cap_text(text, max(ingest.max_request_chars - used, 0), os.path.basename(fn))
+        return text, used + len(text)
+
+    def _fold(self, human, assi, attachments, images, model):
+        if human is not None:
+            if type(human) is tuple:
+                fc = attachments.get(human[0])
+                text, self.attachment_chars = self._capped(fc["text"], human[0], self.attachment_chars)
+                if retrieval.wants(fc["text"]):
+                    self.pending_indexed.append((os.path.basename(human[0]), text))
+                else:
+                    self.pending = self.pending + text
+                self.pending_images.extend(self._image_urls(fc, images, model))
+            else:
+                self.pending = self.pending + self._excerpts(self.indexed + self.pending_indexed, human) + human
+                self.indexed.extend(self.pending_indexed)
+                self.pending_indexed = []
+
+        if assi is not None:
+            self.indexed.extend(self.pending_indexed)
+            self.pending_indexed = []
+            if self.pending or self.pending_images:
+                self.messages.append({"role": "user", "content": user_content(self.pending, self.pending_images)})
+                self.pending = ""
+                self.pending_images = []
+
+            self.messages.append({"role": "assistant", "content": assi})
+
+    def build(self, message, history, system_prompt, attachments, layout=None, system_role=True,
+              model=None, images=None) -> list:
+        """Returns the messages for a new turn.
+
+        Args:
+        message: The new multimodal message, {"text": ..., "files": [...]}.
+        history: Gradio's tuple-format history.
+        system_prompt: The system prompt.
+        attachments: AttachmentCache for uploaded files.
+        layout: "merged" or "stable", None for prompt_layout.
+        system_role: Whether the model accepts a system message.
+        model: The model, selects the size images are prepared at.
+        images: image_prep.ImageCache to send image attachments with, None to send text only.
+        """
+        layout = layout or prompt_layout
+        image_side = image_prep.max_side_for(model) if images is not None else None
+        with self.lock:
+            seen = len(self.entries)
+            if (system_prompt != self.system_prompt or (layout, system_role, image_side, retrieval.enabled) != self.layout
+                    or len(history) < seen
+                    or any(tuple(entry) != self.entries[i] for i, entry in enumerate(history[:seen]))):
+                self.reset(system_prompt, layout, system_role, image_side)
+                seen = 0
+
+            for human, assi in history[seen:]:
+                self._fold(human, assi, attachments, images, model)
+                self.entries.append((human, assi))
+
+            file_parts = ""
+            file_images = []
+            file_indexed = []
+            used = self.attachment_chars
+            if message['files']:
+                for file in message['files']:
+                    fc = attachments.get(file['path'])
+                    text, used = self._capped(fc["text"], file['path'], used)
+                    if retrieval.wants(fc["text"]):
+                        file_indexed.append((os.path.basename(file['path']), text))
+                    else:
+                        file_parts = file_parts + text
+                    file_images.extend(self._image_urls(fc, images, model))
+            file_parts = file_parts + self._excerpts(self.indexed + self.pending_indexed + file_indexed,
+                                                     message['text'] or "")
+
+            # Gradio records a turn's files ahead of its text
+            if layout == "stable":
+                user_msg_parts = self.pending + file_parts + (message['text'] or "")
+            else:
+                user_msg_parts = self.pending + (message['text'] or "") + file_parts
+
+            return self.messages + [{"role": "user", "content": user_content(user_msg_parts, self.pending_images + file_images)}]
+
+    def record_request(self, messages) -> tuple:
+        """Records the prompt sent for this session.
+
+        Returns:
+        The length of the prefix shared with the previous request and the total
+        length, both in characters of the serialized messages.
+        """
+        serialized = json.dumps(messages, ensure_ascii=False)
+        with self.lock:
+            shared = shared_prefix_len(self.last_request, serialized)
+            self.last_request = serialized
+
+        with _prefix_stats_lock:
+            prefix_stats["requests"] += 1
+            prefix_stats["prompt_chars"] += len(serialized)
+            prefix_stats["shared_prefix_chars"] += shared
+
+        return shared, len(serialized)
+
+def prepare_request(state, message, history, system_prompt, temperature, max_tokens, model, attachments,
+                    images=None) -> tuple:
+    """Builds the backend request for a chat turn, as bot() sends it.
+
+    Args:
+    state: The session's PromptState.
+    message: The new multimodal message, {"text": ..., "files": [...]}.
+    history: Gradio's tuple-format history.
+    system_prompt, temperature, max_tokens, model: The chat settings.
+    attachments: AttachmentCache for uploaded files.
+    images: image_prep.ImageCache to send image attachments with, None to send text only.
+
+    Returns:
+    The chat completion payload and the context_window.fit_messages() report.
+    """
+    system_role = model not in no_system_role_models
+    late = False
+    if attachments is not None:
+        # what is left of the request's attachment characters, after the turns already folded into state
+        chars = ingest.CharBudget(ingest.max_request_chars - state.attachment_chars)
+        # the files of turns not folded into state yet and of the new turn, encoded in parallel; build() then takes
+        # them in this order, which is also about the order they take from the budget in
+        paths = [human[0] for human, _ in history[len(state.entries):] if type(human) is tuple]
+        paths.extend(file['path'] for file in message['files'])
+        results = {}
+        if paths:
+            results = attachments.get_many(paths, images=images, model=model, chars=chars)
+            late = any(fc.get("late") for fc in results.values())
+        attachments = _Prefetched(attachments, results, chars)
+    messages = state.build(message, history, system_prompt, attachments, system_role=system_role, model=model,
+                           images=images)
+    if late:
+        # the next turn rebuilds the history with the files that were left out
+        with state.lock:
+            state.reset(None)
+    merged_system_prompt = prompt_layout != "stable" or not system_role
+    messages, fit = context_window.fit_messages(messages, model, max_tokens,
+                                                keep_prefix=system_prompt + "\n" if system_prompt and merged_system_prompt else None)
+    payload = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": True
+    }
+    return payload, fit
+
+class SessionStore:
+    """Bounded mapping of Gradio session hashes to their PromptState."""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or max_sessions
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_hash) -> PromptState:
+        if session_hash is None:
+            return PromptState()
+
+        with self.lock:
+            state = self.states.get(session_hash)
+            if state is None:
+                state = self.states[session_hash] = PromptState()
+                while len(self.states) > self.max_entries:
+                    self.states.popitem(last=False)
+            else:
+                self.states.move_to_end(session_hash)
+            return state
+
+    def drop(self, session_hash):
+        with self.lock:
+            self.states.pop(session_hash, None)
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+import metrics
+
+# Opt-in: replay stored completions for repeated deterministic requests
+enabled = os.environ.get("MLX_CHAT_RESPONSE_CACHE", "") not in ("", "0")
+cache_dir = os.environ.get("MLX_CHAT_RESPONSE_CACHE_DIR", os.path.expanduser("~/.cache/mlx_chat/responses"))
+max_bytes = 256 * 1024 * 1024
+ttl = 7 * 24 * 3600
+
+# Request fields that influence the completion
+KEY_FIELDS = ("model", "messages", "max_tokens", "temperature", "top_p", "top_k", "seed", "stop",
+              "repetition_penalty", "frequency_penalty", "presence_penalty")
+
+_lock = threading.Lock()
+_size = None
+
+def request_key(payload: dict) -> str:
+    """Returns a hash of the fields of a chat request that determine its completion."""
+    canonical = {field: payload[field] for field in KEY_FIELDS if payload.get(field) is not None}
+    serialized = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+def is_deterministic(payload: dict) -> bool:
+    """Greedy decoding is the only case where a repeated request yields the same completion."""
+    temperature = payload.get("temperature")
+    return temperature is not None and float(temperature) == 0
+
+def _path(key: str) -> str:
+    return os.path.join(cache_dir, key[:2], key + ".json")
+
+def get(key: str):
+    """Returns the cached content chunks for key, or None."""
+    path = _path(key)
+    try:
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+        # expiry counts from when the completion was stored, however often it is used
+        if time.time() - entry["created"] > ttl:
+            _remove(path)
+            return None
+        # mtime is the last-use time, for eviction
+        os.utime(path)
+        return entry["chunks"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def put(key: str, model: str, chunks: list):
+    global _size
+
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"model": model, "created": time.time(), "chunks": chunks}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+    with _lock:
+        if _size is None:
+            _size = _scan_size()
+        else:
+            _size += os.path.getsize(path)
+        if _size > max_bytes:
+            _evict()
+
+def _remove(path: str):
+    global _size
+
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        with _lock:
+            if _size is not None:
+                _size -= size
+    except OSError:
+        pass
+
+def _entries() -> list:
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(".json"):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+def _scan_size() -> int:
+    return sum(size for _, size, _ in _entries())
+
+def _evict():
+    """Removes the least recently used entries down to 90% of max_bytes, and those unused for ttl. Call with _lock held.
+
+    An entry unused for ttl is expired: its mtime, the last use, is never
+    earlier than its creation. Expired entries that are still used are
+    removed by get().
+    """
+    global _size
+
+    now = time.time()
+    entries = sorted(_entries())
+    _size = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if _size <= max_bytes * 0.9 and now - mtime <= ttl:
+            break
+        try:
+            os.remove(path)
+            _size -= size
+        except OSError:
+            pass
+
+async def cached_stream(payload: dict, stream):
+    """Streams a chat completion through the cache.
+
+    Args:
+    payload: The chat request.
+    stream: Function returning the backend's async iterator of content deltas for a payload.
+
+    Yields:
+    Content deltas, replayed from the cache on a hit. Completed responses to
+    deterministic requests are stored.
+    """
+    if not is_deterministic(payload):
+        metrics.response_cache_requests.inc(result="bypass")
+        upstream = stream(payload)
+        try:
+            async for content in upstream:
+                yield content
+        finally:
+            await upstream.aclose()
+        return
+
+    key = request_key(payload)
+    chunks = await asyncio.to_thread(get, key)
+    if chunks is not None:
+        metrics.response_cache_requests.inc(result="hit")
+        for content in chunks:
+            yield content
+        return
+
+    metrics.response_cache_requests.inc(result="miss")
+    chunks = []
+    upstream = stream(payload)
+    try:
+        async for content in upstream:
+            chunks.append(content)
+            yield content
+    finally:
+        await upstream.aclose()
+
+    # only reached if the reader consumed the whole response and it ended with
+    # '[DONE]'; backend.stream_chat() raises on a stream that was cut off
+    if chunks:
+        await asyncio.to_thread(put, key, payload.get("model"), chunks)
@@ -0,0 +1,203 @@
+from collections import Counter, OrderedDict
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+
+import metrics
+
+# Opt-in: attachments of at least min_chars characters are indexed, and only
+# the top_k chunks most relevant to the question are put into the prompt
+enabled = os.environ.get("MLX_CHAT_RETRIEVAL", "") not in ("", "0")
+min_chars = 24000
+chunk_chars = 2000
+chunk_overlap = 200
+top_k = 6
+
+# Indexes are stored per content hash, so the same upload is indexed once
+index_dir = os.environ.get("MLX_CHAT_RETRIEVAL_DIR", os.path.expanduser("~/.cache/mlx_chat/retrieval"))
+memory_indexes = 16
+
+# BM25 parameters
+k1 = 1.5
+b = 0.75
+
+INDEX_VERSION = 1
+
+_token_re = re.compile(r"\w+")
+_memory = OrderedDict()
+_lock = threading.Lock()
+
+def tokenize(text: str) -> list:
+    """Lower-cased word tokens; snake_case identifiers also yield their parts."""
+    tokens = []
+    for token in _token_re.findall(text.lower()):
+        tokens.append(token)
+        if "_" in token:
+            tokens.extend(part for part in token.split("_") if part)
+    return tokens
+
+def chunk_text(text: str, size: int = None, overlap: int = None) -> list:
+    """Splits text into chunks of about size characters at line boundaries.
+
+    Consecutive chunks share up to overlap characters of whole lines, so a
+    passage cut by a boundary is still complete in one of them. Lines longer
+    than size are split.
+
+    Returns:
+    A list of (first line, last line, text) with 1-based line numbers.
+    """
+    size = size or chunk_chars
+    overlap = chunk_overlap if overlap is None else overlap
+
+    lines = []
+    for number, line in enumerate(text.splitlines(keepends=True), 1):
+        while len(line) > size:
+            lines.append((number, line[:size]))
+            line = line[size:]
+        lines.append((number, line))
+
+    chunks = []
+    current = []
+    current_chars = 0
+    for number, line in lines:
+        if current and current_chars + len(line) > size:
+            chunks.append((current[0][0], current[-1][0], "".join(part for _, part in current)))
+            carried = []
+            carried_chars = 0
+            for item in reversed(current):
+                if carried_chars + len(item[1]) > overlap:
+                    break
+                carried.insert(0, item)
+                carried_chars += len(item[1])
+            current, current_chars = carried, carried_chars
+        current.append((number, line))
+        current_chars += len(line)
+    if current:
+        chunks.append((current[0][0], current[-1][0], "".join(part for _, part in current)))
+    return chunks
+
+class BM25Index:
+    """Okapi BM25 over the chunks of one document."""
+
+    def __init__(self, chunks: list, postings: dict, lengths: list):
+        self.chunks = chunks
+        self.postings = postings  # term -> [[chunk index, term frequency], ...]
+        self.lengths = lengths
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def build(cls, text: str):
+        chunks = chunk_text(text)
+        postings = {}
+        lengths = []
+        for i, (_, _, chunk) in enumerate(chunks):
+            tokens = tokenize(chunk)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append([i, tf])
+        return cls(chunks, postings, lengths)
+
+    def search(self, query: str, k: int) -> list:
+        """Returns up to k (score, chunk index) pairs, best first."""
+        n = len(self.chunks)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = k1 * (1 - b + b * self.lengths[i] / self.avg_length) if self.avg_length else k1
+                scores[i] = scores.get(i, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return sorted(((score, i) for i, score in scores.items()), reverse=True)[:k]
+
+    def to_dict(self) -> dict:
+        return {"version": INDEX_VERSION, "chunks": self.chunks, "postings": self.postings, "lengths": self.lengths}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls([tuple(chunk) for chunk in data["chunks"]], data["postings"], data["lengths"])
+
+def _index_path(key: str) -> str:
+    return os.path.join(index_dir, key[:2], key + ".json.gz")
+
+def get_index(text: str) -> BM25Index:
+    """Returns the index of text from memory, from disk, or newly built and stored."""
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    key = f"{digest}-{chunk_chars}-{chunk_overlap}-v{INDEX_VERSION}"
+
+    with _lock:
+        index = _memory.get(key)
+        if index is not None:
+            _memory.move_to_end(key)
+            metrics.retrieval_indexes.inc(source="memory")
+            return index
+
+    path = _index_path(key)
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            index = BM25Index.from_dict(json.load(f))
+        metrics.retrieval_indexes.inc(source="disk")
+    except (OSError, ValueError, KeyError):
+        index = BM25Index.build(text)
+        metrics.retrieval_indexes.inc(source="built")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump(index.to_dict(), f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    with _lock:
+        _memory[key] = index
+        while len(_memory) > memory_indexes:
+            _memory.popitem(last=False)
+    return index
+
+def wants(text: str) -> bool:
+    """Whether an attachment's text goes through retrieval rather than into the prompt whole."""
+    return enabled and len(text) >= min_chars
+
+def excerpts(documents: list, query: str, k: int = None) -> str:
+    """Selects the chunks of documents most relevant to query.
+
+    Args:
+    documents: (name, text) pairs.
+    query: The question the excerpts are for.
+    k: Number of chunks over all documents, None for top_k.
+
+    Returns:
+    The selected chunks, grouped by document in document order, each headed
+    with its line range. Documents without a matching chunk contribute their
+    first chunk, so the model still learns what they are.
+    """
+    k = k or top_k
+    indexes = [(name, get_index(text)) for name, text in documents]
+
+    ranked = []
+    for doc, (_, index) in enumerate(indexes):
+        ranked.extend((score, doc, i) for score, i in index.search(query, k))
+    ranked.sort(reverse=True)
+    selected = {(doc, i) for _, doc, i in ranked[:k]}
+    for doc, (_, index) in enumerate(indexes):
+        if index.chunks and not any(d == doc for d, _ in selected):
+            selected.add((doc, 0))
+
+    parts = []
+    for doc, (name, index) in enumerate(indexes):
+        chosen = sorted(i for d, i in selected if d == doc)
+        if not chosen:
+            continue
+        parts.append(f"[{name}: {len(chosen)} of {len(index.chunks)} sections, selected for the question]\n")
+        for i in chosen:
+            first, last, chunk = index.chunks[i]
+            parts.append(f"--- {name}, lines {first}-{last} ---\n{chunk}")
+            if not chunk.endswith("\n"):
+                parts.append("\n")
+    return "".join(parts)
@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import os
+import time
+
+import backend
+import metrics
+
+# Concurrent backend streams per model (model_limits overrides per model) and
+# per configured backend server; requests beyond these wait for a slot. A
+# request is admitted with a slot on one server, see Scheduler.endpoint_for()
+default_model_limit = int(os.environ.get("MLX_CHAT_MODEL_CONCURRENCY", "4"))
+model_limits = {}
+backend_limit = int(os.environ.get("MLX_CHAT_BACKEND_CONCURRENCY", "4"))
+
+# Requests with an estimated prompt plus completion size up to this many tokens
+# go ahead of longer ones; a long request waiting longer than priority_aging
+# seconds is treated as short, so it cannot starve
+short_request_tokens = 2048
+priority_aging = 30.0
+
+# Waiting requests beyond this are turned away
+max_waiting = 256
+
+class SchedulerFull(Exception):
+    pass
+
+class _Waiter:
+    __slots__ = ("model", "session", "cost", "enqueued", "seq", "future")
+
+    def __init__(self, model, session, cost, seq):
+        self.model = model
+        self.session = session
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self.seq = seq
+        self.future = asyncio.get_running_loop().create_future()
+
+class Scheduler:
+    """Admits backend streams in a fair order under per-model and per-backend caps.
+
+    When a slot frees up, the waiting request that runs next is chosen by:
+    short (or long-waiting) before long, then the session that was admitted
+    least recently, then arrival. A session that fires off many requests thus
+    takes turns with the others instead of queueing them ahead.
+
+    Backend slots are Endpoint.inflight of backend.get_pool(): an admitted
+    request holds one on the backend it was admitted to, and streams that
+    backend.stream_chat() fails over to take their own there, so no backend
+    has more than backend_limit streams open at once.
+    """
+
+    def __init__(self):
+        self.waiting = []
+        self.running = {}        # model -> admitted streams
+        self.last_admitted = {}  # session -> admission stamp, for round-robin
+        self.stamps = itertools.count(1)
+        self.seqs = itertools.count()
+
+    def model_limit(self, model) -> int:
+        return model_limits.get(model, default_model_limit)
+
+    def capacity(self) -> int:
+        return backend_limit * max(len(backend.get_pool().endpoints), 1)
+
+    def endpoint_for(self, model):
+        """The backend to admit a stream of model to: the first of BackendPool.select()
+        with a free slot among the healthy ones that serve the model, or among all
+        if none does. None if they are all busy."""
+        endpoints = backend.get_pool().select(model)
+        preferred = [endpoint for endpoint in endpoints if endpoint.healthy and endpoint.serves(model)]
+        for endpoint in preferred or endpoints:
+            if endpoint.inflight < backend_limit:
+                return endpoint
+        return None
+
+    def _has_room(self, model) -> bool:
+        if self.running.get(model, 0) >= self.model_limit(model):
+            return False
+        # without backends the request is let through, for stream_chat() to report the error
+        return not backend.get_pool().endpoints or self.endpoint_for(model) is not None
+
+    def _priority(self, waiter, now) -> tuple:
+        short = waiter.cost <= short_request_tokens or now - waiter.enqueued >= priority_aging
+        return (not short, self.last_admitted.get(waiter.session, 0), waiter.seq)
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.waiting:
+            candidates = [w for w in self.waiting if self._has_room(w.model)]
+            if not candidates:
+                break
+            waiter = min(candidates, key=lambda w: self._priority(w, now))
+            self.waiting.remove(waiter)
+            endpoint = self._admit(waiter.model, waiter.session)
+            metrics.queue_wait_seconds.observe(now - waiter.enqueued, model=waiter.model)
+            waiter.future.set_result(endpoint)
+        self._report()
+
+    def _admit(self, model, session):
+        endpoint = self.endpoint_for(model)
+        if endpoint is not None:
+            endpoint.inflight += 1
+        self.running[model] = self.running.get(model, 0) + 1
+        if session is not None:
+            self.last_admitted[session] = next(self.stamps)
+            if len(self.last_admitted) > 4 * max_waiting:
+                # forget the sessions admitted longest ago
+                for old in sorted(self.last_admitted, key=self.last_admitted.get)[:max_waiting]:
+                    del self.last_admitted[old]
+        return endpoint
+
+    def _report(self):
+        depth = {}
+        for waiter in self.waiting:
+            depth[waiter.model] = depth.get(waiter.model, 0) + 1
+        for model in set(depth) | set(self.running):
+            metrics.queue_depth.set(depth.get(model, 0), model=model)
+            metrics.scheduled_streams.set(self.running.get(model, 0), model=model)
+
+    async def acquire(self, model, session=None, cost=0):
+        """Waits for a slot to stream from model; release() it afterwards.
+
+        Returns:
+        The backend Endpoint the slot is on, None if there are no backends.
+        """
+        if not self.waiting and self._has_room(model):
+            endpoint = self._admit(model, session)
+            metrics.queue_wait_seconds.observe(0.0, model=model)
+            self._report()
+            return endpoint
+        if len(self.waiting) >= max_waiting:
+            metrics.queue_rejected.inc(model=model)
+            raise SchedulerFull(f"Too many requests waiting ({len(self.waiting)}), please try again later")
+
+        waiter = _Waiter(model, session, cost, next(self.seqs))
+        self.waiting.append(waiter)
+        self._dispatch()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # admitted just as the reader went away
+                self.release(model, waiter.future.result())
+            else:
+                self.waiting.remove(waiter)
+                self._report()
+            raise
+
+    def release(self, model, endpoint=None):
+        if endpoint is not None:
+            endpoint.inflight -= 1
+        self.running[model] -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {"running": dict(self.running), "waiting": len(self.waiting),
+                "oldest_wait_s": max((now - w.enqueued for w in self.waiting), default=0.0),
+                "capacity": self.capacity()}
+
+    def stream(self, stream_chat, session=None, cost=0):
+        """Wraps backend.stream_chat, or a function taking the same arguments, to hold a slot while it streams."""
+        async def scheduled(payload):
+            model = payload.get("model")
+            endpoint = await self.acquire(model, session, cost)
+            upstream = stream_chat(payload, reserved=endpoint, limit=backend_limit)
+            try:
+                async for content in upstream:
+                    yield content
+            finally:
+                try:
+                    await upstream.aclose()
+                finally:
+                    self.release(model, endpoint)
+        return scheduled
+
+_schedulers = {}
+
+def get_scheduler() -> Scheduler:
+    """Returns the scheduler of the running event loop."""
+    loop = asyncio.get_running_loop()
+    scheduler = _schedulers.get(loop)
+    if scheduler is None:
+        _schedulers.clear()
+        scheduler = _schedulers[loop] = Scheduler()
+    return scheduler
+
+def busy_models() -> set:
+    """Models with streams admitted or waiting in any scheduler; may be called from other threads."""
+    busy = set()
+    for scheduler in list(_schedulers.values()):
+        busy.update(model for model, count in dict(scheduler.running).items() if count)
+        busy.update(waiter.model for waiter in list(scheduler.waiting))
+    return busy
@@ -0,0 +1,101 @@
+import asyncio
+import os
+
+import metrics
+import response_cache
+
+# Identical requests (same model, messages and sampling parameters) that
+# arrive while one of them is streaming share its backend generation. With
+# temperature > 0 they thus get the same sample rather than one each.
+enabled = os.environ.get("MLX_CHAT_COALESCE", "1") not in ("", "0")
+
+class _Flight:
+    """One backend generation, read by every request that joined it."""
+
+    def __init__(self, upstream):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self._run(upstream))
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def _run(self, upstream):
+        try:
+            async for content in upstream:
+                self.chunks.append(content)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                await upstream.aclose()
+            finally:
+                self.done = True
+                self._notify()
+
+    async def subscribe(self):
+        """Yields the chunks so far, then the rest as they arrive."""
+        i = 0
+        while True:
+            if i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self.changed.wait()
+
+class SingleFlight:
+    """Coalesces identical in-flight streams into one backend generation."""
+
+    def __init__(self):
+        self.flights = {}
+
+    def stream(self, stream_chat):
+        """Wraps a stream function, e.g. backend.stream_chat, so that identical payloads share one stream.
+
+        The backend generation is aborted once no request reads it any more.
+        """
+        async def coalesced(payload):
+            key = response_cache.request_key(payload)
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = _Flight(stream_chat(payload))
+                flight.task.add_done_callback(lambda _: self._forget(key, flight))
+                metrics.coalesced_streams.inc(role="leader")
+            else:
+                metrics.coalesced_streams.inc(role="follower")
+
+            flight.subscribers += 1
+            try:
+                async for content in flight.subscribe():
+                    yield content
+            finally:
+                flight.subscribers -= 1
+                if flight.subscribers == 0 and not flight.done:
+                    self._forget(key, flight)
+                    flight.task.cancel()
+        return coalesced
+
+    def _forget(self, key, flight):
+        # completed responses are for the response cache; only join streams in progress
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+_groups = {}
+
+def get_group() -> SingleFlight:
+    """Returns the coalescing group of the running event loop."""
+    loop = asyncio.get_running_loop()
+    group = _groups.get(loop)
+    if group is None:
+        _groups.clear()
+        group = _groups[loop] = SingleFlight()
+    return group
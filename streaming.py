@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+# UI flush policy: push an update once this many seconds passed since the last
+# one, or once this many deltas are buffered, whichever comes first. The first
+# delta of a response is always pushed right away.
+flush_interval = 0.05
+flush_tokens = 32
+
+# "full" yields the accumulated response (what gr.ChatInterface expects),
+# "delta" yields only the text added since the previous update
+output_mode = "full"
+
+async def coalesce(deltas, interval=None, max_tokens=None, mode=None):
+    """Batches a stream of content deltas into fewer UI updates.
+
+    Args:
+    deltas: Async iterator of content strings, e.g. backend.stream_chat().
+    interval: Maximum time in seconds buffered text is held back, None for the module default, 0 to disable.
+    max_tokens: Maximum number of buffered deltas, None for the module default, 0 to disable.
+    mode: "full" or "delta", None for the module default.
+
+    Yields:
+    The full response so far, or the new text only in "delta" mode.
+    """
+    interval = flush_interval if interval is None else interval
+    max_tokens = flush_tokens if max_tokens is None else max_tokens
+    mode = mode or output_mode
+
+    full_content = ""
+    buffer = []
+    last_flush = 0.0
+    first = True
+
+    def flush():
+        nonlocal full_content, last_flush
+        text = "".join(buffer)
+        buffer.clear()
+        full_content += text
+        last_flush = time.monotonic()
+        return full_content if mode == "full" else text
+
+    iterator = deltas.__aiter__()
+    next_delta = None
+    try:
+        while True:
+            if next_delta is None:
+                next_delta = asyncio.ensure_future(iterator.__anext__())
+
+            if buffer and interval:
+                # wake up when the window closes even if the backend goes quiet
+                timeout = max(0.0, last_flush + interval - time.monotonic())
+                done, _ = await asyncio.wait({next_delta}, timeout=timeout)
+                if not done:
+                    yield flush()
+                    continue
+            else:
+                await asyncio.wait({next_delta})
+
+            try:
+                content = next_delta.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                next_delta = None
+
+            buffer.append(content)
+            if (first or not interval and not max_tokens
+                    or max_tokens and len(buffer) >= max_tokens
+                    or interval and time.monotonic() - last_flush >= interval):
+                first = False
+                yield flush()
+
+        if buffer:
+            yield flush()
+    finally:
+        # tear the upstream stream down now rather than whenever it is garbage
+        # collected, so the backend stops generating for a reader that left
+        if next_delta is not None:
+            next_delta.cancel()
+            await asyncio.wait({next_delta})
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
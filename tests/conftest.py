@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GRADIO_ANALYTICS_ENABLED", "False")
+
+from benchmarks.stub_server import StubConfig, start_stub_server
+
+@pytest.fixture
+def stub(monkeypatch):
+    """A stub FastMLX server that backend.py sends requests to; its config can be changed per test."""
+    import backend
+
+    server = start_stub_server(StubConfig(ttft=0.05, rate=200.0, tokens=20))
+    monkeypatch.setattr(backend, "backend_urls", [server.url])
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,204 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+import backend
+from benchmarks.stub_server import StubConfig, start_stub_server
+
+MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct"
+
+def payload(i=0, max_tokens=20):
+    return {"model": MODEL, "messages": [{"role": "user", "content": f"request {i}"}], "max_tokens": max_tokens}
+
+async def complete(i=0, max_tokens=20) -> str:
+    return "".join([content async for content in backend.stream_chat(payload(i, max_tokens))])
+
+def test_concurrent_streams_reuse_connections(stub):
+    stub.config.ttft = 0.3
+    streams = 16
+
+    async def run():
+        try:
+            start = time.monotonic()
+            first = await asyncio.gather(*[complete(i) for i in range(streams)])
+            elapsed = time.monotonic() - start
+            second = await asyncio.gather(*[complete(i) for i in range(streams)])
+            return first + second, elapsed
+        finally:
+            await backend.aclose_client()
+
+    results, elapsed = asyncio.run(run())
+    stats = stub.stats.snapshot()
+
+    assert all(text == "".join(f"tok{i} " for i in range(20)) for text in results)
+    # all streams were open at once, not one after another
+    assert stats["max_active_streams"] == streams
+    assert elapsed < 0.3 * streams / 2
+    # the second round went over the connections of the first
+    assert stats["requests"] == 2 * streams
+    assert stats["connections"] == streams
+
+def test_gradio_runs_chats_concurrently(stub):
+    from gradio_client import Client
+
+    import app
+
+    stub.config.ttft = 0.5
+    chats = 4
+    # Gradio's queue makes its locks only if this thread has an event loop, which asyncio.run() unsets
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    _, url, _ = app.launch(prevent_thread_lock=True, quiet=True)
+    try:
+        def chat(i, results):
+            job = Client(url, verbose=False).submit({"text": f"question {i}", "files": []},
+                                                    "You are a helpful assistant.", 0, 20, MODEL, api_name="/chat")
+            results[i] = job.result()
+
+        results = {}
+        threads = [threading.Thread(target=chat, args=(i, results)) for i in range(chats)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+    finally:
+        app.get_demo().close()
+
+    assert len(results) == chats
+    assert stub.stats.snapshot()["max_active_streams"] == chats
+
+def wait_for_stop(stub, timeout=2.0) -> int:
+    """Waits until the stub stops sending tokens; returns how many it sent in all."""
+    deadline = time.monotonic() + timeout
+    sent = stub.stats.snapshot()["tokens_sent"]
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        now = stub.stats.snapshot()["tokens_sent"]
+        if now == sent:
+            return sent
+        sent = now
+    raise AssertionError("the stub kept generating")
+
+def test_aclose_stops_generation(stub):
+    stub.config.rate = 200.0
+    stub.config.tokens = 2000
+
+    async def run():
+        try:
+            stream = backend.stream_chat(payload(max_tokens=2000))
+            received = [await stream.__anext__() for _ in range(10)]
+            await stream.aclose()
+            return len(received), stub.stats.snapshot()["tokens_sent"]
+        finally:
+            await backend.aclose_client()
+
+    received, sent_at_close = asyncio.run(run())
+    sent = wait_for_stop(stub)
+
+    assert received == 10
+    assert stub.stats.snapshot()["disconnects"] == 1
+    # a few tokens in flight when the connection closed, not the remaining 1990
+    assert sent - sent_at_close < 50
+
+def test_cancel_stops_generation(stub):
+    stub.config.rate = 200.0
+    stub.config.tokens = 2000
+
+    async def run():
+        received = []
+
+        async def read():
+            async for content in backend.stream_chat(payload(max_tokens=2000)):
+                received.append(content)
+
+        try:
+            task = asyncio.create_task(read())
+            while len(received) < 10:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            return stub.stats.snapshot()["tokens_sent"]
+        finally:
+            await backend.aclose_client()
+
+    sent_at_cancel = asyncio.run(run())
+    sent = wait_for_stop(stub)
+
+    assert stub.stats.snapshot()["disconnects"] == 1
+    assert sent - sent_at_cancel < 50
+
+@pytest.fixture
+def other_stub():
+    server = start_stub_server(StubConfig(ttft=0.05, rate=200.0, tokens=20))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def unused_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+def run_with_pool(coro):
+    async def run():
+        try:
+            return await coro()
+        finally:
+            await backend.aclose_client()
+    return asyncio.run(run())
+
+def test_unreachable_backend_fails_over(stub, monkeypatch):
+    dead = unused_url()
+    monkeypatch.setattr(backend, "backend_urls", [dead, stub.url])
+
+    text = run_with_pool(complete)
+
+    assert text == "".join(f"tok{i} " for i in range(20))
+    endpoints = {endpoint.url: endpoint for endpoint in backend.get_pool().endpoints}
+    assert not endpoints[dead].healthy and endpoints[stub.url].healthy
+
+def test_failing_backend_is_marked_unhealthy(stub, other_stub, monkeypatch):
+    stub.config.status = 503
+    monkeypatch.setattr(backend, "backend_urls", [stub.url, other_stub.url])
+
+    text = run_with_pool(complete)
+
+    assert text
+    assert stub.stats.snapshot()["requests"] == 1
+    assert other_stub.stats.snapshot()["requests"] == 1
+    endpoints = backend.get_pool().endpoints
+    assert [endpoint.healthy for endpoint in endpoints] == [False, True]
+
+def test_requests_go_where_the_model_is_loaded(stub, other_stub, monkeypatch):
+    stub.config.models = ["google/gemma-2-9b-it"]
+    monkeypatch.setattr(backend, "backend_urls", [stub.url, other_stub.url])
+
+    async def run():
+        await backend.get_pool().check_all()
+        return backend.get_pool().select(MODEL), await complete()
+
+    ranked, text = run_with_pool(run)
+
+    assert [endpoint.url for endpoint in ranked] == [other_stub.url, stub.url]
+    assert text
+    # the first try went to the backend with the model, not through a 404 from the other
+    assert stub.stats.snapshot()["requests"] == 0
+
+def test_busy_backends_are_reported_as_busy(stub):
+    async def run():
+        endpoint = backend.get_pool().endpoints[0]
+        endpoint.inflight = 1
+        try:
+            async for _ in backend.stream_chat(payload(), limit=1):
+                pass
+        finally:
+            endpoint.inflight = 0
+
+    with pytest.raises(backend.BackendError, match="busy"):
+        run_with_pool(run)
+    assert stub.stats.snapshot()["requests"] == 0
@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+import batch
+
+def run(tmp_path, lines, *extra):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text("".join(line + "\n" for line in lines))
+    output = tmp_path / "results.jsonl"
+    summary = asyncio.run(batch.run(batch.parse_args([str(path), str(output), "--quiet", *extra])))
+    with open(output) as f:
+        return summary, [json.loads(line) for line in f if line.endswith("}\n")]
+
+def test_failures_stay_with_their_items(stub, tmp_path):
+    summary, results = run(tmp_path, [
+        '"just a prompt"',
+        '{"id": "a", "prompt": "hi", "temperature": null}',
+        '{"id": "b", "prompt": "hi", "history": [["hello", "hi there"]], "max_tokens": 5}',
+        '[1, 2]',
+        '{"id": "c", "prompt": "hi", "history": 5}',
+        '{"id": "d", "prompt": "hi", "temperature": "warm"}',
+        '{"id": "e", "prompt": "hi", "model": "unknown/model"}',
+        'not json',
+    ])
+
+    by_id = {result["id"]: result for result in results}
+    assert summary["completed"] == 3 and summary["failed"] == 5
+    assert by_id[1]["response"] and by_id[1]["error"] is None
+    assert by_id["a"]["error"] is None
+    assert by_id["b"]["chunks"] == 5
+    for failed in (4, "c", "d", "e", 8):
+        assert by_id[failed]["error"]
+
+def test_resumes_and_retries_failed_items(stub, tmp_path):
+    lines = [json.dumps({"id": i, "prompt": f"prompt {i}"}) for i in range(6)]
+    (tmp_path / "results.jsonl").write_text(
+        json.dumps({"id": 0, "response": "done before", "error": None}) + "\n"
+        + json.dumps({"id": 1, "response": None, "error": "BackendError: gone"}) + "\n"
+        # cut short when the previous run was killed
+        + '{"id": 2, "resp')
+
+    summary, results = run(tmp_path, lines)
+
+    assert summary["skipped"] == 1 and summary["completed"] == 5
+    assert sorted(result["id"] for result in results[2:]) == [1, 2, 3, 4, 5]
+    assert stub.stats.snapshot()["requests"] == 5
+
+    # a complete output: nothing is run again
+    summary, _ = run(tmp_path, lines)
+    assert summary["skipped"] == 6 and summary["completed"] == 0
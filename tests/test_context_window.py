@@ -0,0 +1,63 @@
+import context_window
+
+MODEL = "google/gemma-2-9b-it"
+
+def prompt_tokens(messages) -> int:
+    return sum(context_window.estimate_message_tokens(msg, MODEL) for msg in messages)
+
+def conversation(turns, chars):
+    messages = [{"role": "system", "content": "Be brief."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "q" * chars})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "a" * chars})
+    return messages + [{"role": "user", "content": "last question"}]
+
+def test_prompt_within_budget_is_unchanged():
+    messages = conversation(2, 100)
+    fitted, report = context_window.fit_messages(messages, MODEL, 512)
+    assert fitted is messages
+    assert report["trimmed_tokens"] == 0
+
+def test_oldest_turns_are_dropped_to_fit():
+    messages = conversation(40, 2000)
+    budget = context_window.prompt_budget(MODEL, 512)
+    assert prompt_tokens(messages) > budget
+
+    fitted, report = context_window.fit_messages(messages, MODEL, 512)
+
+    assert prompt_tokens(fitted) <= budget
+    assert report["prompt_tokens"] == prompt_tokens(fitted)
+    assert fitted[0] == messages[0] and fitted[-1] == messages[-1]
+    # whole turns go, oldest first: the newest ones are kept in order
+    assert fitted[1:-1] == messages[len(messages) - len(fitted) + 1:-1]
+    assert fitted[1]["role"] == "user"
+    assert report["dropped_messages"] == len(messages) - len(fitted)
+
+def test_oversized_messages_are_truncated_before_turns_are_dropped():
+    messages = conversation(2, 100)
+    messages[1] = {"role": "user", "content": "x" * 100000}
+
+    fitted, report = context_window.fit_messages(messages, MODEL, 512)
+
+    assert len(fitted) == len(messages) and report["dropped_messages"] == 0
+    assert report["truncated_messages"] == 1
+    assert "tokens omitted" in fitted[1]["content"]
+    assert prompt_tokens(fitted) <= context_window.prompt_budget(MODEL, 512)
+
+def test_oversized_last_message_is_truncated_as_a_last_resort():
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "y" * 100000}]
+
+    fitted, _ = context_window.fit_messages(messages, MODEL, 512)
+
+    assert fitted[0] == messages[0]
+    assert fitted[1]["content"].startswith("y") and fitted[1]["content"].endswith("y")
+    assert prompt_tokens(fitted) <= context_window.prompt_budget(MODEL, 512)
+
+def test_merged_system_prompt_moves_to_the_first_remaining_turn():
+    messages = conversation(40, 2000)[1:]
+    messages[0] = dict(messages[0], content="Be brief.\n" + messages[0]["content"])
+
+    fitted, _ = context_window.fit_messages(messages, MODEL, 512, keep_prefix="Be brief.\n")
+
+    assert fitted[0]["role"] == "user" and fitted[0]["content"].startswith("Be brief.\nquestion")
+    assert fitted[0] != messages[0]
@@ -0,0 +1,70 @@
+import io
+import zipfile
+
+import pytest
+
+import doc2json
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+R = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+CORE = ('<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties"'
+        ' xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>Corpus</dc:title><dc:creator>Test</dc:creator>'
+        '</cp:coreProperties>')
+
+PARAGRAPH = ('<w:p w:rsidR="00A1" w14:paraId="1A" xmlns:w14="http://schemas.microsoft.com/office/word/2010/wordml">'
+             '<w:pPr><w:pStyle w:val="Heading1"/><w:spacing w:after="0"/></w:pPr>'
+             '<w:r><w:rPr><w:rFonts w:ascii="Arial" w:hAnsi="Consolas"/><w:b/></w:rPr><w:t>Paragraph {0}</w:t></w:r>'
+             '<w:proofErr w:type="spellStart"/><w:r><w:t xml:space="preserve"> with more text </w:t></w:r></w:p>')
+HIGHLIGHT = '<w:p><w:r><w:rPr><w:highlight w:val="yellow"/><w:i/></w:rPr><w:t>Marked</w:t></w:r></w:p>'
+TABLE = ('<w:tbl><w:tblPr><w:tblStyle w:val="Grid"/></w:tblPr>'
+         '<w:tr><w:tc><w:p><w:r><w:t>a1</w:t></w:r></w:p></w:tc><w:tc><w:p><w:r><w:t>b1</w:t></w:r></w:p></w:tc></w:tr>'
+         '<w:tr><w:tc><w:tbl><w:tr><w:tc><w:p><w:r><w:t>nested</w:t></w:r></w:p></w:tc></w:tr></w:tbl></w:tc></w:tr>'
+         '</w:tbl>')
+LINK = '<w:p><w:hyperlink r:id="rId5"><w:r><w:t>link</w:t></w:r></w:hyperlink><w:del><w:r><w:delText>gone</w:delText></w:r></w:del></w:p>'
+LIST = '<w:p><w:pPr><w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr></w:pPr><w:r><w:t>item</w:t></w:r></w:p>'
+SECTION = '<w:sectPr><w:pgMar w:top="1440"/></w:sectPr>'
+
+# document.xml content below w:document, and attributes of w:document
+CORPUS = {
+    "one_paragraph": (f"<w:body>{PARAGRAPH.format(1)}</w:body>", ""),
+    "many_paragraphs": (f"<w:body>{''.join(PARAGRAPH.format(i) for i in range(500))}{SECTION}</w:body>", ""),
+    "mixed": (f"<w:body>{PARAGRAPH.format(1)}{TABLE}{HIGHLIGHT}{LINK}{LIST}{LIST}{TABLE}{SECTION}</w:body>", ""),
+    "single_table": (f"<w:body>{TABLE}</w:body>", ""),
+    "two_bodies": (f"<w:body>{PARAGRAPH.format(1)}{PARAGRAPH.format(2)}</w:body>"
+                   f"<w:body>{PARAGRAPH.format(3)}{TABLE}</w:body>", ""),
+    "three_bodies": (f"<w:body>{PARAGRAPH.format(1)}</w:body><w:body>{PARAGRAPH.format(2)}{PARAGRAPH.format(3)}</w:body>"
+                     f"<w:body>{TABLE}{TABLE}</w:body>", ""),
+    "background_and_body": (f'<w:background w:color="FFFFFF"/><w:body>{PARAGRAPH.format(1)}{HIGHLIGHT}</w:body>', ""),
+    "body_attributes": (f'<w:body w:foo="1" w:rsidR="00B2">{PARAGRAPH.format(1)}</w:body>', ""),
+    "body_text": (f"<w:body>loose text {PARAGRAPH.format(1)}</w:body>", ""),
+    "empty_body": ("<w:body/>", ""),
+    "ignored_only": (f"<w:body>{SECTION}<w:proofErr/><w:bookmarkStart w:id='0'/></w:body>", ""),
+    "root_attributes": (f"<w:body>{PARAGRAPH.format(1)}</w:body>", 'w:conformance="strict"'),
+    "run_properties_above_body": ("<w:rPr><w:b/></w:rPr><w:rPr><w:highlight w:val='red'/></w:rPr>"
+                                  f"<w:body>{PARAGRAPH.format(1)}</w:body>", ""),
+    "comments_and_instructions": (f"<w:body><!-- note -->{PARAGRAPH.format(1)}<?pi x?>{PARAGRAPH.format(2)}</w:body>", ""),
+    "unicode": ('<w:body><w:p><w:r><w:t>Grüße ☃ "quoted" \\ back</w:t></w:r></w:p></w:body>', ""),
+}
+
+def write_fixture(path, name):
+    inner, root_attributes = CORPUS[name]
+    with zipfile.ZipFile(path, "w") as docx:
+        docx.writestr("docProps/core.xml", CORE)
+        docx.writestr("word/document.xml", f'<?xml version="1.0" encoding="UTF-8"?>'
+                                           f'<w:document {W} {R} {root_attributes}>{inner}</w:document>')
+    return str(path)
+
+@pytest.mark.parametrize("name", sorted(CORPUS))
+@pytest.mark.parametrize("compact", [False, True])
+def test_streaming_conversion_matches_whole_tree(tmp_path, name, compact):
+    path = write_fixture(tmp_path / f"{name}.docx", name)
+    out = io.StringIO()
+    doc2json.convert_docx(path, out, compact=compact)
+    assert out.getvalue() == doc2json.convert_docx_tree(path, compact=compact)
+
+def test_spooled_to_disk(tmp_path, monkeypatch):
+    # small batches and spools, so parts are serialized in several batches and spill to files
+    monkeypatch.setattr(doc2json, "serialize_batch", 3)
+    monkeypatch.setattr(doc2json, "spool_max_memory", 256)
+    for name in ("many_paragraphs", "three_bodies", "mixed"):
+        assert doc2json.check_docx(write_fixture(tmp_path / f"{name}.docx", name)) == []
@@ -0,0 +1,95 @@
+import gzip
+import os
+import time
+
+import pytest
+
+import history_io
+import upload_store
+
+HEADER = '{"format": "mlx_chat_history", "version": 2, "system_prompt": ""}\n'
+
+@pytest.fixture(autouse=True)
+def dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_io, "import_dir", str(tmp_path / "imported"))
+    monkeypatch.setattr(history_io, "export_dir", str(tmp_path / "exports"))
+    monkeypatch.setattr(upload_store, "store_dir", str(tmp_path / "uploads"))
+
+def test_round_trip(tmp_path):
+    attachment = tmp_path / "notes.txt"
+    attachment.write_text("some notes")
+    history = [[(str(attachment),), None], ["hi", "hello"]]
+
+    path = history_io.export_history(history, "be brief")
+    restored, system_prompt = history_io.read_history(path)
+
+    assert system_prompt == "be brief"
+    assert restored[1] == ["hi", "hello"]
+    with open(restored[0][0][0]) as f:
+        assert f.read() == "some notes"
+
+@pytest.mark.parametrize("content", [
+    HEADER + "[1, 2]\n",
+    HEADER + '"text"\n',
+    HEADER + '{"file": "notes.txt"}\n',
+    HEADER + '{"file": {"sha256": 1, "name": ["a"], "data": 2}}\n{"turn": 1}\n',
+    HEADER + '{"turn": [{"sha256": ["a"]}, "hi"]}\n',
+    HEADER + '{"turn": ["only one"]}\n',
+    HEADER + '{"turn": []}\n',
+    HEADER + '{"turn": [1, "x"]}\n',
+    HEADER + '{"turn": ["hi", "hello", "x"]}\n',
+    '{"format": "mlx_chat_history", "version": 2, "system_prompt": ["x"]}\n',
+    '{"format": "mlx_chat_history", "version": "2"}\n',
+    '{"history": [1, 2]}',
+    '{"history": "hi"}',
+    '{"history": [["a"], [1, 2, 3]]}',
+    '{"history": [["a", "b"]], "system_prompt": 5}',
+    '[["a", 1]]',
+])
+def test_malformed_files_raise_value_error(tmp_path, content):
+    path = tmp_path / "history.ndjson"
+    path.write_text(content)
+    with pytest.raises(ValueError):
+        history_io.read_history(str(path))
+
+def test_only_embedded_attachments_are_restored(tmp_path):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("someone else's upload")
+    # another user's upload, and an earlier import of it
+    digest = upload_store.get_store().add(str(secret))
+    history_io.read_history(history_io.export_history([[(str(secret),), None]], ""))
+
+    path = tmp_path / "history.ndjson"
+    path.write_text(HEADER + '{"file": {"sha256": "%s", "name": "secret.txt", "size": 21}}\n'
+                    '{"turn": [{"sha256": "%s", "name": "secret.txt"}, null]}\n' % (digest, digest))
+    history, _ = history_io.read_history(str(path))
+
+    assert history == [[history_io.missing_note.format(name="secret.txt"), None]]
+
+def test_corrupt_gzip_raises_value_error(tmp_path):
+    data = gzip.compress((HEADER + '{"turn": ["hi", "hello"]}\n' * 100).encode())
+    truncated = tmp_path / "truncated.ndjson.gz"
+    truncated.write_bytes(data[:len(data) // 2])
+    garbled = tmp_path / "garbled.ndjson.gz"
+    garbled.write_bytes(data[:10] + b"\xff" * 20 + data[30:])
+
+    for path in (truncated, garbled):
+        with pytest.raises(ValueError):
+            history_io.read_history(str(path))
+
+def test_old_imports_and_exports_are_removed(tmp_path):
+    attachment = tmp_path / "notes.txt"
+    attachment.write_text("some notes")
+    first = history_io.export_history([[(str(attachment),), None]], "")
+    imported = os.path.dirname(history_io.read_history(first)[0][0][0][0])
+    assert os.path.isdir(imported)
+
+    old = time.time() - history_io.import_max_age - 60
+    os.utime(imported, (old, old))
+    os.utime(os.path.dirname(first), (old, old))
+    second = history_io.export_history([["hi", "hello"]], "")
+    history_io.read_history(second)
+
+    assert not os.path.exists(imported)
+    assert not os.path.exists(os.path.dirname(first))
+    assert os.path.exists(second)
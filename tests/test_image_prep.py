@@ -0,0 +1,81 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+import image_prep
+import upload_store
+
+SMALL_MODEL = "mlx-community/llava-1.5-7b-4bit"
+
+def png(size, mode="RGB") -> bytes:
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 100, 50, 128) if mode == "RGBA" else (200, 100, 50)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def decode(url: str) -> Image.Image:
+    _, data = url.split(",", 1)
+    return Image.open(io.BytesIO(base64.b64decode(data)))
+
+def test_large_images_are_downscaled():
+    url = image_prep.prepare(png((2000, 1000)), max_side=1024)
+
+    assert url.startswith("data:image/jpeg;base64,")
+    assert decode(url).size == (1024, 512)
+
+def test_small_images_pass_through_unchanged():
+    data = png((300, 200))
+    assert image_prep.prepare(data, max_side=1024) == image_prep.data_url(data, "png")
+
+def test_transparent_images_are_flattened_for_jpeg():
+    image = decode(image_prep.prepare(png((2000, 2000), "RGBA"), max_side=500))
+    assert image.mode == "RGB" and image.size == (500, 500)
+
+def test_unknown_data_is_rejected():
+    with pytest.raises(ValueError):
+        image_prep.prepare(b"not an image")
+
+def test_cache_prepares_each_image_once_per_size(tmp_path, monkeypatch):
+    calls = []
+    prepare = image_prep.prepare
+    monkeypatch.setattr(image_prep, "prepare", lambda *args: calls.append(args[1:]) or prepare(*args))
+    first = tmp_path / "a.png"
+    first.write_bytes(png((2000, 1000)))
+    # the same image uploaded again under another name
+    second = tmp_path / "b.png"
+    second.write_bytes(first.read_bytes())
+    cache = image_prep.ImageCache()
+
+    url = cache.get(str(first))
+    assert cache.get(str(second)) == url
+    assert decode(cache.get(str(first), SMALL_MODEL)).size == (672, 336)
+
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert [args[0] for args in calls] == [1024, 672]
+
+def test_prepared_images_are_kept_in_the_upload_store(tmp_path, monkeypatch):
+    store = upload_store.UploadStore(str(tmp_path / "store"))
+    path = tmp_path / "a.png"
+    path.write_bytes(png((2000, 1000)))
+    # uploads are added to the store when they are encoded, before their images are prepared
+    store.add(str(path))
+    url = image_prep.ImageCache(store=store).get(str(path))
+
+    # a new cache, as after a restart, finds the stored result
+    monkeypatch.setattr(image_prep, "prepare", lambda *args: pytest.fail("prepared again"))
+    assert image_prep.ImageCache(store=store).get(str(path)) == url
+
+def test_cache_is_bounded(tmp_path):
+    cache = image_prep.ImageCache(max_entries=2)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"{i}.png"
+        path.write_bytes(png((100 + i, 100)))
+        paths.append(str(path))
+        cache.get(paths[-1])
+
+    assert len(cache.entries) == 2
+    # the oldest was dropped
+    cache.get(paths[0])
+    assert (cache.hits, cache.misses) == (0, 4)
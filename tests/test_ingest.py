@@ -0,0 +1,71 @@
+import codecs
+
+import pytest
+
+import ingest
+
+def write(tmp_path, name, data: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+@pytest.mark.parametrize("name, data, kind", [
+    ("photo.bin", b"\x89PNG\r\n\x1a\n" + b"\x00" * 100, "image"),
+    ("photo.jpg", b"\xff\xd8\xff\xe0" + b"\x00" * 100, "image"),
+    ("paper.pdf", b"%PDF-1.7\n", "pdf"),
+    ("report.docx", b"PK\x03\x04" + b"\x00" * 100, "docx"),
+    ("archive.zip", b"PK\x03\x04" + b"\x00" * 100, "binary"),
+    ("program", b"\x7fELF\x02\x01\x01\x00", "binary"),
+    ("notes.txt", "Grüße\n".encode("utf-8"), "text"),
+    ("notes16.txt", "Grüße\n".encode("utf-16"), "text"),
+    ("empty.txt", b"", "text"),
+])
+def test_sniff(tmp_path, name, data, kind):
+    assert ingest.sniff(write(tmp_path, name, data)) == kind
+
+@pytest.mark.parametrize("data, text", [
+    ("Grüße, 世界\n".encode("utf-8"), "Grüße, 世界\n"),
+    (codecs.BOM_UTF8 + "with BOM".encode("utf-8"), "with BOM"),
+    ("wide text".encode("utf-16"), "wide text"),
+    (b"bad \xff byte", "bad � byte"),
+])
+def test_read_text_decodes(tmp_path, data, text):
+    assert ingest.read_text(write(tmp_path, "notes.txt", data)) == text
+
+def test_read_text_stops_at_the_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "read_size", 7)
+    path = write(tmp_path, "big.txt", b"0123456789" * 100)
+
+    text = ingest.read_text(path, 25)
+
+    assert text.startswith("0123456789" * 2 + "01234")
+    assert text[25:] == ingest.marker("big.txt", "25 bytes", "1000 bytes")
+    assert ingest.read_text(path, 0) == "0123456789" * 100
+
+def test_read_text_decodes_characters_split_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "read_size", 7)
+    path = write(tmp_path, "wide.txt", ("ü世" * 100).encode("utf-8"))
+    assert ingest.read_text(path, 0) == "ü世" * 100
+
+def test_read_text_drops_a_character_cut_by_the_limit(tmp_path):
+    path = write(tmp_path, "umlauts.txt", ("ab" + "ü" * 10).encode("utf-8"))
+
+    text = ingest.read_text(path, 3)
+
+    # the third byte is the first half of "ü"
+    assert text.startswith("ab") and "�" not in text
+    assert "truncated after 3 bytes of 22 bytes" in text
+
+def test_cap_text():
+    assert ingest.cap_text("short", 10, "a.txt") == "short"
+    capped = ingest.cap_text("x" * 20, 10, "a.txt")
+    assert capped == "x" * 10 + ingest.marker("a.txt", "10 characters", "20 characters")
+
+def test_char_budget_is_shared():
+    budget = ingest.CharBudget(100)
+    assert budget.reserve(60) == 60
+    assert budget.reserve(60) == 40
+    assert budget.reserve(10) == 0
+    budget.release(15)
+    assert budget.reserve(60) == 15
+    assert ingest.CharBudget(-5).reserve(1) == 0
@@ -0,0 +1,19 @@
+import metrics
+
+def test_label_values_are_escaped_and_models_bounded(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", True)
+    monkeypatch.setattr(metrics, "known_models", set())
+    counter = metrics.Counter("test_requests_total", "Test counter")
+    metrics._registry.remove(counter)
+
+    metrics.register_models(["m1"])
+    counter.inc(model="m1")
+    for i in range(100):
+        counter.inc(model=f"typed model {i}")
+    counter.inc(status='a"b\\c\nd')
+
+    lines = counter.render()[2:]
+    assert 'test_requests_total{model="m1"} 1' in lines
+    assert 'test_requests_total{model="other"} 100' in lines
+    assert 'test_requests_total{status="a\\"b\\\\c\\nd"} 1' in lines
+    assert len(lines) == 3
@@ -0,0 +1,38 @@
+import asyncio
+
+import backend
+import model_manager
+
+MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct"
+OTHER = "google/gemma-2-9b-it"
+
+def test_plan_leaves_models_in_use_loaded(stub, monkeypatch):
+    monkeypatch.setattr(model_manager, "max_loaded_models", 1)
+    monkeypatch.setattr(model_manager, "preload_models", [])
+    monkeypatch.setattr(model_manager, "unload_retry_interval", 3600.0)
+    manager = model_manager.ModelManager([stub.url])
+    payload = {"model": MODEL, "messages": [{"role": "user", "content": "hi"}], "max_tokens": 20}
+
+    async def run():
+        try:
+            stream = backend.stream_chat(payload)
+            chunks = [await stream.__anext__()]
+            # picking the other model while MODEL still streams
+            await asyncio.to_thread(manager.plan, OTHER)
+            chunks.extend([content async for content in stream])
+            return chunks
+        finally:
+            await backend.aclose_client()
+
+    chunks = asyncio.run(run())
+    try:
+        assert len(chunks) == 20
+        assert MODEL in stub.config.models
+        assert manager.retry is not None
+
+        # once the stream is done, the next plan unloads it
+        manager.plan(OTHER)
+        assert stub.config.models == [OTHER]
+    finally:
+        manager.retry.cancel()
+        manager.executor.shutdown()
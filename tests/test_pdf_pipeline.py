@@ -0,0 +1,51 @@
+import pytest
+
+import pdf_pipeline
+
+def make_pdf(path, pages):
+    """A PDF whose pages have a text layer where pages[i] is text, and are blank (image only) where it is None."""
+    import fitz
+
+    pdf = fitz.open()
+    for text in pages:
+        page = pdf.new_page()
+        if text:
+            page.insert_text((72, 72), text)
+        else:
+            page.draw_rect(fitz.Rect(50, 50, 300, 300), color=(1, 0, 0), fill=(0, 0, 1))
+    pdf.save(str(path))
+    return str(path)
+
+def kinds(results):
+    return [next(key for key in ("text", "image", "omitted") if key in result) for result in results]
+
+@pytest.fixture
+def pdf(tmp_path):
+    return make_pdf(tmp_path / "doc.pdf", ["page one has some text", None, None, "page four has some text", None])
+
+def test_pages_are_not_rendered_unless_requested(pdf, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("rendered")
+
+    monkeypatch.setattr(pdf_pipeline, "render_page", fail)
+    monkeypatch.setattr(pdf_pipeline, "get_pool", fail)
+    results = list(pdf_pipeline.iter_pdf(pdf, render=False))
+    assert kinds(results) == ["text", "omitted", "omitted", "text", "omitted"]
+    assert [r["page"] for r in results] == [1, 2, 3, 4, 5]
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_image_count_and_bytes_are_capped(pdf, monkeypatch, workers):
+    monkeypatch.setattr(pdf_pipeline, "max_images", 2)
+    assert kinds(pdf_pipeline.iter_pdf(pdf, workers=workers)) == ["text", "image", "image", "text", "omitted"]
+
+    monkeypatch.setattr(pdf_pipeline, "max_images", 20)
+    one_image = len(next(r["image"] for r in pdf_pipeline.iter_pdf(pdf, workers=1) if "image" in r))
+    monkeypatch.setattr(pdf_pipeline, "max_image_bytes", one_image + 1)
+    assert kinds(pdf_pipeline.iter_pdf(pdf, workers=workers)) == ["text", "image", "omitted", "text", "omitted"]
+
+def test_pages_past_the_limit_are_not_read(pdf, monkeypatch):
+    monkeypatch.setattr(pdf_pipeline, "max_pages", 2)
+    results = list(pdf_pipeline.iter_pdf(pdf, render=False))
+    assert kinds(results) == ["text", "omitted", "omitted"]
+    assert results[-1]["page"] == 3
+    assert "2 selected pages after it" in results[-1]["omitted"]
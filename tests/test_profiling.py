@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import profiling
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "profile_dir", str(tmp_path))
+    monkeypatch.setattr(profiling, "sample_rate", 1.0)
+    return tmp_path
+
+def busy_function(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+def profile_busy_thread(seconds=0.2, **tags) -> str:
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_function, args=(stop,), name="worker")
+    worker.start()
+    try:
+        profile = profiling.begin("some/model")
+        time.sleep(seconds)
+        return profile.finish(**tags)
+    finally:
+        stop.set()
+        worker.join()
+
+def wait_for_sampler_to_stop():
+    for _ in range(100):
+        if profiling._sampler is None:
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_requests_are_sampled_at_the_rate(monkeypatch):
+    monkeypatch.setattr(profiling, "sample_rate", 0.0)
+    assert profiling.begin("some/model") is None
+    assert profiling._sampler is None
+
+def test_profile_is_written_as_collapsed_stacks_and_speedscope(profile_dir):
+    path = profile_busy_thread(prompt_chars=123)
+
+    assert wait_for_sampler_to_stop()
+    with open(path) as f:
+        lines = f.read().splitlines()
+    worker = [line for line in lines if line.startswith("worker;")]
+    assert worker and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("busy_function (test_profiling.py:" in line for line in worker)
+
+    with open(path[:-len(".collapsed")] + ".speedscope.json") as f:
+        speedscope = json.load(f)
+    profiles = {profile["name"]: profile for profile in speedscope["profiles"]}
+    assert "worker" in profiles
+    frames = speedscope["shared"]["frames"]
+    assert all(index < len(frames) for sample in profiles["worker"]["samples"] for index in sample)
+    assert "prompt_chars=123" in speedscope["name"]
+
+    with open(profile_dir / "profiles.jsonl") as f:
+        entry = json.loads(f.readline())
+    assert entry["file"] == os.path.basename(path)[:-len(".collapsed")]
+    assert entry["model"] == "some/model" and entry["prompt_chars"] == 123 and entry["samples"] > 0
+
+def test_old_profiles_are_removed(profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, "max_profiles", 2)
+    paths = [profile_busy_thread(0.02) for _ in range(3)]
+
+    assert sorted(p.name for p in profile_dir.glob("*.collapsed")) == sorted(os.path.basename(p) for p in paths[1:])
+    assert len(list(profile_dir.glob("*.speedscope.json"))) == 2
+    assert wait_for_sampler_to_stop()
+
+def test_rate_is_set_through_the_admin_route():
+    assert profiling.admin("POST", {"rate": ["0.25"]})["rate"] == 0.25
+    assert profiling.admin("POST", {"rate": ["7"]})["rate"] == 1.0
+    assert profiling.admin("GET", {})["active"] == 0
@@ -0,0 +1,54 @@
+import ingest
+import prompt_builder
+
+MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct"
+
+def attachment_text(payload) -> int:
+    return sum(message["content"].count("q") for message in payload["messages"])
+
+def write_files(tmp_path, count, size):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"notes{i}.txt"
+        path.write_text("q" * size)
+        paths.append(str(path))
+    return paths
+
+def test_one_budget_covers_history_and_new_files(tmp_path, monkeypatch):
+    import app
+
+    monkeypatch.setattr(ingest, "max_request_chars", 1000)
+    reads = []
+    read_text = ingest.read_text
+    monkeypatch.setattr(ingest, "read_text", lambda fn, max_bytes=None: reads.append(max_bytes) or read_text(fn, max_bytes))
+    attachments = prompt_builder.AttachmentCache(app.encode_file)
+    paths = write_files(tmp_path, 4, 400)
+    history = [[(paths[0],), None], ["first", "ok"], [(paths[1],), None], ["second", "ok"]]
+    message = {"text": "third", "files": [{"path": paths[2]}, {"path": paths[3]}]}
+
+    payload, _ = prompt_builder.prepare_request(prompt_builder.PromptState(), message, history, "", 0.5, 100,
+                                                MODEL, attachments)
+
+    # the files are read concurrently, so which of them the budget cuts short depends on timing
+    assert 0 < attachment_text(payload) <= 1000
+    assert "truncated after" in payload["messages"][-1]["content"]
+    # no file was read past what was left of the budget
+    assert sum(reads) <= 1000
+    # the file cut short by the budget is not cached as its encoding
+    assert attachments.get(paths[2])["text"] == "q" * 400
+
+def test_budget_carries_over_to_later_turns(tmp_path, monkeypatch):
+    import app
+
+    monkeypatch.setattr(ingest, "max_request_chars", 1000)
+    attachments = prompt_builder.AttachmentCache(app.encode_file)
+    state = prompt_builder.PromptState()
+    paths = write_files(tmp_path, 2, 700)
+    history = []
+
+    for path in paths:
+        message = {"text": "next", "files": [{"path": path}]}
+        payload, _ = prompt_builder.prepare_request(state, message, history, "", 0.5, 100, MODEL, attachments)
+        history = history + [[(path,), None], ["next", "ok"]]
+
+    assert attachment_text(payload) == 1000
@@ -0,0 +1,51 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+import backend
+import response_cache
+
+MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct"
+
+def read(payload) -> str:
+    async def run():
+        try:
+            return "".join([content async for content in response_cache.cached_stream(payload, backend.stream_chat)])
+        finally:
+            await backend.aclose_client()
+    return asyncio.run(run())
+
+def test_only_complete_streams_are_cached(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "cache_dir", str(tmp_path))
+    payload = {"model": MODEL, "messages": [{"role": "user", "content": "hi"}], "max_tokens": 20, "temperature": 0}
+    key = response_cache.request_key(payload)
+
+    stub.config.done_marker = False
+    with pytest.raises(backend.BackendError):
+        read(payload)
+    assert response_cache.get(key) is None
+
+    stub.config.done_marker = True
+    text = read(payload)
+    assert "".join(response_cache.get(key)) == text
+    assert stub.stats.snapshot()["requests"] == 2
+
+    # replayed without asking the backend
+    assert read(payload) == text
+    assert stub.stats.snapshot()["requests"] == 2
+
+def test_entries_expire_however_often_they_are_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "cache_dir", str(tmp_path))
+    response_cache.put("a" * 64, MODEL, ["cached"])
+    assert response_cache.get("a" * 64) == ["cached"]
+
+    # stored over a week ago, and just used
+    path = response_cache._path("a" * 64)
+    with open(path, "w") as f:
+        json.dump({"model": MODEL, "created": time.time() - response_cache.ttl - 60, "chunks": ["cached"]}, f)
+
+    assert response_cache.get("a" * 64) is None
+    assert not os.path.exists(path)
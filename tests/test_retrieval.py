@@ -0,0 +1,70 @@
+import pytest
+
+import retrieval
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, "index_dir", str(tmp_path))
+    monkeypatch.setattr(retrieval, "_memory", type(retrieval._memory)())
+
+def document(sections: dict) -> str:
+    # one section per topic, each long enough to be its own chunk
+    return "".join(f"Section about {topic}.\n" + f"{text}\n" * 60 for topic, text in sections.items())
+
+def test_chunks_overlap_at_line_boundaries():
+    text = "".join(f"line {i:04d}\n" for i in range(1000))
+    chunks = retrieval.chunk_text(text, size=200, overlap=40)
+
+    assert all(len(chunk) <= 200 and chunk.endswith("\n") for _, _, chunk in chunks)
+    assert chunks[0][0] == 1 and chunks[-1][1] == 1000
+    # consecutive chunks share lines, and together they have every line
+    for (_, last, _), (first, _, _) in zip(chunks, chunks[1:]):
+        assert first <= last
+    assert {line for first, last, _ in chunks for line in range(first, last + 1)} == set(range(1, 1001))
+
+def test_search_ranks_matching_chunks_first():
+    text = document({
+        "cooking": "Simmer the tomato sauce with garlic and basil.",
+        "rockets": "The booster separates after the main engine cutoff.",
+        "gardening": "Water the tomato plants early in the morning.",
+    })
+    index = retrieval.BM25Index.build(text)
+
+    results = index.search("main engine cutoff", 10)
+    best = index.chunks[results[0][1]][2]
+    assert "booster" in best
+    assert [score for score, _ in results] == sorted((score for score, _ in results), reverse=True)
+    # chunks without any query term are not returned
+    assert all("engine" in index.chunks[i][2] or "main" in index.chunks[i][2] for _, i in results)
+
+    # a term in fewer chunks weighs more
+    garlic = index.search("tomato garlic", 10)
+    assert "garlic" in index.chunks[garlic[0][1]][2]
+
+def test_search_returns_top_k():
+    text = document({f"topic{i}": f"shared words and topic{i} details" for i in range(20)})
+    index = retrieval.BM25Index.build(text)
+
+    assert len(index.search("shared words", 3)) == 3
+    assert len(index.search("nothing matches this", 3)) == 0
+
+def test_excerpts_select_top_k_over_documents():
+    manual = document({f"part{i}": f"assembly step {i} of the bookshelf" for i in range(10)})
+    recipes = document({f"dish{i}": f"recipe {i} with lentils" for i in range(10)})
+
+    text = retrieval.excerpts([("manual.txt", manual), ("recipes.txt", recipes)], "lentils recipe", k=2)
+
+    assert text.count("--- recipes.txt") == 2
+    # the other document still shows what it is
+    assert text.count("--- manual.txt") == 1
+    assert "[recipes.txt: 2 of" in text
+
+def test_index_is_stored_and_reused(tmp_path):
+    text = document({"a": "alpha beta", "b": "gamma delta"})
+    built = retrieval.get_index(text)
+    assert list(tmp_path.rglob("*.json.gz"))
+
+    retrieval._memory.clear()
+    loaded = retrieval.get_index(text)
+    assert loaded is not built
+    assert loaded.chunks == built.chunks and loaded.search("gamma", 2) == built.search("gamma", 2)
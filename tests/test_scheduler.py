@@ -0,0 +1,39 @@
+import asyncio
+
+import backend
+import scheduler
+from benchmarks.stub_server import StubConfig, start_stub_server
+
+MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct"
+
+def test_backend_limit_holds_per_backend(stub, monkeypatch):
+    # the second backend does not have the model, so every stream has to go to the first
+    other = start_stub_server(StubConfig(ttft=0.05, rate=200.0, tokens=20, models=["google/gemma-2-9b-it"]))
+    monkeypatch.setattr(backend, "backend_urls", [stub.url, other.url])
+    monkeypatch.setattr(scheduler, "backend_limit", 2)
+    monkeypatch.setattr(scheduler, "default_model_limit", 8)
+    stub.config.ttft = 0.2
+
+    async def run():
+        try:
+            await backend.get_pool().check_all()
+            stream = scheduler.Scheduler().stream(backend.stream_chat)
+            payload = {"model": MODEL, "messages": [{"role": "user", "content": "hi"}], "max_tokens": 20}
+
+            async def one():
+                return "".join([content async for content in stream(payload)])
+
+            return await asyncio.gather(*[one() for _ in range(6)])
+        finally:
+            await backend.aclose_client()
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        other.shutdown()
+        other.server_close()
+
+    assert len(results) == 6 and all(results)
+    assert stub.stats.snapshot()["max_active_streams"] == 2
+    assert other.stats.snapshot()["requests"] == 0
+    assert all(endpoint.inflight == 0 for endpoint in backend.get_pool().endpoints)
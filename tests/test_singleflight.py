@@ -0,0 +1,60 @@
+import asyncio
+
+import backend
+import singleflight
+
+MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct"
+PAYLOAD = {"model": MODEL, "messages": [{"role": "user", "content": "hi"}], "max_tokens": 20, "temperature": 0.7}
+TEXT = "".join(f"tok{i} " for i in range(20))
+
+def run(coro):
+    async def main():
+        try:
+            return await coro(singleflight.SingleFlight().stream(backend.stream_chat))
+        finally:
+            await backend.aclose_client()
+    return asyncio.run(main())
+
+async def read(stream, payload=PAYLOAD) -> str:
+    return "".join([content async for content in stream(payload)])
+
+def test_identical_requests_share_one_stream(stub):
+    other = dict(PAYLOAD, messages=[{"role": "user", "content": "something else"}])
+
+    results = run(lambda stream: asyncio.gather(*[read(stream) for _ in range(4)], read(stream, other)))
+
+    assert results == [TEXT] * 5
+    # one generation for the four identical requests, one for the other
+    assert stub.stats.snapshot()["requests"] == 2
+
+def test_cancelling_one_reader_leaves_the_others(stub):
+    stub.config.rate = 50.0
+
+    async def scenario(stream):
+        readers = [asyncio.create_task(read(stream)) for _ in range(3)]
+        await asyncio.sleep(0.2)
+        readers[0].cancel()
+        return await asyncio.gather(*readers[1:])
+
+    assert run(scenario) == [TEXT] * 2
+    stats = stub.stats.snapshot()
+    assert stats["requests"] == 1 and stats["disconnects"] == 0
+
+def test_generation_stops_when_every_reader_is_gone(stub):
+    stub.config.rate = 20.0
+
+    async def scenario(stream):
+        readers = [asyncio.create_task(read(stream)) for _ in range(2)]
+        await asyncio.sleep(0.2)
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        # the stub notices the closed connection at its next write
+        for _ in range(50):
+            if stub.stats.snapshot()["disconnects"]:
+                break
+            await asyncio.sleep(0.05)
+
+    run(scenario)
+    stats = stub.stats.snapshot()
+    assert stats["disconnects"] == 1 and stats["tokens_sent"] < 20
@@ -0,0 +1,54 @@
+import hashlib
+import os
+
+import upload_store
+
+def upload(tmp_path, name, content: bytes) -> str:
+    path = tmp_path / "uploads" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+def test_identical_uploads_share_one_blob(tmp_path):
+    store = upload_store.UploadStore(str(tmp_path / "store"))
+    first = upload(tmp_path, "a.txt", b"same content")
+    second = upload(tmp_path, "b.txt", b"same content")
+
+    digest = store.add(first)
+    assert store.add(second) == digest == hashlib.sha256(b"same content").hexdigest()
+
+    blob = store.blob_path(digest)
+    assert os.path.samefile(first, blob) and os.path.samefile(second, blob)
+    assert os.stat(blob).st_nlink == 3
+    assert store.stats()["entries"] == 1
+
+def test_least_recently_used_entries_are_evicted_at_the_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_store, "touch_interval", 0)
+    store = upload_store.UploadStore(str(tmp_path / "store"), quota=250)
+    digests = [store.add(upload(tmp_path, f"{i}.txt", bytes([i]) * 100)) for i in range(2)]
+    # the first is used again, so the second is the least recently used
+    store.touch(digests[0])
+
+    digests.append(store.add(upload(tmp_path, "2.txt", bytes([2]) * 100)))
+
+    assert store.stats() == {"entries": 2, "bytes": 200, "quota": 250}
+    assert os.path.exists(store.blob_path(digests[0]))
+    assert not os.path.exists(os.path.dirname(store.blob_path(digests[1])))
+    assert os.path.exists(store.blob_path(digests[2]))
+
+def test_new_entry_is_kept_even_above_the_quota(tmp_path):
+    store = upload_store.UploadStore(str(tmp_path / "store"), quota=50)
+    digest = store.add(upload(tmp_path, "big.txt", b"x" * 100))
+    assert os.path.exists(store.blob_path(digest))
+
+def test_artifacts_count_toward_the_quota_and_survive_a_restart(tmp_path):
+    root = str(tmp_path / "store")
+    store = upload_store.UploadStore(root)
+    digest = store.add(upload(tmp_path, "a.txt", b"a" * 100))
+    name = upload_store.artifact_name("encoded", ["a.txt", 1])
+    store.save_artifact(digest, name, {"text": "a" * 100})
+
+    restarted = upload_store.UploadStore(root)
+    assert restarted.load_artifact(digest, name) == {"text": "a" * 100}
+    assert restarted.stats()["bytes"] == store.stats()["bytes"] > 200
+    assert upload_store.artifact_name("encoded", ["a.txt", 2]) != name
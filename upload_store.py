@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import metrics
+
+# Uploads are kept once per content hash, with what was derived from them
+# (extracted text, converted documents, rendered pages, scaled images) next to
+# them, so the same file uploaded again is neither stored nor processed twice
+enabled = os.environ.get("MLX_CHAT_UPLOAD_STORE", "1") not in ("", "0")
+store_dir = os.environ.get("MLX_CHAT_UPLOAD_DIR", os.path.expanduser("~/.cache/mlx_chat/uploads"))
+# Least recently used entries are removed above this many bytes
+quota_bytes = int(os.environ.get("MLX_CHAT_UPLOAD_QUOTA", str(2 * 1024 * 1024 * 1024)))
+
+read_size = 1024 * 1024
+# Seconds between recording uses of the same entry on disk
+touch_interval = 60.0
+# Paths whose hash is remembered, see UploadStore.digest()
+memo_entries = 4096
+
+BLOB = "blob"
+
+class UploadStore:
+    """Content-addressed store of uploaded files and their derived artifacts.
+
+    Each file is kept as store_dir/<2 hex digits>/<sha256>/blob. The upload
+    itself is replaced by a hardlink to that blob, so identical uploads share
+    one copy on disk. Entries are evicted least recently used first once the
+    store exceeds quota_bytes; an evicted entry is recreated from the next
+    upload of the same content.
+    """
+
+    def __init__(self, root=None, quota=None):
+        self.root = root or store_dir
+        self.quota = quota_bytes if quota is None else quota
+        self.lock = threading.Lock()
+        self.hashes = {}        # (path, size, mtime, inode) -> digest
+        self.index = None       # digest -> [bytes, last use], loaded on first use
+        self.total = 0
+
+    def _entry_dir(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self._entry_dir(digest), BLOB)
+
+    def _load_index(self):
+        # entries that are in use were touched; the directory mtime is their last use
+        index = {}
+        if os.path.isdir(self.root):
+            for prefix in os.scandir(self.root):
+                if not prefix.is_dir():
+                    continue
+                for entry in os.scandir(prefix.path):
+                    if not entry.is_dir():
+                        continue
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                    index[entry.name] = [size, entry.stat().st_mtime]
+        self.index = index
+        self.total = sum(size for size, _ in index.values())
+        metrics.upload_store_bytes.set(self.total)
+
+    def _stat_key(self, path: str) -> tuple:
+        st = os.stat(path)
+        return (path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def digest(self, path: str) -> str:
+        """SHA-256 of a file's contents, remembered by path, size, mtime and inode."""
+        key = self._stat_key(path)
+        with self.lock:
+            digest = self.hashes.get(key)
+        if digest is not None:
+            return digest
+
+        h = hashlib.sha256()
+        with open(path, mode="rb") as f:
+            for block in iter(lambda: f.read(read_size), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        self._remember(key, digest)
+        return digest
+
+    def _remember(self, key: tuple, digest: str):
+        with self.lock:
+            self.hashes[key] = digest
+            if len(self.hashes) > memo_entries:
+                # dicts keep insertion order: drop the oldest half
+                for old in list(self.hashes)[:memo_entries // 2]:
+                    del self.hashes[old]
+
+    def add(self, path: str) -> str:
+        """Stores the file at path unless its content is stored already.
+
+        A new file is hardlinked into the store (copied across file systems);
+        a file whose content is stored already is replaced by a hardlink to
+        the stored blob.
+
+        Returns:
+        The content digest.
+        """
+        digest = self.digest(path)
+        blob = self.blob_path(digest)
+        with self.lock:
+            if self.index is None:
+                self._load_index()
+            known = digest in self.index
+
+        if known and os.path.exists(blob):
+            if not os.path.samefile(path, blob):
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                try:
+                    os.link(blob, tmp)
+                    os.replace(tmp, path)
+                    self._remember(self._stat_key(path), digest)
+                except OSError:
+                    # another file system, or the upload directory is read-only
+                    pass
+            metrics.upload_store_files.inc(result="duplicate")
+            self.touch(digest)
+            return digest
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, blob)
+        metrics.upload_store_files.inc(result="new")
+        self._account(digest)
+        return digest
+
+    def touch(self, digest: str):
+        """Records a use of an entry, for LRU eviction."""
+        now = time.time()
+        with self.lock:
+            if self.index is None:
+                self._load_index()
+            entry = self.index.get(digest)
+            if entry is None or now - entry[1] < touch_interval:
+                return
+            entry[1] = now
+        try:
+            os.utime(self._entry_dir(digest))
+        except OSError:
+            pass
+
+    def _account(self, digest: str):
+        # re-measures an entry after it changed, then enforces the quota
+        entry_dir = self._entry_dir(digest)
+        try:
+            size = sum(f.stat().st_size for f in os.scandir(entry_dir) if f.is_file())
+        except OSError:
+            size = 0
+        with self.lock:
+            if self.index is None:
+                self._load_index()
+            old = self.index.get(digest)
+            self.total += size - (old[0] if old else 0)
+            self.index[digest] = [size, time.time()]
+            metrics.upload_store_bytes.set(self.total)
+        self.evict(keep=digest)
+
+    def evict(self, keep: str = None):
+        """Removes the least recently used entries until the store fits its quota."""
+        with self.lock:
+            if self.index is None:
+                self._load_index()
+            if self.total <= self.quota:
+                return
+            victims = []
+            for digest in sorted(self.index, key=lambda d: self.index[d][1]):
+                if self.total <= self.quota:
+                    break
+                if digest == keep:
+                    continue
+                self.total -= self.index.pop(digest)[0]
+                victims.append(digest)
+            metrics.upload_store_bytes.set(self.total)
+        for digest in victims:
+            shutil.rmtree(self._entry_dir(digest), ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(self._entry_dir(digest)))
+            except OSError:
+                # other entries share the prefix directory
+                pass
+            metrics.upload_store_evictions.inc()
+
+    def artifact_path(self, digest: str, name: str) -> str:
+        return os.path.join(self._entry_dir(digest), name)
+
+    def load_artifact(self, digest: str, name: str):
+        """Returns a stored JSON artifact of an entry, or None."""
+        try:
+            with open(self.artifact_path(digest, name), encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            metrics.upload_store_artifacts.inc(result="miss")
+            return None
+        metrics.upload_store_artifacts.inc(result="hit")
+        self.touch(digest)
+        return value
+
+    def save_artifact(self, digest: str, name: str, value):
+        """Stores a JSON artifact next to an entry's blob; ignored if the entry was evicted."""
+        path = self.artifact_path(digest, name)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self._account(digest)
+
+    def stats(self) -> dict:
+        with self.lock:
+            if self.index is None:
+                self._load_index()
+            return {"entries": len(self.index), "bytes": self.total, "quota": self.quota}
+
+def artifact_name(kind: str, settings) -> str:
+    """File name of a derived artifact, distinct for every setting that changes it."""
+    key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return f"{kind}-{key}.json"
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> UploadStore:
+    """Returns the store at store_dir, or None if the store is disabled."""
+    global _store
+
+    if not enabled:
+        return None
+    with _store_lock:
+        if _store is None or _store.root != store_dir:
+            _store = UploadStore()
+        return _store